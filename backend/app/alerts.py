@@ -1,12 +1,11 @@
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
 
+from .services.email_service import email_notifier
+
 EMAIL_USER = os.getenv("EMAIL_USER", "alert.iot.capstone@gmail.com") 
 EMAIL_PASS = os.getenv("EMAIL_PASS", "fake_password_change_me")
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = 587
 
 def send_alert_email(to_email: str, subject: str, message: str):
     try:
@@ -21,12 +20,7 @@ def send_alert_email(to_email: str, subject: str, message: str):
 
         msg.attach(MIMEText(message, 'plain'))
 
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(EMAIL_USER, EMAIL_PASS)
-        text = msg.as_string()
-        server.sendmail(EMAIL_USER, to_email, text)
-        server.quit()
+        email_notifier.pool.sendmail(EMAIL_USER, to_email, msg.as_string())
         print(f"Email sent to {to_email}")
     except Exception as e:
         print(f"Failed to send email: {e}")
@@ -39,10 +39,11 @@ class ChatEngine:
 
         # 3. Status Report (REAL DB Data)
         if "status" in query or "readings" in query or "system" in query:
-            from . import database, models
-            db = database.SessionLocal()
+            from . import database
+            from .services.latest_readings import latest_readings
+            db = database.SessionLocal()  # only queried on a cold registry
             try:
-                latest = db.query(models.SensorData).order_by(models.SensorData.timestamp.desc()).first()
+                latest = latest_readings.get(db)
                 if latest:
                     return (f"Current environmental telemetry: Temperature {latest.temperature:.1f}°C, "
                             f"Humidity {latest.humidity:.1f}%, "
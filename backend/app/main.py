@@ -1,27 +1,23 @@
 import asyncio
+import json
 import logging
 import os
 from datetime import datetime as dt, timedelta, datetime
 from typing import List, Optional, Dict
 import math
 
-# Global State for Alerts
-alert_cooldowns = {}
-
-# Persistent Alert Logger
-ALERT_LOG_FILE = os.path.join(os.path.dirname(__file__), "alert_system.log")
-def log_alert_activity(message: str):
-    try:
-        with open(ALERT_LOG_FILE, "a", encoding="utf-8") as f:
-            ts = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-            f.write(f"[{ts}] {message}\n")
-    except: pass
+# Persistent Alert Logger (buffered JSON lines, see services/event_log.py)
+from .services.event_log import event_log
+def log_alert_activity(message: str, level: str = "info"):
+    event_log.log("alert", message, level)
 
 log_alert_activity("--- ALERT SYSTEM REBOOTED ---")
 # print(f"LOADING MAIN FROM {__file__}")
 
 
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.middleware.httpsredirect import HTTPSRedirectMiddleware
@@ -38,7 +34,7 @@ from .connectors.esp32_stub import ESP32StubConnector
 from .routers import assistant, auth_v2 as auth, map as map_router, pro_api, push_notifications, devices
 from .routers.push_notifications import send_push_notification_to_user
 from .services import (
-    kalman_filter as kf_instance,
+    kalman_bank,
     aqi_calculator,
     external_apis,
     fusion_engine,
@@ -47,12 +43,33 @@ from .services import (
 from . import ml_engine
 
 # Initialize ML components
-anomaly_detector = ml_engine.IoTAnomalyDetector()
-trust_calculator = ml_engine.TrustScoreCalculator()
-insight_generator = ml_engine.SmartInsightGenerator()
+anomaly_detector = ml_engine.anomaly_detector  # shared with the anomaly scorer and state checkpoints
+trust_calculator = ml_engine.trust_calculator
+insight_generator = ml_engine.insight_generator
 
 from .services.websocket_manager import manager
 from .services.api_cache import refresh_map_cache, get_cached_markers
+from .services.ingest_queue import ingest_queue
+from .services.device_registry import device_registry
+from .services.alert_worker import alert_pool
+from .services.alert_index import alert_index
+from .services.cooldown_store import cooldown_store
+from .services.historical_context import historical_service
+from .services.latest_readings import latest_readings, snapshot as latest_snapshot
+from .services.dashboard_snapshots import dashboard_snapshots
+from .services.rollups import RESOLUTIONS, rollup_store
+from .services.sensor_storage import sensor_storage
+from .services import sensor_export
+from .services import aggregation
+from .services.email_service import email_notifier
+from .services.push_dispatcher import push_dispatcher
+from .services.notification_outbox import notification_outbox
+from .services.model_retrainer import model_retrainer
+from .services.anomaly_scorer import anomaly_scorer
+from .services.state_checkpoint import state_checkpoint
+from .services.rolling_windows import rolling_windows
+from .services.quantile_sketches import quantile_sketches
+from .services.alert_digest import alert_digest, digest_content_key
 
 # --- Logging Configuration ---
 # --- Logging Configuration ---
@@ -84,20 +101,77 @@ async def startup_event():
     try:
         # 1. Database Schema
         models.Base.metadata.create_all(bind=database.engine)
+        try:
+            sensor_storage.ensure_schema(database.engine)
+        except Exception as e:
+            logger.error(f"Sensor storage schema check failed: {e}")
         
         # 2. Admin Seeding
         admin_setup.create_admin_user()
+
+        # 2a. Resume filter/ML state from the last checkpoint (devices load lazily on their next reading)
+        if state_checkpoint.enabled:
+            try:
+                state_checkpoint.restore()
+            except Exception as e:
+                logger.error(f"State checkpoint restore failed: {e}")
+
+        # 2b. Warm the device/user resolution cache, alert rule index and hourly rollups
+        db = database.SessionLocal()
+        try:
+            device_registry.load(db)
+            alert_index.refresh(db)
+            historical_service.load(db)
+            dashboard_snapshots.attach(database.SessionLocal)
+            latest_readings.load(db)
+        finally:
+            db.close()
         
         # 3. Start Background Tasks
         logger.info("Starting background services...")
         asyncio.create_task(poll_devices()) 
         asyncio.create_task(refresh_map_cache())
+        asyncio.create_task(device_registry.run_flusher(database.SessionLocal))
+        asyncio.create_task(rollup_store.run_flusher(database.SessionLocal))
+        asyncio.create_task(sensor_storage.run(database.SessionLocal))
+        alert_pool.start(run_outbox_delivery)
+        model_retrainer.start()
+        if anomaly_detector.shared is None:
+            # Cold start: fit the shared anomaly model from archived readings (no-op without the archive)
+            anomaly_detector.seed_from_archive()
+        if state_checkpoint.enabled:
+            asyncio.create_task(state_checkpoint.run())
+        asyncio.create_task(notification_outbox.run(database.SessionLocal, alert_pool))
+        if WRITE_BEHIND_ENABLED:
+            ingest_queue.start(persist_ingest_group, broadcast_ingest_group, dead_letter_ingest_items)
         
         logger.info("EcoSync Backend Initialized Successfully.")
         logger.info("Startup: Background tasks initiated (Polling Enabled)")
     except Exception as e:
         logger.error(f"Startup execution failed: {e}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flushes buffered ingestion, device status, rollups and queued alerts before the worker exits"""
+    await ingest_queue.stop()
+    await asyncio.to_thread(alert_pool.stop)
+    model_retrainer.stop()
+    db = database.SessionLocal()
+    try:
+        device_registry.flush(db)
+        rollup_store.flush(db)
+    except Exception as e:
+        logger.error(f"Flush on shutdown failed: {e}")
+    finally:
+        db.close()
+    if state_checkpoint.enabled:
+        try:
+            await asyncio.to_thread(state_checkpoint.save)
+        except Exception as e:
+            logger.error(f"State checkpoint on shutdown failed: {e}")
+    email_notifier.pool.close()
+    push_dispatcher.stop()
+    event_log.flush()
 
 
 
@@ -125,6 +199,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 # --- Security Headers ---
@@ -177,6 +252,46 @@ def get_connector(device: models.Device):
         return ESP32StubConnector(device.id, config)
     return None
 
+def store_polled_reading(dev_id: str, data: dict):
+    """Stores one polled public-API reading and stages its alerts in the same transaction (blocking)."""
+    db = database.SessionLocal()
+    try:
+        # Re-fetch dev in this session to update
+        dev = db.query(models.Device).get(dev_id)
+        if not dev:
+            return
+        dev.last_seen = dt.utcnow()
+        dev.status = data.get("status", "offline")
+
+        metrics = data.get("metrics", {})
+        if not metrics:
+            return
+        measurement = models.SensorData(
+            device_id=dev.id,
+            timestamp=dt.utcnow(),
+            temperature=metrics.get("temperatureC"),
+            humidity=metrics.get("humidityPct"),
+            pressure=metrics.get("pressureHPa"),
+            wind_speed=metrics.get("windMS"),
+            pm2_5=metrics.get("pm25")
+        )
+        snapshot = alert_snapshot(measurement)
+        sample = historical_service.sample(measurement)
+        reading = latest_snapshot(measurement)
+        db.add(measurement)
+        # Alerts are staged in the same transaction as the reading
+        claims = stage_alerts(db, dev, snapshot)
+        try:
+            db.commit()
+        except Exception:
+            release_cooldowns(claims)
+            raise
+        historical_service.record(sample)
+        latest_readings.record(reading)
+    finally:
+        db.close()
+
+
 async def poll_devices():
     """Background task to poll external APIs"""
     while True:
@@ -207,34 +322,8 @@ async def poll_devices():
                         # 3. Fetch Data (NO DB SESSION HELD)
                         data = await asyncio.to_thread(connector.fetch_data)
                         
-                        # 4. Save Data (Short Session)
-                        db = database.SessionLocal()
-                        try:
-                            # Re-fetch dev in this session to update
-                            dev = db.query(models.Device).get(dev_id)
-                            if dev:
-                                dev.last_seen = dt.utcnow()
-                                dev.status = data.get("status", "offline")
-                                
-                                metrics = data.get("metrics", {})
-                                if metrics:
-                                    measurement = models.SensorData(
-                                        device_id=dev.id,
-                                        timestamp=dt.utcnow(),
-                                        temperature=metrics.get("temperatureC"),
-                                        humidity=metrics.get("humidityPct"),
-                                        pressure=metrics.get("pressureHPa"),
-                                        wind_speed=metrics.get("windMS"),
-                                        pm2_5=metrics.get("pm25")
-                                    )
-                                    db.add(measurement)
-                                    db.commit() 
-                                    db.refresh(measurement)
-                                    
-                                    # Offload alerts
-                                    await asyncio.to_thread(check_alerts_wrapper, dev.id, measurement.id)
-                        finally:
-                            db.close()
+                        # 4. Save Data (Short Session, in a worker thread)
+                        await asyncio.to_thread(store_polled_reading, dev_id, data)
 
                 except Exception as e:
                     logger.error(f"Error polling device {dev_id}: {e}")
@@ -244,17 +333,19 @@ async def poll_devices():
         
         await asyncio.sleep(60)
 
-def check_alerts_wrapper(dev_id, measurement_id, user_email: Optional[str] = None):
-    """Wrapper to run check_alerts in a new thread with its own DB session"""
+ALERT_SNAPSHOT_FIELDS = ("timestamp", "temperature", "humidity", "pm2_5", "gas", "rain", "smart_insight")
+
+def alert_snapshot(measurement: models.SensorData) -> dict:
+    """Plain copy of the fields alert staging/delivery read (stored in the outbox payload)"""
+    snapshot = {field: getattr(measurement, field) for field in ALERT_SNAPSHOT_FIELDS}
+    snapshot["risk_level"] = getattr(measurement, "risk_level", "SAFE")
+    return snapshot
+
+def run_outbox_delivery(entry_ids: List[int], claim_token: str):
+    """Alert worker entry point: delivers claimed outbox entries with its own DB session"""
     db = database.SessionLocal()
     try:
-        dev = db.query(models.Device).get(dev_id)
-        meas = db.query(models.SensorData).get(measurement_id)
-        if dev and meas:
-             check_alerts(db, dev, meas, user_email)
-             db.commit() # Save alerts if any
-    except Exception as e:
-        logger.error(f"Async Alert Error: {e}")
+        notification_outbox.deliver(db, entry_ids, claim_token)
     finally:
         db.close()
 
@@ -281,20 +372,9 @@ def send_email_alert(subject: str, body: str, recipient: str = None):
 
         msg.attach(MIMEText(body, 'plain'))
 
-        # Connect to Gmail SMTP with timeout
-        logger.info(f"📧 Connecting to Gmail SMTP for {receiver_email}...")
-        server = smtplib.SMTP('smtp.gmail.com', 587, timeout=15)
-        server.starttls()
-        
-        # Login
-        logger.info(f"🔐 Authenticating as {sender_email}...")
-        server.login(sender_email, sender_password)
-        
-        # Send email
-        logger.info(f"📤 Sending alert email...")
-        text = msg.as_string()
-        server.sendmail(sender_email, receiver_email, text)
-        server.quit()
+        # Send over a pooled (already authenticated) SMTP session
+        logger.info(f"📤 Sending alert email to {receiver_email}...")
+        email_notifier.pool.sendmail(sender_email, receiver_email, msg.as_string())
         
         logger.info(f"Email Alert SENT successfully to {receiver_email}")
         return True
@@ -345,170 +425,277 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     return c * r
 
 
-def check_alerts(db: Session, device: models.Device, measurement: models.SensorData, user_email: Optional[str] = None):
-    """Rule-based alerting with Email Notification (Checks ALL active user settings)"""
-    
+def stage_alerts(db: Session, device, snapshot: dict, user_email: Optional[str] = None) -> list:
+    """
+    Rule-based alerting (checks ALL active user settings). Breaches are staged as Alert +
+    outbox rows on db, so they commit together with the measurement; delivery happens in
+    the outbox workers. Returns the cooldown claims to release if that commit fails.
+    """
     current_ts = dt.utcnow()
-    temp = float(measurement.temperature) if measurement.temperature is not None else 0.0
-    hum = float(measurement.humidity) if measurement.humidity is not None else 0.0
-    pm25 = float(measurement.pm2_5) if measurement.pm2_5 is not None else 0.0
-    gas = float(measurement.gas) if measurement.gas is not None else 0.0
-    rain = float(measurement.rain) if measurement.rain is not None else 4095.0
-    
-    risk_level = getattr(measurement, 'risk_level', 'SAFE')
-    smart_insight = getattr(measurement, 'smart_insight', 'Normal environment detected.')
+    temp = float(snapshot["temperature"]) if snapshot.get("temperature") is not None else 0.0
+    hum = float(snapshot["humidity"]) if snapshot.get("humidity") is not None else 0.0
+    gas = float(snapshot["gas"]) if snapshot.get("gas") is not None else 0.0
+    risk_level = snapshot.get("risk_level", "SAFE")
 
     log_alert_activity(f"CHECK: {device.id} | T:{temp}, H:{hum}, G:{gas}, Risk:{risk_level}")
 
-    # 1. Fetch ALL active alert settings
+    # 1. Find the active alert configs this reading breaches (in-memory threshold index)
     try:
-        all_settings = db.query(models.AlertSettings).filter(models.AlertSettings.is_active == True).all()
-        log_alert_activity(f"Found {len(all_settings)} active alert configs.")
+        breached_configs = alert_index.breaches(db, {"temperature": temp, "gas": gas, "humidity": hum})
     except Exception as e:
-        log_alert_activity(f"DB Error fetching settings: {e}")
-        return {"status": "error", "message": "DB Error"}
-
-    for settings in all_settings:
-        target_email = settings.user_email
-        if not target_email: continue
+        log_alert_activity(f"DB Error fetching settings: {e}", "error")
+        return []
+    if not breached_configs:
+        return []
+    log_alert_activity(f"{len(breached_configs)} of {len(alert_index)} active alert configs breached.")
+
+    claims = []
+    user_ids = device_registry.user_ids_for(db, [match["user_email"] for match in breached_configs])
+    for match in breached_configs:
+        target_email = match["user_email"]
+        limits = match["thresholds"]
 
         # Thresholds
-        T_MAX = settings.temp_threshold or 45.0
-        H_MIN = settings.humidity_min or 20.0
-        H_MAX = settings.humidity_max or 80.0
-        G_MAX = settings.gas_threshold or 2000.0
-        
+        T_MAX = limits["temp_threshold"]
+        H_MIN = limits["humidity_min"]
+        H_MAX = limits["humidity_max"]
+        G_MAX = limits["gas_threshold"]
+
         breaches = []
         if temp > T_MAX: breaches.append(f"Temperature Breach ({temp}°C > {T_MAX}°C)")
         if gas > G_MAX: breaches.append(f"Air Quality Breach ({gas} > {G_MAX})")
         if hum > H_MAX or hum < H_MIN: breaches.append(f"Humidity Out of Range ({hum}%)")
 
         # Only alert on ACTUAL threshold breaches — not just elevated risk level
-        should_alert = len(breaches) > 0
-        
-        if should_alert:
-            cooldown_key = f"{device.id}_{target_email}"
-            last_sent = alert_cooldowns.get(cooldown_key)
-            
-            if last_sent and (current_ts - last_sent) < timedelta(minutes=10):
-                remaining = int(10 - (current_ts - last_sent).total_seconds() / 60)
-                log_alert_activity(f"SKIP (Cooldown): {target_email} — next alert in {remaining} min.")
-                continue
+        if not breaches:
+            continue
+
+        user_id = user_ids.get(target_email)
+        if alert_digest.enabled:
+            # Digest mode: every breach is folded into the recipient's open digest (no cooldown)
+            metrics = {}
+            if temp > T_MAX: metrics["temperature"] = (temp, T_MAX)
+            if gas > G_MAX: metrics["gas"] = (gas, G_MAX)
+            if hum > H_MAX or hum < H_MIN: metrics["humidity"] = (hum, H_MAX if hum > H_MAX else H_MIN)
+            digest, created = alert_digest.collect(
+                db, target_email, user_id, device, metrics, snapshot.get("timestamp"), " | ".join(breaches)
+            )
+            if created and user_id and push_dispatcher.configured:
+                notification_outbox.enqueue(db, "push", {
+                    "title": f"🛡️ EcoSync Alert: {device.name}",
+                    "body": f"{' | '.join(breaches)} (digest follows)",
+                    "icon": "/favicon.ico",
+                    "badge": "/favicon.ico",
+                    "tag": "ecosync-alert-digest",
+                    "requireInteraction": True,
+                    "data": {"url": "/dashboard"},
+                }, recipient=target_email, user_id=user_id, device_id=device.id)
+            log_alert_activity(f"🧾 DIGEST {'OPENED' if created else 'UPDATED'} for {target_email} | Breaches: {breaches}")
+            continue
+
+        # Claim the cooldown slot so only one worker stages this alert; delivery retries
+        # are handled by the outbox, so the slot is kept even if sending fails later
+        cooldown_key = f"{device.id}_{target_email}"
+        if not cooldown_store.claim(cooldown_key, current_ts, db):
+            last_sent = cooldown_store.get(cooldown_key, db) or current_ts
+            remaining = int((cooldown_store.cooldown - (current_ts - last_sent)).total_seconds() / 60)
+            log_alert_activity(f"SKIP (Cooldown): {target_email} — next alert in {remaining} min.")
+            continue
+        claims.append((cooldown_key, current_ts))
+
+        metric = "temperature" if temp > T_MAX else ("gas" if gas > G_MAX else "humidity")
+        alert = models.Alert(
+            metric=metric,
+            value={"temperature": temp, "gas": gas, "humidity": hum}[metric],
+            message=" | ".join(breaches),
+            recipient_email=target_email,
+            email_sent=False,
+            timestamp=current_ts,
+            user_id=user_id,
+        )
+        db.add(alert)
+        payload = {
+            "device_id": device.id,
+            "device_name": device.name,
+            "snapshot": snapshot,
+            "thresholds": limits,
+            "breaches": breaches,
+            "triggered_at": current_ts,
+        }
+        notification_outbox.enqueue(db, "email", payload, recipient=target_email, user_id=user_id, device_id=device.id, alert=alert)
+        if user_id and push_dispatcher.configured:
+            notification_outbox.enqueue(db, "push", {
+                "title": f"🛡️ EcoSync Alert: {device.name}",
+                "body": " | ".join(breaches),
+                "icon": "/favicon.ico",
+                "badge": "/favicon.ico",
+                "tag": f"ecosync-alert-{device.id}",
+                "requireInteraction": True,
+                "data": {"url": "/dashboard"},
+            }, recipient=target_email, user_id=user_id, device_id=device.id, alert=alert)
+        log_alert_activity(f"🔥 ALERT STAGED for {target_email} | Breaches: {breaches}")
+
+    return claims
+
+
+def release_cooldowns(claims: list):
+    """
+    Gives back cooldown slots claimed by stage_alerts when their commit failed (claims made
+    in the database store were part of that transaction; releasing them again is a no-op).
+    """
+    for key, claimed_at in claims:
+        cooldown_store.release(key, claimed_at)
+
+
+def deliver_alert_email(db: Session, entry: models.NotificationOutbox, payload: dict) -> bool:
+    """Outbox handler: renders the rich alert email (with historical context) and sends it."""
+    snapshot = payload["snapshot"]
+    limits = payload["thresholds"]
+    target_email = entry.recipient
+    temp = float(snapshot["temperature"]) if snapshot.get("temperature") is not None else 0.0
+    hum = float(snapshot["humidity"]) if snapshot.get("humidity") is not None else 0.0
+    gas = float(snapshot["gas"]) if snapshot.get("gas") is not None else 0.0
+    rain = float(snapshot["rain"]) if snapshot.get("rain") is not None else 4095.0
+    smart_insight = snapshot.get("smart_insight") or "Normal environment detected."
+    T_MAX = limits["temp_threshold"]
+    H_MIN = limits["humidity_min"]
+    H_MAX = limits["humidity_max"]
+    G_MAX = limits["gas_threshold"]
+    triggered_at = datetime.fromisoformat(payload["triggered_at"])
+
+    log_alert_activity(f"📨 DELIVERING alert {entry.id} to {target_email} (attempt {(entry.attempts or 0) + 1})")
+
+    # Determine rain status from sensor value (lower = wetter)
+    rain_status = "RAINING" if rain < 1000 else ("DAMP" if rain < 2000 else "DRY")
+    rain_alert = rain < 1000  # Only alert if actively raining
+
+    alert_payload = [
+        {"metric": "Temperature", "value": f"{round(temp, 1)}°C", "limit": f"{T_MAX}°C", "status": "CRITICAL" if temp > T_MAX else "SAFE"},
+        {"metric": "Humidity", "value": f"{round(hum, 1)}%", "limit": f"{H_MAX}%", "status": "CRITICAL" if (hum > H_MAX or hum < H_MIN) else "SAFE"},
+        {"metric": "Gas Level", "value": f"{round(gas, 1)} ppm", "limit": f"{G_MAX} ppm", "status": "CRITICAL" if gas > G_MAX else "SAFE"},
+        {"metric": "Rain Sensor", "value": rain_status, "limit": "DRY", "status": "MODERATE" if rain_alert else "SAFE"},
+    ]
+
+    # --- Historical Context (hourly rollups, cached) ---
+    historical_context = historical_service.context(db, payload["device_id"], triggered_at)
+    lw_snap = historical_context["last_week"]
+    last_week_day = historical_context["last_week_day"]
+
+    # Build AI Precautions with historical context
+    precautions = []
+    if temp > T_MAX:
+        lw_note = f" Last {last_week_day} at this time it was {lw_snap['temperature']}°C." if lw_snap and lw_snap.get("temperature") else ""
+        precautions.append(f"🌡️ High Temperature ({round(temp,1)}°C): Increase ventilation, avoid direct sun exposure, check cooling systems.{lw_note}")
+    if gas > G_MAX:
+        lw_note = f" Last week gas was {lw_snap['gas']} ppm." if lw_snap and lw_snap.get("gas") else ""
+        precautions.append(f"💨 Elevated Gas ({round(gas,1)} ppm): Evacuate the area immediately, open windows, avoid ignition sources.{lw_note}")
+    if hum > H_MAX:
+        precautions.append(f"💧 High Humidity ({round(hum,1)}%): Run dehumidifiers, check for water leaks, prevent mold growth.")
+    elif hum < H_MIN:
+        precautions.append(f"🏜️ Low Humidity ({round(hum,1)}%): Use a humidifier, stay hydrated, protect sensitive equipment.")
+    if rain_alert:
+        precautions.append(f"🌧️ Rain Detected: Secure outdoor equipment, check drainage systems, avoid electrical hazards near water.")
+
+    precaution_text = " | ".join(precautions) if precautions else "No immediate action required."
+    full_insight = f"{smart_insight or 'AI Analysis complete.'}\n\n⚠️ Recommended Precautions: {precaution_text}"
+
+    success = email_notifier.send_alert(
+        recipients=[target_email],
+        device_name=payload["device_name"],
+        timestamp=triggered_at.strftime("%Y-%m-%d %H:%M:%S UTC"),
+        alert_data=alert_payload,
+        ai_insight=full_insight,
+        historical_context=historical_context,
+        dashboard_link="http://localhost:5173/dashboard",
+        title="🛡️ EcoSync Critical Alert"
+    )
 
-            log_alert_activity(f"🔥 TRIGGERING EMAIL to {target_email} | Breaches: {breaches}")
-            
-            try:
-                # Determine rain status from sensor value (lower = wetter)
-                rain_status = "RAINING" if rain < 1000 else ("DAMP" if rain < 2000 else "DRY")
-                rain_alert = rain < 1000  # Only alert if actively raining
-
-                alert_payload = [
-                    {"metric": "Temperature", "value": f"{round(temp, 1)}°C", "limit": f"{T_MAX}°C", "status": "CRITICAL" if temp > T_MAX else "SAFE"},
-                    {"metric": "Humidity", "value": f"{round(hum, 1)}%", "limit": f"{H_MAX}%", "status": "CRITICAL" if (hum > H_MAX or hum < H_MIN) else "SAFE"},
-                    {"metric": "Gas Level", "value": f"{round(gas, 1)} ppm", "limit": f"{G_MAX} ppm", "status": "CRITICAL" if gas > G_MAX else "SAFE"},
-                    {"metric": "Rain Sensor", "value": rain_status, "limit": "DRY", "status": "MODERATE" if rain_alert else "SAFE"},
-                ]
-
-                # --- Fetch Historical Context from DB ---
-                def _hist_snap(rows):
-                    if not rows: return None
-                    r = rows[0]
-                    return {
-                        "temperature": round(r.temperature, 1) if r.temperature is not None else None,
-                        "humidity": round(r.humidity, 1) if r.humidity is not None else None,
-                        "gas": round(r.gas, 1) if r.gas is not None else None,
-                        "anomaly_label": r.anomaly_label or "Normal",
-                        "smart_insight": r.smart_insight or "",
-                        "timestamp": r.timestamp.strftime("%Y-%m-%d %H:%M") if r.timestamp else "",
-                    }
-
-                lw_rows = db.query(models.SensorData).filter(
-                    models.SensorData.device_id == device.id,
-                    models.SensorData.timestamp >= current_ts - timedelta(days=7, minutes=30),
-                    models.SensorData.timestamp <= current_ts - timedelta(days=7) + timedelta(minutes=30)
-                ).order_by(models.SensorData.timestamp.desc()).limit(3).all()
-
-                yd_rows = db.query(models.SensorData).filter(
-                    models.SensorData.device_id == device.id,
-                    models.SensorData.timestamp >= current_ts - timedelta(days=1, minutes=30),
-                    models.SensorData.timestamp <= current_ts - timedelta(days=1) + timedelta(minutes=30)
-                ).order_by(models.SensorData.timestamp.desc()).limit(3).all()
-
-                week_rows = db.query(models.SensorData).filter(
-                    models.SensorData.device_id == device.id,
-                    models.SensorData.timestamp >= current_ts - timedelta(days=7)
-                ).all()
-
-                def _avg(rows, field):
-                    vals = [getattr(r, field) for r in rows if getattr(r, field) is not None]
-                    return round(sum(vals) / len(vals), 1) if vals else None
-
-                lw_snap = _hist_snap(lw_rows)
-                yd_snap = _hist_snap(yd_rows)
-                week_avg = {
-                    "temperature": _avg(week_rows, "temperature"),
-                    "humidity": _avg(week_rows, "humidity"),
-                    "gas": _avg(week_rows, "gas"),
-                }
-                last_week_day = (current_ts - timedelta(days=7)).strftime("%A")
-                time_str = current_ts.strftime("%I:%M %p")
-
-                historical_context = {
-                    "last_week": lw_snap,
-                    "yesterday": yd_snap,
-                    "week_averages": week_avg,
-                    "last_week_day": last_week_day,
-                    "time_str": time_str,
-                }
-
-                # Build AI Precautions with historical context
-                precautions = []
-                if temp > T_MAX:
-                    lw_note = f" Last {last_week_day} at this time it was {lw_snap['temperature']}°C." if lw_snap and lw_snap.get("temperature") else ""
-                    precautions.append(f"🌡️ High Temperature ({round(temp,1)}°C): Increase ventilation, avoid direct sun exposure, check cooling systems.{lw_note}")
-                if gas > G_MAX:
-                    lw_note = f" Last week gas was {lw_snap['gas']} ppm." if lw_snap and lw_snap.get("gas") else ""
-                    precautions.append(f"💨 Elevated Gas ({round(gas,1)} ppm): Evacuate the area immediately, open windows, avoid ignition sources.{lw_note}")
-                if hum > H_MAX:
-                    precautions.append(f"💧 High Humidity ({round(hum,1)}%): Run dehumidifiers, check for water leaks, prevent mold growth.")
-                elif hum < H_MIN:
-                    precautions.append(f"🏜️ Low Humidity ({round(hum,1)}%): Use a humidifier, stay hydrated, protect sensitive equipment.")
-                if rain_alert:
-                    precautions.append(f"🌧️ Rain Detected: Secure outdoor equipment, check drainage systems, avoid electrical hazards near water.")
-
-                precaution_text = " | ".join(precautions) if precautions else "No immediate action required."
-                full_insight = f"{smart_insight or 'AI Analysis complete.'}\n\n⚠️ Recommended Precautions: {precaution_text}"
-
-                from .services.email_service import email_notifier
-                success = email_notifier.send_alert(
-                    recipients=[target_email],
-                    device_name=device.name,
-                    timestamp=current_ts.strftime("%Y-%m-%d %H:%M:%S UTC"),
-                    alert_data=alert_payload,
-                    ai_insight=full_insight,
-                    historical_context=historical_context,
-                    dashboard_link="http://localhost:5173/dashboard",
-                    title="🛡️ EcoSync Critical Alert"
+    if success:
+        log_alert_activity(f"📧 SUCCESS: Email delivered to {target_email}")
+    else:
+        log_alert_activity(f"❌ SMTP FAILURE for {target_email} (will retry)", "error")
+    return success
+
+
+METRIC_LABELS = {"temperature": ("Temperature", "°C"), "humidity": ("Humidity", "%"), "gas": ("Gas Level", " ppm")}
+
+
+def deliver_alert_digest(db: Session, entries: list, payloads: list) -> list:
+    """
+    Outbox batch handler: sends each closed digest. Recipients whose digests have the
+    same content get one rendered template (send_alert renders once per call).
+    """
+    groups: Dict[str, list] = {}
+    for entry, payload in zip(entries, payloads):
+        groups.setdefault(digest_content_key(payload), []).append((entry, payload))
+
+    results = {}
+    for group in groups.values():
+        payload = group[0][1]
+        recipients = [entry.recipient for entry, _ in group]
+        window_start = datetime.fromisoformat(payload["window_start"])
+        minutes = max(1, round((dt.utcnow() - window_start).total_seconds() / 60))
+
+        rows = []
+        for device in payload["devices"].values():
+            for metric, state in device["metrics"].items():
+                label, unit = METRIC_LABELS[metric]
+                # Peak in the breach direction (low humidity breaches report the minimum)
+                peak = state["max"] if state["max"] > state["limit"] else state["min"]
+                rows.append({
+                    "metric": f"{device['name']} · {label}",
+                    "value": f"{round(peak, 1)}{unit} (peak, {state['count']}×)",
+                    "limit": f"{state['limit']}{unit}",
+                    "status": "CRITICAL",
+                })
+        device_names = [device["name"] for device in payload["devices"].values()]
+        insight = (
+            f"{payload['breaches']} threshold breaches on {len(device_names)} device(s) in the last {minutes} min: "
+            f"{', '.join(device_names)}. Values shown are the peaks reached during the window."
+        )
+
+        log_alert_activity(f"📨 DELIVERING digest to {len(recipients)} recipient(s): {recipients}")
+        success = email_notifier.send_alert(
+            recipients=recipients,
+            device_name=device_names[0] if len(device_names) == 1 else f"{len(device_names)} devices",
+            timestamp=window_start.strftime("%Y-%m-%d %H:%M:%S UTC"),
+            alert_data=rows,
+            ai_insight=insight,
+            dashboard_link="http://localhost:5173/dashboard",
+            title="🛡️ EcoSync Alert Digest",
+        )
+        if success:
+            alert_ids = [alert_id for _, p in group for alert_id in p["alert_ids"]]
+            if alert_ids:
+                db.query(models.Alert).filter(models.Alert.id.in_(alert_ids)).update(
+                    {"email_sent": True}, synchronize_session=False
                 )
-                
-                if success:
-                    alert_cooldowns[cooldown_key] = current_ts
-                    log_alert_activity(f"📧 SUCCESS: Email delivered to {target_email}")
-                else:
-                    log_alert_activity(f"❌ SMTP FAILURE for {target_email}")
-            except Exception as smtp_err:
-                log_alert_activity(f"❌ SMTP CRASH for {target_email}: {smtp_err}")
-    
-    return {"status": "success"}
+            log_alert_activity(f"📧 SUCCESS: Digest delivered to {recipients}")
+        else:
+            log_alert_activity(f"❌ SMTP FAILURE for digest to {recipients} (will retry)", "error")
+        for entry, _ in group:
+            results[entry.id] = success
+    return [results[entry.id] for entry in entries]
+
+
+def deliver_alert_push(db: Session, entry: models.NotificationOutbox, payload: dict) -> bool:
+    """Outbox handler: pushes the alert to every active subscription of the recipient."""
+    result = push_dispatcher.send_to_users(db, [entry.user_id], payload)
+    # No subscriptions left is not a failure worth retrying
+    return result["sent"] > 0 or result["failed"] == 0
+
+
+notification_outbox.register("email", deliver_alert_email)
+notification_outbox.register("push", deliver_alert_push)
+notification_outbox.register_batch("digest", deliver_alert_digest)
 
 
 # --- Alert Debug Endpoints ---
 
 @app.post("/api/debug/reset-cooldowns", tags=["Debug"])
 def reset_alert_cooldowns():
-    """Clears the in-memory alert cooldown dict so alerts can fire immediately."""
-    count = len(alert_cooldowns)
-    alert_cooldowns.clear()
+    """Clears the alert cooldown store so alerts can fire immediately."""
+    count = cooldown_store.reset()
     log_alert_activity(f"🔄 Cooldowns manually reset ({count} entries cleared)")
     return {"status": "ok", "cleared": count, "message": "Alert cooldowns cleared. Next threshold breach will trigger an email immediately."}
 
@@ -516,17 +703,18 @@ def reset_alert_cooldowns():
 def get_cooldown_status():
     """Shows current cooldown state for all devices."""
     now = dt.utcnow()
+    cooldown_min = cooldown_store.cooldown.total_seconds() / 60
     status = {}
-    for key, last_sent in alert_cooldowns.items():
+    for key, last_sent in cooldown_store.snapshot().items():
         elapsed = (now - last_sent).total_seconds() / 60
-        remaining = max(0, 10 - elapsed)
+        remaining = max(0, cooldown_min - elapsed)
         status[key] = {
             "last_sent": last_sent.isoformat(),
             "elapsed_min": round(elapsed, 1),
             "remaining_min": round(remaining, 1),
             "blocked": remaining > 0
         }
-    return {"cooldowns": status, "total": len(status)}
+    return {"cooldowns": status, "total": len(status), "backend": type(cooldown_store).__name__}
 
 
 # --- Compliance Log API ---
@@ -608,409 +796,590 @@ class IoTSensorData(BaseModel):
     ph: float = 7.0
 
 
+# Upper bound on readings accepted by /iot/data/batch in a single request
+MAX_BATCH_SIZE = int(os.getenv("IOT_MAX_BATCH_SIZE", "1000"))
 
+# Write-behind mode: validate + filter in the request, return 202 and group-commit in the background
+WRITE_BEHIND_ENABLED = os.getenv("IOT_WRITE_BEHIND", "false").lower() == "true"
+# Accepted readings that could not be stored even on their own (JSON lines, for replay)
+INGEST_DEAD_LETTER_PATH = os.getenv(
+    "INGEST_DEAD_LETTER_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "state", "ingest_dead_letter.jsonl")
+)
 
-@app.post("/iot/data", tags=["IoT"])
-async def receive_iot_data(data: IoTSensorData, db: Session = Depends(get_db)):
-    """Receives data from ESP32, applies Kalman filter, checks anomalies and alerts."""
-    log_alert_activity(f"RECEIVE_IOT_DATA ENTRY - Email: {data.user_email}")
+
+def device_id_for_email(user_email: Optional[str]) -> str:
+    """Maps a user email to its dashboard device id (ESP32_MAIN when anonymous)."""
+    if user_email:
+        id_sanitized = user_email.replace("@", "_").replace(".", "_")
+        return f"DASHBOARD_{id_sanitized}"
+    return "ESP32_MAIN"
+
+
+_preparing: Dict[str, asyncio.Future] = {}  # device id -> its prepare_device task in flight
+
+
+def prepare_device(device_id: str):
+    """Loads a device's checkpointed state and creates its anomaly-detector state (file I/O: runs in a thread)."""
     try:
-        current_ts = dt.utcnow()
-        
-        # 1. Kalman Filtering & Cleaning
-        temp_val = data.temperature if data.temperature is not None else 0.0
-        hum_val = data.humidity if data.humidity is not None else 0.0
-        
-        filtered_temp, temp_conf = kf_instance.filter_temperature(temp_val)
-        filtered_hum, hum_conf = kf_instance.filter_humidity(hum_val)
-        filtered_pm25, pm25_conf = kf_instance.filter_pm25(data.pm25)
-        mq_cleaned = kf_instance.clean_mq_data(data.mq_raw)
-
-        # 1b. Trust Score & Anomaly Detection
-        current_data = {
-            "temperature": filtered_temp,
-            "humidity": filtered_hum,
-            "pm2_5": filtered_pm25,
-            "pressure": data.pressure,
-            "wind_speed": data.wind_speed,
-            "uv_index": 0, # Placeholder
-            "vibration": 0, # Placeholder
-            "ph": data.ph,
-            "gas": data.gas or mq_cleaned["smoothed"]
-        }
-        
-        trust_score = trust_calculator.calculate_score(current_data)
-        is_anomaly, anomaly_score = anomaly_detector.update_and_predict([
-            filtered_temp, data.pressure, 0, data.wind_speed, 0, 0, 0, filtered_pm25, 0, 0, 0
-        ])
-        
-        anomalies_list, precautions = anomaly_detector.check_thresholds(current_data)
-        smart_insight = insight_generator.generate_insight(current_data, anomalies_list)
-        
-        if is_anomaly:
-            anomalies_list.append("Statistical Outlier")
-        
-        # 2. Get/Create Device (Unique per User for localized geofencing)
-        if data.user_email:
-             id_sanitized = data.user_email.replace("@", "_").replace(".", "_")
-             device_id = f"DASHBOARD_{id_sanitized}"
-        else:
-             device_id = "ESP32_MAIN"
-        
-        log_alert_activity(f"Target Device: {device_id}")
-        
-        device = db.query(models.Device).filter(models.Device.id == device_id).first()
-        log_alert_activity(f"Device query done. Found={device is not None}")
+        state_checkpoint.prefetch(device_id)
+        anomaly_detector.prepare(device_id)
+    except Exception as e:
+        logger.error(f"Preparing state of {device_id} failed: {e}")
+
+
+async def prepare_devices(readings: List[IoTSensorData]):
+    """
+    A device's first reading in this worker restores its checkpoint and lists its archive;
+    that is done in a thread before the reading enters the filter/ML pipeline. Readings that
+    arrive meanwhile wait for the same task, so a device's readings keep their order.
+    """
+    waits = []
+    for device_id in {device_id_for_email(data.user_email) for data in readings}:
+        if anomaly_detector.knows(device_id):
+            continue
+        task = _preparing.get(device_id)
+        if task is None:
+            task = _preparing[device_id] = asyncio.ensure_future(asyncio.to_thread(prepare_device, device_id))
+            task.add_done_callback(lambda _, device_id=device_id: _preparing.pop(device_id, None))
+        waits.append(task)
+    if waits:
+        await asyncio.gather(*waits)
+
+
+def filter_readings(readings: List[IoTSensorData]) -> List[dict]:
+    """Kalman-filters a list of readings through the per-device filter bank in one vectorized call."""
+    device_ids = [device_id_for_email(data.user_email) for data in readings]
+    values = [
+        [
+            data.temperature if data.temperature is not None else 0.0,
+            data.humidity if data.humidity is not None else 0.0,
+            data.pm25,
+        ]
+        for data in readings
+    ]
+    return kalman_bank.filter_batch(device_ids, values, [data.mq_raw for data in readings])
+
+
+def anomaly_features(data: IoTSensorData, kf_result: dict) -> tuple:
+    """(feature vector in ml_engine.Preprocessor order, device id) of one Kalman-filtered reading."""
+    return [
+        kf_result["temperature"][0], data.pressure, 0, data.wind_speed, 0, 0, 0, kf_result["pm25"][0], 0, 0, 0
+    ], device_id_for_email(data.user_email)
+
+
+def process_reading(data: IoTSensorData, kf_result: dict, anomaly: tuple) -> dict:
+    """
+    Runs one Kalman-filtered reading through trust scoring, threshold checks and insights.
+    anomaly is its (is_anomaly, score) from the anomaly scorer.
+    """
+    # 1. Kalman Filtering & Cleaning (done by filter_readings)
+    filtered_temp, temp_conf = kf_result["temperature"]
+    filtered_hum, hum_conf = kf_result["humidity"]
+    filtered_pm25, pm25_conf = kf_result["pm25"]
+    mq_cleaned = kf_result["mq"]
+    device_id = device_id_for_email(data.user_email)
+
+    # 1b. Trust Score & Anomaly Detection
+    current_data = {
+        "temperature": filtered_temp,
+        "humidity": filtered_hum,
+        "pm2_5": filtered_pm25,
+        "pressure": data.pressure,
+        "wind_speed": data.wind_speed,
+        "uv_index": 0, # Placeholder
+        "vibration": 0, # Placeholder
+        "ph": data.ph,
+        "gas": data.gas or mq_cleaned["smoothed"]
+    }
+
+    trust_score = trust_calculator.calculate_score(current_data, device_id)
+    is_anomaly, anomaly_score = anomaly
+
+    anomalies_list, precautions = anomaly_detector.check_thresholds(current_data)
+    smart_insight = insight_generator.generate_insight(current_data, anomalies_list)
+
+    if is_anomaly:
+        anomalies_list.append("Statistical Outlier")
+
+    # New Smart Alert Logic (Phase 2) - Calculated for EVERY request
+    log_alert_activity(f"Calling generate_full_report for {data.user_email}")
+    smart_report = insight_generator.generate_full_report(
+        {
+            "temperature": data.temperature,
+            "gas": data.mq_raw, # Using mq_raw as gas proxy
+            "humidity": data.humidity,
+            "ph": data.ph
+        },
+        anomalies_list,
+        device_id
+    )
+
+    smart_insight = smart_report["insight"]
+    trust_score = trust_calculator.calculate_score({
+        "temperature": data.temperature,
+        "humidity": data.humidity,
+        "pm2_5": filtered_pm25,
+    }, device_id)
+
+    return {
+        "filtered_temp": filtered_temp,
+        "filtered_hum": filtered_hum,
+        "filtered_pm25": filtered_pm25,
+        "confidence": (temp_conf, hum_conf, pm25_conf),
+        "mq_cleaned": mq_cleaned,
+        "trust_score": trust_score,
+        "is_anomaly": is_anomaly,
+        "anomaly_score": anomaly_score,
+        "anomalies": anomalies_list,
+        "smart_insight": smart_insight,
+        "smart_report": smart_report,
+    }
+
+
+def resolve_devices(db: Session, readings: List[IoTSensorData], current_ts):
+    """
+    Get/Create the devices for a set of readings (Unique per User for localized geofencing).
+    Known devices come from the in-memory registry and their last_seen/status updates are
+    buffered; only unknown devices and unlinked users hit the DB (one query each at most).
+    New devices are left pending on the session so they commit together with the measurements.
+    Returns (devices by id, newly created devices) - register the latter after commit.
+    """
+    latest_by_device = {}
+    for data in readings:
+        latest_by_device[device_id_for_email(data.user_email)] = data
+
+    devices = device_registry.get_many(db, latest_by_device)
+
+    # Only look up users for devices that are new or not yet linked
+    emails = {
+        data.user_email for dev_id, data in latest_by_device.items()
+        if data.user_email and (dev_id not in devices or not devices[dev_id].user_id)
+    }
+    user_ids = device_registry.user_ids_for(db, emails) if emails else {}
+
+    created = []
+    for dev_id, data in latest_by_device.items():
+        user_id = user_ids.get(data.user_email)
+        device = devices.get(dev_id)
         if not device:
-            # Find the actual user record to link
-            user = db.query(models.User).filter(models.User.email == data.user_email).first()
             device = models.Device(
-                id=device_id, name="EcoSync Node", 
+                id=dev_id, name="EcoSync Node",
                 connector_type="esp32",
-                lat=data.lat or 0.0, lon=data.lon or 0.0, 
+                lat=data.lat or 0.0, lon=data.lon or 0.0,
                 status="online", last_seen=current_ts,
-                user_id=user.id if user else None
+                user_id=user_id
             )
             db.add(device)
-            db.commit()
-            db.refresh(device)
+            devices[dev_id] = device
+            created.append(device)
         else:
-            device.last_seen = current_ts
-            device.status = "online"
             # Link user if not already linked
-            if not device.user_id and data.user_email:
-                user = db.query(models.User).filter(models.User.email == data.user_email).first()
-                if user:
-                    device.user_id = user.id
-            if data.lat and data.lon:
-                device.lat = data.lat
-                device.lon = data.lon
-            db.commit()
+            device_registry.touch(device, current_ts, "online", data.lat, data.lon, user_id)
+
+    log_alert_activity(f"Resolved {len(devices)} device(s), {len(created)} new")
+    return devices, created
+
+
+def build_measurement(device, data: IoTSensorData, processed: dict, current_ts) -> models.SensorData:
+    """Creates the SensorData row for a processed reading."""
+    mq_cleaned = processed["mq_cleaned"]
+    smart_report = processed["smart_report"]
+    anomalies_list = processed["anomalies"]
+    measurement = models.SensorData(
+        device_id=device.id,
+        user_id=device.user_id,
+        timestamp=current_ts,
+        temperature=float(processed["filtered_temp"]),
+        humidity=float(processed["filtered_hum"]),
+        pressure=float(data.pressure),
+        wind_speed=float(data.wind_speed),
+        pm2_5=float(processed["filtered_pm25"]),
+        pm10=float(mq_cleaned["z_score"]), # Using z-score for now
+        mq_raw=float(data.mq_raw),
+        gas=float(data.gas) if data.gas is not None else float(mq_cleaned["smoothed"]),
+        rain=float(data.rain),
+        motion=int(data.motion),
+        ph=float(data.ph),
+        trust_score=float(processed["trust_score"]),
+        anomaly_label=",".join(anomalies_list) if anomalies_list else "Normal",
+        smart_insight=processed["smart_insight"]
+    )
 
-        # New Smart Alert Logic (Phase 2) - Calculated for EVERY request
-        log_alert_activity(f"Calling generate_full_report for {data.user_email}")
-        smart_report = insight_generator.generate_full_report(
-            {
-                "temperature": data.temperature,
-                "gas": data.mq_raw, # Using mq_raw as gas proxy
-                "humidity": data.humidity,
-                "ph": data.ph
-            },
-            anomalies_list
-        )
-        
-        smart_insight = smart_report["insight"]
-        trust_score = trust_calculator.calculate_score({
+    # Add extra metrics to object for immediate response (not stored in DB yet)
+    measurement.risk_level = smart_report["risk_level"]
+    measurement.prediction = smart_report["prediction"]
+    measurement.sensor_health = smart_report["sensor_health"]
+    measurement.baseline = smart_report["baseline"]
+    measurement.baseline_range = smart_report["baseline_range"]
+    measurement.unusualness = smart_report["unusualness"]
+    return measurement
+
+
+def build_stream_payload(device_id: str, data: IoTSensorData, processed: dict, current_ts) -> dict:
+    """WebSocket payload for a processed reading."""
+    mq_cleaned = processed["mq_cleaned"]
+    temp_conf, hum_conf, pm25_conf = processed["confidence"]
+    mq_norm = float(min(100, max(0, (mq_cleaned["smoothed"] - 200) / 6)))
+    return {
+        "deviceId": device_id,
+        "timestamp": current_ts.isoformat(),
+        "raw": {
             "temperature": data.temperature,
             "humidity": data.humidity,
-            "pm2_5": filtered_pm25,
-        })
+            "pm25": data.pm25,
+            "mq_raw": data.mq_raw
+        },
+        "filtered": {
+            "temperature": round(processed["filtered_temp"], 2),
+            "humidity": round(processed["filtered_hum"], 2),
+            "pm25": round(processed["filtered_pm25"], 2),
+            "mq_smoothed": mq_cleaned["smoothed"]
+        },
+        "confidence": {
+            "temperature": round(temp_conf, 3),
+            "humidity": round(hum_conf, 3),
+            "pm25": round(pm25_conf, 3)
+        },
+        "mq_quality": {
+            "is_outlier": mq_cleaned["is_outlier"],
+            "z_score": mq_cleaned["z_score"]
+        },
+        "mq_index": mq_norm,
+        "pressure": data.pressure,
+        "wind_speed": data.wind_speed,
+        "smart_metrics": {
+            "trust_score": round(processed["trust_score"], 1),
+            "is_anomaly": processed["is_anomaly"],
+            "anomaly_score": round(processed["anomaly_score"], 3),
+            "insight": processed["smart_insight"],
+            "ph": data.ph
+        }
+    }
 
-        # 3. Store Filtered Data with proper transaction handling
+
+def persist_ingest_group(group: list) -> dict:
+    """
+    Stores a group of processed (data, processed, timestamp) readings and their staged
+    alerts with one commit, on its own session. Used by the write-behind writer and, via
+    asyncio.to_thread, by the synchronous ingestion endpoints - it blocks on the database
+    (device resolution, alert index refreshes, cooldown claims), so never call it on the
+    event loop. Returns the newest reading per device for broadcasting.
+    """
+    db = database.SessionLocal()
+    claims = []
+    try:
+        devices, created = resolve_devices(db, [data for data, _, _ in group], group[-1][2])
+        measurements = []
+        latest = {}
+        for data, processed, ts in group:
+            device = devices[device_id_for_email(data.user_email)]
+            measurement = build_measurement(device, data, processed, ts)
+            measurements.append(measurement)
+            claims += stage_alerts(db, device, alert_snapshot(measurement), data.user_email)
+            latest[device.id] = (data, processed, ts)
+        samples = [historical_service.sample(m) for m in measurements]
+        snapshots = [latest_snapshot(m) for m in measurements]
+        db.add_all(measurements)
+        db.commit()
+    except Exception:
+        db.rollback()
+        release_cooldowns(claims)
+        raise
+    finally:
+        db.close()
+    # Committed: a failure from here on must not make the queue retry (and duplicate) the group
+    try:
+        device_registry.register(created)
+        historical_service.record_many(samples)
+        latest_readings.record_many(snapshots)
+    except Exception as e:
+        logger.error(f"Post-commit cache update failed: {e}")
+    return latest
+
+
+def dead_letter_ingest_items(group: list, error: Exception):
+    """Write-behind dead-letter hook: appends readings that could not be stored to INGEST_DEAD_LETTER_PATH"""
+    os.makedirs(os.path.dirname(INGEST_DEAD_LETTER_PATH), exist_ok=True)
+    with open(INGEST_DEAD_LETTER_PATH, "a", encoding="utf-8") as f:
+        for data, _, ts in group:
+            record = {"failed_at": dt.utcnow().isoformat(), "received_at": ts.isoformat(), "error": str(error),
+                      "reading": jsonable_encoder(data)}
+            f.write(json.dumps(record) + "\n")
+    log_alert_activity(f"Dead-lettered {len(group)} reading(s) to {INGEST_DEAD_LETTER_PATH}: {error}", "error")
+
+
+async def broadcast_ingest_group(group: list, latest: dict):
+    """Write-behind post-commit hook: WebSocket broadcast of the newest reading per device"""
+    for device_id, (data, processed, ts) in latest.items():
         try:
-            mq_norm = float(min(100, max(0, (mq_cleaned["smoothed"] - 200) / 6)))
-            measurement = models.SensorData(
-                device_id=device.id,
-                user_id=device.user_id,
-                timestamp=current_ts,
-                temperature=float(filtered_temp),
-                humidity=float(filtered_hum),
-                pressure=float(data.pressure),
-                wind_speed=float(data.wind_speed),
-                pm2_5=float(filtered_pm25),
-                pm10=float(mq_cleaned["z_score"]), # Using z-score for now
-                mq_raw=float(data.mq_raw),
-                gas=float(data.gas) if data.gas is not None else float(mq_cleaned["smoothed"]),
-                rain=float(data.rain),
-                motion=int(data.motion),
-                ph=float(data.ph),
-                trust_score=float(trust_score),
-                anomaly_label=",".join(anomalies_list) if anomalies_list else "Normal",
-                smart_insight=smart_insight
-            )
-            
-            # Add extra metrics to object for immediate response (not stored in DB yet)
-            measurement.risk_level = smart_report["risk_level"]
-            measurement.prediction = smart_report["prediction"]
-            measurement.sensor_health = smart_report["sensor_health"]
-            measurement.baseline = smart_report["baseline"]
-            db.add(measurement)
-            db.commit()
+            await manager.broadcast(build_stream_payload(device_id, data, processed, ts), "ESP32_MAIN")
+        except Exception as ws_error:
+            logger.error(f"WebSocket broadcast failed: {ws_error}")
 
-            # 4. Alert Check with proper session management
-            try:
-                # Ensure objects are fresh after first commit
-                db.refresh(device)
-                db.refresh(measurement)
-                
-                check_alerts(db, device, measurement, data.user_email)
-                db.commit()
-            except Exception as alert_error:
-                log_alert_activity(f"⚠️ Alert check CRASH: {alert_error}")
-                logger.error(f"Alert check failed: {alert_error}")
-
-            # 5. WebSocket Broadcast with error handling
-            try:
-                payload = {
-                    "deviceId": device_id,
-                    "timestamp": current_ts.isoformat(),
-                    "raw": {
-                        "temperature": data.temperature,
-                        "humidity": data.humidity,
-                        "pm25": data.pm25,
-                        "mq_raw": data.mq_raw
-                    },
-                    "filtered": {
-                        "temperature": round(filtered_temp, 2),
-                        "humidity": round(filtered_hum, 2),
-                        "pm25": round(filtered_pm25, 2),
-                        "mq_smoothed": mq_cleaned["smoothed"]
-                    },
-                    "confidence": {
-                        "temperature": round(temp_conf, 3),
-                        "humidity": round(hum_conf, 3),
-                        "pm25": round(pm25_conf, 3)
-                    },
-                    "mq_quality": {
-                        "is_outlier": mq_cleaned["is_outlier"],
-                        "z_score": mq_cleaned["z_score"]
-                    },
-                    "mq_index": mq_norm,
-                    "pressure": data.pressure,
-                    "mq_index": mq_norm,
-                    "pressure": data.pressure,
-                    "wind_speed": data.wind_speed,
-                    "smart_metrics": {
-                        "trust_score": round(trust_score, 1),
-                        "is_anomaly": is_anomaly,
-                        "anomaly_score": round(anomaly_score, 3),
-                        "insight": smart_insight,
-                        "ph": data.ph
-                    }
-                }
-                await manager.broadcast(payload, "ESP32_MAIN")
-            except Exception as ws_error:
-                logger.error(f"WebSocket broadcast failed: {ws_error}")
-                # Don't fail the entire request due to WebSocket issues
-
-            return {"status": "ok", "message": "Data processed successfully", "device_id": device_id}
 
+def ingest_queue_full_response(needed: int) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"status": "error", "detail": f"Ingestion queue full ({ingest_queue.free_slots()} free, {needed} needed). Retry shortly."},
+        headers={"Retry-After": "1"}
+    )
+
+
+@app.get("/api/debug/alert-queue", tags=["Debug"])
+def get_alert_queue_status():
+    """Shows alert worker pool depth, drop counts, per-job latency, SMTP session reuse and push fan-out."""
+    return {**alert_pool.stats(), "smtp": email_notifier.pool.stats(), "push": push_dispatcher.stats()}
+
+
+@app.get("/api/debug/outbox", tags=["Debug"])
+def get_outbox_status(db: Session = Depends(get_db)):
+    """Shows notification outbox entries by status, the oldest undelivered age and retry counts."""
+    return notification_outbox.stats(db)
+
+
+@app.get("/api/debug/ingest-queue", tags=["Debug"])
+def get_ingest_queue_status():
+    """Shows write-behind queue depth, throughput and commit latency."""
+    return {
+        "enabled": WRITE_BEHIND_ENABLED,
+        **ingest_queue.stats(),
+        "device_registry": device_registry.stats(),
+        "historical_context": historical_service.stats(),
+        "latest_readings": latest_readings.stats(),
+        "dashboard_snapshots": dashboard_snapshots.stats(),
+        "rollups": rollup_store.stats(),
+        "storage": sensor_storage.stats(),
+        "event_log": event_log.stats(),
+        "anomaly_models": anomaly_detector.stats(),
+        "anomaly_scoring": anomaly_scorer.stats(),
+        "state_checkpoint": state_checkpoint.stats(),
+        "rolling_windows": rolling_windows.stats(),
+        "baseline_sketches": quantile_sketches.stats(),
+    }
+
+
+@app.post("/iot/data", tags=["IoT"])
+async def receive_iot_data(data: IoTSensorData):
+    """Receives data from ESP32, applies Kalman filter, checks anomalies and alerts."""
+    log_alert_activity(f"RECEIVE_IOT_DATA ENTRY - Email: {data.user_email}")
+    if WRITE_BEHIND_ENABLED and ingest_queue.free_slots() < 1:
+        return ingest_queue_full_response(1)
+    try:
+        current_ts = dt.utcnow()
+        await prepare_devices([data])
+        kf_result = filter_readings([data])[0]
+        processed = process_reading(data, kf_result, await anomaly_scorer.score(*anomaly_features(data, kf_result)))
+
+        if WRITE_BEHIND_ENABLED:
+            device_id = device_id_for_email(data.user_email)
+            if not ingest_queue.submit((data, processed, current_ts)):
+                return ingest_queue_full_response(1)
+            return JSONResponse(
+                status_code=202,
+                content={"status": "accepted", "message": "Data queued for storage", "device_id": device_id}
+            )
+
+        # 2. Store the reading: device upsert + measurement + staged alerts in one transaction
+        #    (blocking DB work, including the alert cooldown claims, runs in a worker thread)
+        device_id = device_id_for_email(data.user_email)
+        log_alert_activity(f"Target Device: {device_id}")
+        try:
+            await asyncio.to_thread(persist_ingest_group, [(data, processed, current_ts)])
         except Exception as e:
-            log_alert_activity(f"❌ IoT Data Error: {e}")
+            log_alert_activity(f"❌ IoT Data Error: {e}", "error")
             logger.error(f"IoT Data Error: {e}")
             return {"status": "error", "detail": str(e)}
-            
+
+        # 3. WebSocket Broadcast with error handling
+        try:
+            payload = build_stream_payload(device_id, data, processed, current_ts)
+            await manager.broadcast(payload, "ESP32_MAIN")
+        except Exception as ws_error:
+            logger.error(f"WebSocket broadcast failed: {ws_error}")
+            # Don't fail the entire request due to WebSocket issues
+
+        return {"status": "ok", "message": "Data processed successfully", "device_id": device_id}
+
     except Exception as e:
-        log_alert_activity(f"❌ IoT Processing Error: {e}")
+        log_alert_activity(f"❌ IoT Processing Error: {e}", "error")
         logger.error(f"IoT Processing Error: {e}")
         return {"status": "error", "detail": str(e)}
 
 
-@app.get("/api/data", tags=["Analytics"])
-def get_historical_data(limit: int = 100, db: Session = Depends(get_db)):
+@app.post("/iot/data/batch", tags=["IoT"])
+async def receive_iot_data_batch(readings: List[IoTSensorData]):
     """
-    Returns historical sensor data for analytics visualization.
+    Receives a buffered array of readings (possibly for many devices) from a gateway.
+    Every reading goes through the same filter/ML pipeline as /iot/data; all rows are
+    written with a single bulk insert and one commit per batch.
     """
-    data = db.query(models.SensorData).order_by(models.SensorData.timestamp.desc()).limit(limit).all()
-    return data
+    if not readings:
+        return {"status": "ok", "message": "Empty batch", "stored": 0}
+    if len(readings) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {MAX_BATCH_SIZE} readings)")
+
+    log_alert_activity(f"RECEIVE_IOT_BATCH ENTRY - {len(readings)} readings")
+    if WRITE_BEHIND_ENABLED and ingest_queue.free_slots() < len(readings):
+        return ingest_queue_full_response(len(readings))
+    try:
+        current_ts = dt.utcnow()
 
+        # 1. Filter/ML pipeline (in order, so per-stream state advances like single posts)
+        await prepare_devices(readings)
+        kf_results = filter_readings(readings)
+        anomalies = await anomaly_scorer.score_many([anomaly_features(data, kf) for data, kf in zip(readings, kf_results)])
+        processed_list = [process_reading(data, kf, a) for data, kf, a in zip(readings, kf_results, anomalies)]
 
-@app.get("/api/historical-context", tags=["Analytics"])
-def get_historical_context(user_email: Optional[str] = None, db: Session = Depends(get_db)):
-    """
-    Returns AI historical context: same-time last week readings, 7-day averages,
-    and a generated narrative comparing current vs historical conditions.
-    """
-    now = dt.utcnow()
-    
-    # Build device filter
-    device_id = None
-    if user_email:
-        id_sanitized = user_email.replace("@", "_").replace(".", "_")
-        device_id = f"DASHBOARD_{id_sanitized}"
-
-    def base_query():
-        q = db.query(models.SensorData)
-        if device_id:
-            q = q.filter(models.SensorData.device_id == device_id)
-        return q
-
-    # 1. Same time last week (±30 min window)
-    last_week_center = now - timedelta(days=7)
-    last_week_start = last_week_center - timedelta(minutes=30)
-    last_week_end = last_week_center + timedelta(minutes=30)
-    last_week_rows = base_query().filter(
-        models.SensorData.timestamp >= last_week_start,
-        models.SensorData.timestamp <= last_week_end
-    ).order_by(models.SensorData.timestamp.desc()).limit(5).all()
-
-    # 2. Same time yesterday (±30 min window)
-    yesterday_center = now - timedelta(days=1)
-    yesterday_start = yesterday_center - timedelta(minutes=30)
-    yesterday_end = yesterday_center + timedelta(minutes=30)
-    yesterday_rows = base_query().filter(
-        models.SensorData.timestamp >= yesterday_start,
-        models.SensorData.timestamp <= yesterday_end
-    ).order_by(models.SensorData.timestamp.desc()).limit(5).all()
-
-    # 3. 7-day averages
-    week_ago = now - timedelta(days=7)
-    week_rows = base_query().filter(
-        models.SensorData.timestamp >= week_ago
-    ).all()
-
-    def avg(rows, field):
-        vals = [getattr(r, field) for r in rows if getattr(r, field) is not None]
-        return round(sum(vals) / len(vals), 1) if vals else None
-
-    week_avg = {
-        "temperature": avg(week_rows, "temperature"),
-        "humidity": avg(week_rows, "humidity"),
-        "gas": avg(week_rows, "gas"),
-    }
+        if WRITE_BEHIND_ENABLED:
+            queued = sum(
+                ingest_queue.submit((data, processed, current_ts))
+                for data, processed in zip(readings, processed_list)
+            )
+            return JSONResponse(
+                status_code=202,
+                content={"status": "accepted", "message": "Batch queued for storage", "queued": queued}
+            )
+
+        # 2. One transaction for the whole batch: devices, bulk insert, staged alerts (in a worker thread)
+        group = [(data, processed, current_ts) for data, processed in zip(readings, processed_list)]
+        try:
+            latest = await asyncio.to_thread(persist_ingest_group, group)
+        except Exception as e:
+            log_alert_activity(f"❌ IoT Batch Error: {e}", "error")
+            logger.error(f"IoT Batch Error: {e}")
+            return {"status": "error", "detail": str(e)}
+
+        # 3. Broadcast only the newest reading per device
+        await broadcast_ingest_group(group, latest)
 
-    # 4. Build snapshot helper
-    def snapshot(rows):
-        if not rows:
-            return None
-        r = rows[0]
         return {
-            "timestamp": r.timestamp.isoformat() if r.timestamp else None,
-            "temperature": round(r.temperature, 1) if r.temperature is not None else None,
-            "humidity": round(r.humidity, 1) if r.humidity is not None else None,
-            "gas": round(r.gas, 1) if r.gas is not None else None,
-            "rain": r.rain,
-            "anomaly_label": r.anomaly_label,
-            "smart_insight": r.smart_insight,
+            "status": "ok",
+            "message": "Batch processed successfully",
+            "stored": len(group),
+            "devices": sorted(latest),
         }
 
-    last_week_snap = snapshot(last_week_rows)
-    yesterday_snap = snapshot(yesterday_rows)
-
-    # 5. Generate AI narrative
-    def generate_narrative(last_week_snap, yesterday_snap, week_avg, now):
-        lines = []
-        day_name = (now - timedelta(days=7)).strftime("%A")
-        time_str = now.strftime("%I:%M %p")
-
-        if last_week_snap and last_week_snap.get("temperature") is not None:
-            lw_temp = last_week_snap["temperature"]
-            lw_hum = last_week_snap.get("humidity", "N/A")
-            lw_gas = last_week_snap.get("gas", "N/A")
-            lw_anomaly = last_week_snap.get("anomaly_label") or "Normal"
-            lw_insight = last_week_snap.get("smart_insight") or ""
-            lines.append(
-                f"📅 Last {day_name} at {time_str}: Temperature was {lw_temp}°C, "
-                f"Humidity {lw_hum}%, Gas {lw_gas} ppm. "
-                f"Status: {lw_anomaly}."
-                + (f" AI noted: {lw_insight}" if lw_insight else "")
-            )
-        else:
-            lines.append(f"📅 No data recorded last {day_name} at this time.")
-
-        if yesterday_snap and yesterday_snap.get("temperature") is not None:
-            yd_temp = yesterday_snap["temperature"]
-            yd_hum = yesterday_snap.get("humidity", "N/A")
-            yd_anomaly = yesterday_snap.get("anomaly_label") or "Normal"
-            lines.append(
-                f"🕐 Yesterday at {time_str}: Temperature was {yd_temp}°C, "
-                f"Humidity {yd_hum}%. Status: {yd_anomaly}."
-            )
-        else:
-            lines.append(f"🕐 No data recorded yesterday at this time.")
+    except Exception as e:
+        log_alert_activity(f"❌ IoT Batch Processing Error: {e}", "error")
+        logger.error(f"IoT Batch Processing Error: {e}")
+        return {"status": "error", "detail": str(e)}
 
-        if week_avg.get("temperature") is not None:
-            lines.append(
-                f"📊 7-Day Averages: Temperature {week_avg['temperature']}°C, "
-                f"Humidity {week_avg['humidity']}%, Gas {week_avg['gas']} ppm."
-            )
 
-        return " | ".join(lines)
+DATA_PAGE_MAX = int(os.getenv("API_DATA_MAX_PAGE", "5000"))
+
+
+@app.get("/api/data", tags=["Analytics"])
+def get_historical_data(
+    limit: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    device_id: Optional[str] = None,
+    resolution: str = "auto",
+    max_points: int = 500,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    order: str = "desc",
+    format: str = "json",
+    db: Session = Depends(get_db),
+):
+    """
+    Returns historical sensor data for analytics visualization.
+    Without start: raw readings, newest first, `limit` (default 100, max API_DATA_MAX_PAGE)
+    per page; `fields` picks columns and the X-Next-Cursor header continues via `cursor`.
+    format=ndjson/csv streams every matching row (or `limit` rows) in constant memory.
+    With start (and optional end), a series from the rollup tables at `resolution`
+    (1m/1h/1d, or "auto" for the finest one that stays within max_points buckets);
+    resolution=raw reads sensor_data.
+    """
+    if start is None or resolution == "raw" or format != "json":
+        if format not in sensor_export.FORMATS:
+            raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(sensor_export.FORMATS)}")
+        if order not in ("asc", "desc"):
+            raise HTTPException(status_code=400, detail="order must be asc or desc")
+        try:
+            columns = sensor_export.parse_fields(fields)
+            filters = {"device_id": device_id, "start": start, "end": end, "cursor": cursor, "descending": order == "desc"}
+            if format != "json":
+                sensor_export.build_query(columns, **filters)  # validates the cursor before streaming starts
+                return StreamingResponse(
+                    sensor_export.stream(database.SessionLocal, columns, format, limit=limit, **filters),
+                    media_type=sensor_export.MEDIA_TYPES[format],
+                    headers={"Content-Disposition": f"attachment; filename=sensor_data.{format}"},
+                )
+            rows, next_cursor = sensor_export.fetch_page(db, columns, min(max(1, limit or 100), DATA_PAGE_MAX), **filters)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return JSONResponse(jsonable_encoder(rows), headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
+
+    end_ts = end or dt.utcnow()
+    if resolution == "auto":
+        resolution = rollup_store.choose_resolution(start, end_ts, max(1, max_points))
+    elif resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be auto, raw or one of {', '.join(RESOLUTIONS)}")
+    return rollup_store.series(db, resolution, start, end, device_id)
+
+
+@app.get("/api/analytics/aggregate", tags=["Analytics"])
+def get_aggregated_series(
+    from_: datetime = Query(..., alias="from"),
+    to: Optional[datetime] = None,
+    device_id: Optional[str] = None,
+    metric: Optional[str] = None,
+    bucket: str = "auto",
+    percentiles: Optional[str] = None,
+    max_points: int = 500,
+    db: Session = Depends(get_db),
+):
+    """
+    Bucketed series for charts: per bucket mean/min/max/count (and pN for each requested
+    percentile) of each metric (comma-separated, default temperature,humidity,gas).
+    bucket is e.g. 5m/1h/1d or "auto"; buckets are UTC-aligned and empty ones are omitted.
+    Served from the rollup tables when possible, otherwise aggregated from raw columns.
+    """
+    end = to or dt.utcnow()
+    if end <= from_:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    try:
+        metrics = aggregation.parse_metrics(metric)
+        wanted = aggregation.parse_percentiles(percentiles)
+        if bucket == "auto":
+            bucket = aggregation.auto_bucket(from_, end, max(1, max_points))
+        return aggregation.aggregator.aggregate(db, metrics, from_, end, bucket, device_id, wanted)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    narrative = generate_narrative(last_week_snap, yesterday_snap, week_avg, now)
 
+@app.get("/api/historical-context", tags=["Analytics"])
+def get_historical_context(user_email: Optional[str] = None, db: Session = Depends(get_db)):
+    """
+    Returns AI historical context: same-time last week readings, 7-day averages,
+    and a generated narrative comparing current vs historical conditions.
+    Served from the in-memory hourly rollups (cached for HISTORY_CONTEXT_TTL_SECONDS).
+    """
+    device_id = device_id_for_email(user_email) if user_email else None
+    context = historical_service.context(db, device_id)
     return {
-        "last_week": last_week_snap,
-        "yesterday": yesterday_snap,
-        "week_averages": week_avg,
-        "narrative": narrative,
-        "generated_at": now.isoformat(),
+        "last_week": context["last_week"],
+        "yesterday": context["yesterday"],
+        "week_averages": context["week_averages"],
+        "narrative": context["narrative"],
+        "generated_at": context["generated_at"],
     }
 
 
 @app.get("/api/filtered/latest", tags=["IoT"])
-async def get_filtered_iot_data(user_email: Optional[str] = None, db: Session = Depends(get_db)):
-    """Returns latest Kalman-filtered data with user-aware thresholds."""
-    # Debug: Try ESP32_MAIN first
-    reading = db.query(models.SensorData).filter(
-        models.SensorData.device_id == "ESP32_MAIN"
-    ).order_by(models.SensorData.timestamp.desc()).first()
-    
-    if not reading:
-        # Debug: Try ANY device
-        last_any = db.query(models.SensorData).order_by(models.SensorData.timestamp.desc()).first()
-        if last_any:
-             reading = last_any
-        else:
-             return {"status": "no_data", "message": "No ESP32 data available"}
-    
-    # Calculate AQI
-    aqi_result = aqi_calculator.calculate_overall_aqi({"pm25": reading.pm2_5})
-    health_recs = aqi_calculator.get_health_recommendations(
-        aqi_result.get("aqi"), aqi_result.get("dominant_pollutant_key")
-    )
-    
-    # Calculate Rainfall Prediction
-    prediction = weather_service.calculate_rainfall_prediction(
-        reading.humidity, 
-        reading.wind_speed or 0.0, 
-        reading.pressure or 1013.0
-    )
-
-    # User-Specific Threshold Breaches
-    user_breaches = []
-    if user_email:
-        settings = db.query(models.AlertSettings).filter(
-            models.AlertSettings.user_email == user_email,
-            models.AlertSettings.is_active == True
-        ).first()
-        if settings:
-            temp = reading.temperature or 0.0
-            gas = reading.gas or 0.0
-            if temp > (settings.temp_threshold or 45.0):
-                user_breaches.append(f"Temperature exceeds your limit ({temp}°C > {settings.temp_threshold}°C)")
-            if gas > (settings.gas_threshold or 2000.0):
-                user_breaches.append(f"Gas level exceeds your limit ({gas} > {settings.gas_threshold})")
-    
-    return {
-        "status": "ok",
-        "timestamp": reading.timestamp.isoformat(),
-        "deviceId": reading.device_id,
-        "filtered": {
-            "temperature": reading.temperature,
-            "humidity": reading.humidity,
-            "pm25": reading.pm2_5,
-            "mq_smoothed": reading.pm10,
-            "pressure": reading.pressure,
-            "wind_speed": reading.wind_speed or 0.0
-        },
-        "air_quality": {
-            "aqi": aqi_result.get("aqi"),
-            "category": aqi_result.get("category"),
-            "color": aqi_result.get("color"),
-            "dominant_pollutant": aqi_result.get("dominant_pollutant")
-        },
-        "health": health_recs,
-        "weather": prediction,
-        "smart_metrics": {
-            "trust_score": reading.trust_score,
-            "anomaly_label": reading.anomaly_label,
-            "insight": reading.smart_insight,
-            "ph": reading.ph,
-            "risk_level": "CRITICAL" if len(user_breaches) > 0 else "SAFE",
-            "user_breaches": user_breaches
-        }
-    }
+def get_filtered_iot_data(request: Request, user_email: Optional[str] = None, db: Session = Depends(get_db)):
+    """
+    Returns latest Kalman-filtered data with user-aware thresholds (precomputed, ETag/304 aware).
+    Sync: a poll may refresh the latest readings or render a user's payload (database reads).
+    """
+    etag, body = dashboard_snapshots.get(db, user_email)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        dashboard_snapshots.record_not_modified()
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 # --- WebSocket Endpoint with proper error handling and cleanup ---
@@ -1126,7 +1495,7 @@ async def get_pro_data(lat: float = 17.3850, lon: float = 78.4867, city: str = N
     external_data["location"]["name"] = location_name
     
     # 2. Fetch Local
-    latest = db.query(models.SensorData).order_by(models.SensorData.timestamp.desc()).first()
+    latest = latest_readings.get(db)
     local_data = {"temp": latest.temperature, "humidity": latest.humidity, "pm25": latest.pm2_5} if latest else {}
     
     # 3. Fuse
@@ -1156,6 +1525,7 @@ def get_alert_settings(email: Optional[str] = None, db: Session = Depends(get_db
         db.add(settings)
         db.commit()
         db.refresh(settings)
+        alert_index.refresh(db)
     return settings
 
 @app.post("/api/settings/alerts", response_model=schemas.AlertSettingsResponse, tags=["Settings"])
@@ -1174,6 +1544,8 @@ def update_alert_settings(settings: schemas.AlertSettingsCreate, db: Session = D
     
     db.commit()
     db.refresh(db_settings)
+    alert_index.refresh(db)
+    dashboard_snapshots.refresh(db)
     return db_settings
 @app.get("/realtime/map", tags=["Map"])
 async def get_realtime_map_data():
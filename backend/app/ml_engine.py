@@ -1,20 +1,33 @@
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 
-# Shared Alert Logger (same as main.py)
-ALERT_LOG_FILE = os.path.join(os.path.dirname(__file__), "alert_system.log")
-def log_ml_activity(message: str):
-    try:
-        with open(ALERT_LOG_FILE, "a", encoding="utf-8") as f:
-            ts = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-            f.write(f"[{ts}] [ML] {message}\n")
-    except: pass
+# Shared Alert Logger (same event log as main.py; per-step messages can be sampled via EVENT_LOG_SAMPLE_ML)
+from .services.event_log import event_log
+def log_ml_activity(message: str, level: str = "info"):
+    event_log.log("ml", message, level)
 
 import numpy as np
 from filterpy.kalman import KalmanFilter
 from sklearn.ensemble import IsolationForest
 import pickle
 import os
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from .services.rolling_windows import RollingWindow, rolling_windows
+from .services.quantile_sketches import quantile_sketches
+from .services.sensor_archive import sensor_archive
+
+# Per-device rolling windows (services/rolling_windows.py)
+FEATURE_NAMES = ("temperature", "pressure", "vibration", "wind_speed", "uv_index", "soil_temp",
+                 "soil_moisture", "pm2_5", "pm10", "no2", "solar")  # Preprocessor order
+TRUST_WINDOW = 5     # readings the spike check averages over
+HEALTH_WINDOW = 10   # readings the stuck/noisy checks look at
+TREND_WINDOW = 5     # readings the trend projection spans
+rolling_windows.define("trust", ("temperature",), TRUST_WINDOW)
+rolling_windows.define("insight", ("temperature", "gas", "humidity", "ph"), HEALTH_WINDOW)
 
 class AdaptiveKalmanFilter:
     """
@@ -74,10 +87,10 @@ class Preprocessor:
         return scaled
 
 class TrustScoreCalculator:
-    def __init__(self):
-        self.history = []
+    def __init__(self, windows=rolling_windows):
+        self.windows = windows
 
-    def calculate_score(self, reading: dict):
+    def calculate_score(self, reading: dict, device_id="default"):
         """
         Calculate trust score (0-100) based on:
         1. Range Validity (Physics check)
@@ -93,13 +106,13 @@ class TrustScoreCalculator:
         
         # 2. Stability Check (Simulated for single reading)
         # In a real system, we'd check standard deviation over time
-        if len(self.history) > 5:
-            last_avg = np.mean([x['temperature'] for x in self.history[-5:]])
+        history = self.windows.window(device_id, "trust")
+        last_avg = history.mean("temperature")
+        if history.pushed > TRUST_WINDOW and last_avg is not None:
             if abs(reading.get('temperature', 0) - last_avg) > 10: 
                 score -= 15 # Sudden spike penalty
 
-        self.history.append(reading)
-        if len(self.history) > 20: self.history.pop(0)
+        history.push_values(reading)
             
         return float(max(0.0, min(100.0, score)))
 
@@ -134,16 +147,16 @@ class RiskLevelCalculator:
         return "SAFE"
 
 class PredictionEngine:
-    def predict_next_10_mins(self, history: list) -> dict:
+    def predict_next_10_mins(self, history: RollingWindow) -> dict:
         """
         Simple linear projection for short-term trends.
         """
-        if len(history) < 5:
+        if len(history) < TREND_WINDOW:
             return {"temperature": "Stable", "gas": "Stable"}
             
         # Get last 5 temps
-        temps = [x.get('temperature', 0) for x in history[-5:]]
-        gases = [x.get('gas', 0) for x in history[-5:]]
+        temps = history.tail("temperature", TREND_WINDOW)
+        gases = history.tail("gas", TREND_WINDOW)
         
         # Calculate slope (simple last - first)
         temp_slope = temps[-1] - temps[0]
@@ -155,19 +168,19 @@ class PredictionEngine:
         return {"temperature": t_trend, "gas": g_trend}
 
 class SensorHealthMonitor:
-    def check_health(self, history: list) -> dict:
+    def check_health(self, history: RollingWindow) -> dict:
         """
-        Detects sensor faults like 'Stuck Value' or 'Noisy/Spiky'.
+        Detects sensor faults like 'Stuck Value' or 'Noisy/Spiky' from the running
+        min/max/std of the last HEALTH_WINDOW readings.
         """
         health = {"temperature": "OK", "gas": "OK", "humidity": "OK"}
         
-        if len(history) < 10: return health
+        if len(history) < HEALTH_WINDOW: return health
         
         for sensor in ["temperature", "gas", "humidity"]:
-            readings = [x.get(sensor, 0) for x in history[-10:]]
-            if len(set(readings)) == 1:
+            if history.count(sensor) == len(history) and history.min(sensor) == history.max(sensor):
                 health[sensor] = "Stuck/Frozen"
-            elif np.std(readings) > 20: # Arbitrary high noise threshold
+            elif (history.std(sensor) or 0.0) > 20: # Arbitrary high noise threshold
                 health[sensor] = "Unstable/Noisy"
                 
         return health
@@ -181,21 +194,24 @@ class SmartInsightGenerator:
         self.risk_calc = RiskLevelCalculator()
         self.predictor = PredictionEngine()
         self.health_mon = SensorHealthMonitor()
-        self.history_buffer = []
+        self.windows = rolling_windows
+        self.sketches = quantile_sketches
 
-    def generate_full_report(self, reading: dict, anomalies: list):
+    def generate_full_report(self, reading: dict, anomalies: list, device_id="default"):
         log_ml_activity(f"Starting report for {reading.get('temp', 'N/A')}")
         # Update history
-        self.history_buffer.append(reading)
-        if len(self.history_buffer) > 20: self.history_buffer.pop(0)
+        history = self.windows.window(device_id, "insight")
+        history.push_values(reading)
+        # Score against the device's value distribution so far (services/quantile_sketches.py)
+        profile = self.sketches.observe(device_id, reading)
         
         # Calculate Metrics
         try:
             risk = self.risk_calc.calculate_risk(reading, anomalies)
             log_ml_activity(f"Risk calc: {risk}")
-            health = self.health_mon.check_health(self.history_buffer)
+            health = self.health_mon.check_health(history)
             log_ml_activity("Health check done")
-            prediction = self.predictor.predict_next_10_mins(self.history_buffer)
+            prediction = self.predictor.predict_next_10_mins(history)
             log_ml_activity("Prediction done")
             
             # Generate Text Insight
@@ -207,19 +223,14 @@ class SmartInsightGenerator:
                 "risk_level": risk,
                 "sensor_health": health,
                 "prediction": prediction,
-                "baseline": self._get_mock_baseline(reading)
+                "baseline": {metric: entry["p50"] for metric, entry in profile.items()},
+                "baseline_range": profile,
+                "unusualness": {metric: entry["unusualness"] for metric, entry in profile.items() if "unusualness" in entry}
             }
         except Exception as e:
-            log_ml_activity(f"❌ ML ENGINE ERROR: {e}")
+            log_ml_activity(f"❌ ML ENGINE ERROR: {e}", "error")
             raise e
 
-    def _get_mock_baseline(self, reading):
-        # Returns a 'normal' value slightly different from current for demo
-        return {
-            "temperature": max(20, reading.get('temperature', 25) - 5),
-            "gas": max(100, reading.get('gas', 200) - 50)
-        }
-
     def _generate_text(self, reading: dict, anomalies: list, risk: str):
         insights = []
         
@@ -272,11 +283,88 @@ class SmartInsightGenerator:
     def generate_insight(self, reading: dict, anomalies: list):
         return self._generate_text(reading, anomalies, "SAFE")
 
-class IoTAnomalyDetector:
+# Background retraining (see services/model_retrainer.py)
+BUFFER_SIZE = 1000
+MIN_FIT_SAMPLES = 50
+RETRAIN_INTERVAL_SECONDS = float(os.getenv("ANOMALY_RETRAIN_INTERVAL_SECONDS", "3600"))
+RETRAIN_MIN_NEW_SAMPLES = int(os.getenv("ANOMALY_RETRAIN_MIN_NEW_SAMPLES", "200"))
+# Refit early when the recent outlier rate (EWMA) drifts this far above the expected contamination
+DRIFT_OUTLIER_RATE = float(os.getenv("ANOMALY_DRIFT_OUTLIER_RATE", "0.3"))
+DRIFT_ALPHA = 0.02
+# Cold start from the Parquet archive (services/sensor_archive.py) when it is enabled
+ARCHIVE_SEED_DAYS = int(os.getenv("ANOMALY_ARCHIVE_SEED_DAYS", "30"))
+ARCHIVE_SEED_MAX_ROWS = int(os.getenv("ANOMALY_ARCHIVE_SEED_MAX_ROWS", "50000"))
+SHARED_KEY = "__shared__"  # retrainer key of the shared model
+
+
+def fit_isolation_forest(samples, n_estimators=100, contamination=0.1):
+    """Fits a fresh IsolationForest; module-level so it can run in a worker process."""
+    model = IsolationForest(n_estimators=n_estimators, contamination=contamination)
+    model.fit(samples)
+    return model
+
+
+def fit_archived(device_ids, start=None, max_rows=BUFFER_SIZE, n_estimators=100, contamination=0.1):
+    """
+    Reads the devices' archived readings since start and fits a model on the newest
+    max_rows of them; module-level so the Parquet read runs in the worker process too.
+    Returns (model, rows) or None if the archive has too few readings.
+    """
+    features = sensor_archive.training_matrix(device_ids, start)[-max_rows:]
+    if len(features) < MIN_FIT_SAMPLES:
+        return None
+    scaled = Preprocessor().scale(features)
+    return fit_isolation_forest(scaled, n_estimators, contamination), len(scaled)
+
+
+def score_samples(model, rows):
+    """
+    (anomaly flags, decision scores) for a matrix of scaled rows from one score_samples pass;
+    same results as model.predict(rows) == -1 and model.decision_function(rows).
+    """
+    scores = model.score_samples(np.asarray(rows, dtype=float)) - model.offset_
+    return scores < 0, scores
+
+
+class FittedModel:
+    """An immutable (model, version) pair; swapped in with a single reference assignment."""
+    __slots__ = ("model", "version", "fitted_at", "samples")
+
+    def __init__(self, model, version, samples):
+        self.model = model
+        self.version = version
+        self.fitted_at = datetime.utcnow()
+        self.samples = samples
+
+
+rolling_windows.define("features", FEATURE_NAMES, BUFFER_SIZE, track_stats=False)
+
+
+class DeviceModelState:
+    # The training buffer is the device's "features" rolling window, looked up on every use
+    # rather than held here, so a window the store evicted is never written to or kept alive
     def __init__(self):
-        self.buffer = []
-        self.model = IsolationForest(n_estimators=100, contamination=0.1)
-        self.is_fitted = False
+        self.current = None          # FittedModel or None
+        self.submitted_at = None     # monotonic time of the last submitted fit
+        self.new_samples = 0         # readings since the last fit was submitted
+        self.outlier_rate = 0.0      # EWMA of the anomaly flag
+
+
+class IoTAnomalyDetector:
+    def __init__(self, retrainer=None, max_devices=None):
+        from .services.model_retrainer import model_retrainer
+        self.retrainer = retrainer or model_retrainer
+        self.model_params = {"n_estimators": 100, "contamination": 0.1}
+        self.windows = rolling_windows
+        # device id -> DeviceModelState; least recently used devices are evicted, bounded like the windows
+        self.devices = OrderedDict()
+        self.max_devices = max_devices or self.windows.max_devices
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self.archive = sensor_archive
+        self.shared = None           # FittedModel from fit_offline, used until a device has its own
+        # restore_hook(device_id) -> saved state (see services/state_checkpoint.py) or None
+        self.restore_hook = None
         self.preprocessor = Preprocessor()
         
         self.config = {
@@ -292,6 +380,10 @@ class IoTAnomalyDetector:
             "PH_MAX": 14.0
         }
 
+    @property
+    def is_fitted(self):
+        return self.shared is not None or any(state.current for state in list(self.devices.values()))
+
     def update_config(self, new_config: dict):
         self.config.update(new_config)
 
@@ -348,23 +440,184 @@ class IoTAnomalyDetector:
 
         return alerts, precautions
 
-    def update_and_predict(self, feature_vector):
+    def observe(self, feature_vector, device_id="default"):
+        """
+        Buffers one reading for the device and schedules a background refit when due.
+        Returns (scaled features, FittedModel to score them with or None).
+        """
         scaled_features = self.preprocessor.scale(feature_vector)
-        self.buffer.append(scaled_features)
-        
-        if len(self.buffer) > 1000:
-            self.buffer.pop(0)
-        
-        if len(self.buffer) >= 50 and not self.is_fitted:
-            self.model.fit(self.buffer)
-            self.is_fitted = True
-            
-        if self.is_fitted:
-            prediction = self.model.predict([scaled_features])[0]
-            score = self.model.decision_function([scaled_features])[0]
-            return bool(prediction == -1), float(score) # True if anomaly
-        
-        return False, 0.0
+        state = self._state(device_id)
+        buffer = self.windows.window(device_id, "features")
+        buffer.push(scaled_features)
+        state.new_samples += 1
+
+        # Read the model reference once: a refit finishing meanwhile only affects later readings
+        fitted = state.current or self.shared
+        if self._should_refit(device_id, state, buffer):
+            self._schedule_refit(device_id, state, buffer)
+        return scaled_features, fitted
+
+    def knows(self, device_id):
+        return device_id in self.devices
+
+    def prepare(self, device_id):
+        """
+        Creates a device's state ahead of its first reading. That may restore a checkpoint
+        and list the device's archive, so run it in a thread rather than on the event loop.
+        """
+        self._state(device_id)
+
+    def _state(self, device_id):
+        with self._lock:
+            state = self.devices.get(device_id)
+            if state is not None:
+                self.devices.move_to_end(device_id)
+                return state
+        state = self._new_state(device_id)  # outside the lock: may read a checkpoint or submit a fit
+        with self._lock:
+            state = self.devices.setdefault(device_id, state)
+            while len(self.devices) > self.max_devices:
+                self.devices.popitem(last=False)
+                self.evicted += 1
+        return state
+
+    def _new_state(self, device_id):
+        state = DeviceModelState()
+        saved = self.restore_hook(device_id) if self.restore_hook else None
+        if saved is not None:
+            state.new_samples = saved["new_samples"]
+            state.outlier_rate = saved["outlier_rate"]
+            if saved.get("model") is not None:
+                state.current = FittedModel(saved["model"], saved["version"], saved["samples"])
+                state.submitted_at = time.monotonic()
+        if state.current is None and self.archive.enabled and self.archive.months(device_id):
+            self._seed_device(device_id, state)
+        return state
+
+    def _archive_fit(self, device_ids, max_rows):
+        # The archive ends at its watermark (closed months only), so the window ends there too
+        start = (self.archive.archived_until() or datetime.utcnow()) - timedelta(days=ARCHIVE_SEED_DAYS)
+        return partial(fit_archived, start=start, max_rows=max_rows, **self.model_params), tuple(device_ids)
+
+    def _seed_device(self, device_id, state):
+        """Fits a first model for a device from its archived readings instead of waiting for 50 live ones."""
+        def swap(result):
+            if result is not None and state.current is None:
+                model, rows = result
+                state.current = FittedModel(model, 1, rows)
+                log_ml_activity(f"Anomaly model v1 for {device_id} fitted on {rows} archived readings")
+
+        fit, device_ids = self._archive_fit([device_id], BUFFER_SIZE)
+        if self.retrainer.submit(device_id, fit, device_ids, swap):
+            state.submitted_at = time.monotonic()
+
+    def seed_from_archive(self, device_ids=None):
+        """
+        Fits the shared model in the background from the newest ANOMALY_ARCHIVE_SEED_DAYS of
+        archived readings (all archived devices by default); a no-op if the archive is off.
+        """
+        if not self.archive.enabled:
+            return False
+        device_ids = self.archive.devices() if device_ids is None else list(device_ids)
+        if not device_ids:
+            return False
+
+        def swap(result):
+            if result is not None:
+                model, rows = result
+                version = (self.shared.version if self.shared else 0) + 1
+                self.shared = FittedModel(model, version, rows)
+                log_ml_activity(f"Shared anomaly model v{version} fitted on {rows} archived readings")
+
+        fit, device_ids = self._archive_fit(device_ids, ARCHIVE_SEED_MAX_ROWS)
+        return self.retrainer.submit(SHARED_KEY, fit, device_ids, swap)
+
+    def export(self):
+        """Per-device retraining state and fitted models, for checkpoints (buffers are in the rolling windows)."""
+        return {
+            device_id: {
+                "new_samples": state.new_samples,
+                "outlier_rate": state.outlier_rate,
+                "fitted": state.current,
+            }
+            for device_id, state in list(self.devices.items())
+        }
+
+    def record_outcome(self, device_id, is_anomaly):
+        state = self.devices.get(device_id)
+        if state is not None:
+            state.outlier_rate += DRIFT_ALPHA * (is_anomaly - state.outlier_rate)
+
+    def update_and_predict(self, feature_vector, device_id="default"):
+        scaled_features, fitted = self.observe(feature_vector, device_id)
+        if fitted is None:
+            return False, 0.0
+        flags, scores = score_samples(fitted.model, [scaled_features])
+        self.record_outcome(device_id, bool(flags[0]))
+        return bool(flags[0]), float(scores[0]) # True if anomaly
+
+    def _should_refit(self, device_id, state, buffer):
+        if len(buffer) < MIN_FIT_SAMPLES or self.retrainer.busy(device_id):
+            return False
+        if state.current is None:
+            # First fit as soon as there is enough data (retried after a minute if it failed)
+            return state.submitted_at is None or time.monotonic() - state.submitted_at >= 60
+        if state.new_samples < RETRAIN_MIN_NEW_SAMPLES:
+            return False
+        due = time.monotonic() - state.submitted_at >= RETRAIN_INTERVAL_SECONDS
+        drifted = state.outlier_rate >= DRIFT_OUTLIER_RATE
+        return due or drifted
+
+    def _schedule_refit(self, device_id, state, buffer):
+        samples = buffer.snapshot()
+        version = (state.current.version if state.current else 0) + 1
+
+        def swap(model):
+            state.current = FittedModel(model, version, len(samples))
+            state.outlier_rate = 0.0
+            log_ml_activity(f"Anomaly model v{version} for {device_id} fitted on {len(samples)} readings")
+
+        if self.retrainer.submit(device_id, partial(fit_isolation_forest, **self.model_params), samples, swap):
+            state.new_samples = 0
+            state.submitted_at = time.monotonic()
+
+    def fit_offline(self, features):
+        """
+        Fits the shared model on a historical feature matrix (rows in Preprocessor order, e.g.
+        sensor_archive.training_matrix) instead of waiting for 50 live readings per device.
+        Devices use it until their own model is fitted in the background.
+        """
+        features = np.asarray(features, dtype=float)
+        if len(features) < MIN_FIT_SAMPLES:
+            return False
+        scaled = self.preprocessor.scale(features)
+        version = (self.shared.version if self.shared else 0) + 1
+        self.shared = FittedModel(fit_isolation_forest(scaled, **self.model_params), version, len(scaled))
+        log_ml_activity(f"Anomaly model fitted offline on {len(features)} archived readings")
+        return True
+
+    def backtest(self, features):
+        """Anomaly flags and scores of the shared model over a historical feature matrix."""
+        scaled = self.preprocessor.scale(np.asarray(features, dtype=float))
+        return score_samples(self.shared.model, scaled)
+
+    def stats(self):
+        return {
+            "devices": len(self.devices),
+            "max_devices": self.max_devices,
+            "evicted": self.evicted,
+            "shared_version": self.shared.version if self.shared else None,
+            "models": {
+                device_id: {
+                    "version": state.current.version if state.current else None,
+                    "fitted_at": state.current.fitted_at.isoformat() if state.current else None,
+                    "buffered": len(self.windows.peek(device_id, "features") or ()),
+                    "outlier_rate": round(state.outlier_rate, 3),
+                }
+                for device_id, state in list(self.devices.items())[:50]
+            },
+            "retrainer": self.retrainer.stats(),
+        }
 
 # Singleton Instances
 anomaly_detector = IoTAnomalyDetector()
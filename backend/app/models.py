@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Text, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -46,6 +46,11 @@ class Device(Base):
 
 class SensorData(Base):
     __tablename__ = "sensor_data"
+    __table_args__ = (
+        # Per-device latest/range queries, and time-range scans (retention, rollup rebuilds)
+        Index("ix_sensor_data_device_ts", "device_id", "timestamp"),
+        Index("ix_sensor_data_timestamp", "timestamp"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     device_id = Column(String, ForeignKey("devices.id"), nullable=False)
@@ -85,6 +90,38 @@ class Alert(Base):
     # Relationships
     user = relationship("User", back_populates="alerts")
 
+class NotificationOutbox(Base):
+    __tablename__ = "notification_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    alert_id = Column(Integer, ForeignKey("alerts.id"), nullable=True)
+    channel = Column(String, nullable=False) # email, push
+    recipient = Column(String, nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    device_id = Column(String, nullable=True)
+    payload = Column(Text, nullable=False) # JSON
+    status = Column(String, default="pending", index=True) # pending, sending, sent, failed
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, index=True)
+    locked_until = Column(DateTime, nullable=True)
+    claim_token = Column(String, nullable=True, index=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+    alert = relationship("Alert")
+
+class PushSubscription(Base):
+    __tablename__ = "push_subscriptions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    endpoint = Column(Text, unique=True, nullable=False)
+    p256dh = Column(String, nullable=False)
+    auth = Column(String, nullable=False)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class AlertSettings(Base):
     __tablename__ = "alert_settings"
     
@@ -113,4 +150,45 @@ class SafetyLog(Base):
     shift = Column(String, default="A") # A, B, C
     date = Column(String, nullable=False, index=True) # YYYY-MM-DD
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
\ No newline at end of file
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class AlertCooldown(Base):
+    __tablename__ = "alert_cooldowns"
+
+    key = Column(String, primary_key=True) # "<device_id>_<recipient email>"
+    last_sent = Column(DateTime, nullable=False, index=True)
+
+class SensorRollup(Base):
+    __tablename__ = "sensor_rollups"
+    __table_args__ = (UniqueConstraint("device_id", "resolution", "bucket_start", name="uq_sensor_rollup_bucket"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(String, nullable=False, index=True)
+    resolution = Column(String, nullable=False, default="1h") # Bucket width: 1m, 1h or 1d
+    bucket_start = Column(DateTime, nullable=False, index=True)
+    sample_count = Column(Integer, default=0) # Readings in the bucket
+    temperature_sum = Column(Float, default=0.0)
+    temperature_count = Column(Integer, default=0)
+    temperature_min = Column(Float, nullable=True)
+    temperature_max = Column(Float, nullable=True)
+    humidity_sum = Column(Float, default=0.0)
+    humidity_count = Column(Integer, default=0)
+    humidity_min = Column(Float, nullable=True)
+    humidity_max = Column(Float, nullable=True)
+    gas_sum = Column(Float, default=0.0)
+    gas_count = Column(Integer, default=0)
+    gas_min = Column(Float, nullable=True)
+    gas_max = Column(Float, nullable=True)
+    pm2_5_sum = Column(Float, default=0.0)
+    pm2_5_count = Column(Integer, default=0)
+    pm2_5_min = Column(Float, nullable=True)
+    pm2_5_max = Column(Float, nullable=True)
+    # Newest reading in the bucket (answers "same time yesterday / last week")
+    last_ts = Column(DateTime, nullable=True)
+    last_temperature = Column(Float, nullable=True)
+    last_humidity = Column(Float, nullable=True)
+    last_gas = Column(Float, nullable=True)
+    last_pm2_5 = Column(Float, nullable=True)
+    last_rain = Column(Float, nullable=True)
+    last_anomaly_label = Column(String, nullable=True)
+    last_smart_insight = Column(Text, nullable=True)
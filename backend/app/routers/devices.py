@@ -5,6 +5,7 @@ from datetime import datetime
 
 from .. import models, schemas, database
 from ..services.websocket_manager import manager
+from ..services.device_registry import device_registry
 
 router = APIRouter()
 
@@ -26,6 +27,7 @@ def create_device(device: schemas.DeviceCreate, db: Session = Depends(database.g
     db.add(db_device)
     db.commit()
     db.refresh(db_device)
+    device_registry.register([db_device])
     return db_device
 
 @router.get("/devices/{device_id}", response_model=schemas.DeviceResponse, tags=["Devices"])
@@ -47,6 +49,7 @@ def update_device(device_id: str, device_update: schemas.DeviceUpdate, db: Sessi
         setattr(device, key, value)
 
     db.commit()
+    device_registry.invalidate(device_id)
     db.refresh(device)
     return device
 
@@ -59,5 +62,6 @@ def delete_device(device_id: str, db: Session = Depends(database.get_db)):
 
     db.delete(device)
     db.commit()
+    device_registry.invalidate(device_id)
     return {"message": "Device deleted successfully"}
 
@@ -7,6 +7,7 @@ import asyncio
 from typing import List
 from .. import models, database
 from ..services import external_apis
+from ..services.latest_readings import latest_readings
 
 router = APIRouter(
     prefix="/api/pro",
@@ -182,7 +183,7 @@ async def get_pro_current(
             pass
 
     # --- FUSION LOGIC ---
-    latest_reading = db.query(models.SensorData).order_by(models.SensorData.timestamp.desc()).first()
+    latest_reading = latest_readings.get(db)
     local_data = {}
     if latest_reading:
         local_data = {
@@ -6,24 +6,14 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import Optional
-import json
-from pywebpush import webpush, WebPushException
-import os
-from dotenv import load_dotenv
 
 from .. import models, database
 from .auth_v2 import get_current_user
-
-load_dotenv()
+from ..services.push_dispatcher import push_dispatcher
 
 router = APIRouter(prefix="/api/push", tags=["push-notifications"])
 
-# VAPID keys (will be generated and stored in .env)
-VAPID_PRIVATE_KEY = os.getenv("VAPID_PRIVATE_KEY")
-VAPID_PUBLIC_KEY = os.getenv("VAPID_PUBLIC_KEY")
-VAPID_CLAIMS = {
-    "sub": "mailto:sreekar092004@gmail.com"  # Contact email
-}
+# VAPID keys (generated and stored in .env) and signing are handled by push_dispatcher
 
 
 class PushSubscriptionRequest(BaseModel):
@@ -128,14 +118,16 @@ async def unsubscribe_from_push(
 
 
 @router.post("/test")
-async def send_test_notification(
+def send_test_notification(
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """
-    Send a test push notification to the current user
+    Send a test push notification to the current user.
+    A plain def: FastAPI runs it in the threadpool, so the blocking fan-out stays off the
+    event loop and db is only ever used from this one thread.
     """
-    if not VAPID_PRIVATE_KEY or not VAPID_PUBLIC_KEY:
+    if not push_dispatcher.configured:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="VAPID keys not configured. Run generate_vapid_keys.py first."
@@ -164,35 +156,10 @@ async def send_test_notification(
         "data": {"url": "/dashboard"}
     }
 
-    sent_count = 0
-    failed_count = 0
-
-    for sub in subscriptions:
-        try:
-            subscription_info = {
-                "endpoint": sub.endpoint,
-                "keys": {
-                    "p256dh": sub.p256dh,
-                    "auth": sub.auth
-                }
-            }
-
-            webpush(
-                subscription_info=subscription_info,
-                data=json.dumps(payload),
-                vapid_private_key=VAPID_PRIVATE_KEY,
-                vapid_claims=VAPID_CLAIMS
-            )
-            sent_count += 1
-
-        except WebPushException as e:
-            print(f"Push failed for subscription {sub.id}: {e}")
-            failed_count += 1
-            
-            # If subscription is invalid (410 Gone), deactivate it
-            if e.response and e.response.status_code == 410:
-                sub.is_active = False
-                db.commit()
+    # Concurrent fan-out; gone subscriptions are deactivated on db
+    result = push_dispatcher.send(db, subscriptions, payload)
+    sent_count = result["sent"]
+    failed_count = result["failed"]
 
     return {
         "success": True,
@@ -211,47 +178,14 @@ def send_push_notification_to_user(
     Utility function to send push notification to a specific user
     Used by alert system
     """
-    if not VAPID_PRIVATE_KEY or not VAPID_PUBLIC_KEY:
+    if not push_dispatcher.configured:
         print("⚠️ VAPID keys not configured, skipping push notification")
         return False
 
-    # Get user's active subscriptions
-    subscriptions = db.query(models.PushSubscription).filter(
-        models.PushSubscription.user_id == user_id,
-        models.PushSubscription.is_active == True
-    ).all()
-
-    if not subscriptions:
+    result = push_dispatcher.send_to_users(db, [user_id], payload)
+    if not result["sent"] and not result["failed"]:
         print(f"⚠️ No active push subscriptions for user {user_id}")
         return False
 
-    sent_count = 0
-
-    for sub in subscriptions:
-        try:
-            subscription_info = {
-                "endpoint": sub.endpoint,
-                "keys": {
-                    "p256dh": sub.p256dh,
-                    "auth": sub.auth
-                }
-            }
-
-            webpush(
-                subscription_info=subscription_info,
-                data=json.dumps(payload),
-                vapid_private_key=VAPID_PRIVATE_KEY,
-                vapid_claims=VAPID_CLAIMS
-            )
-            sent_count += 1
-            print(f"Push notification sent to user {user_id}")
-
-        except WebPushException as e:
-            print(f"❌ Push failed for subscription {sub.id}: {e}")
-            
-            # If subscription is invalid (410 Gone), deactivate it
-            if e.response and e.response.status_code == 410:
-                sub.is_active = False
-                db.commit()
-
-    return sent_count > 0
+    print(f"Push notification sent to {result['sent']} device(s) of user {user_id}")
+    return result["sent"] > 0
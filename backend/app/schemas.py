@@ -100,6 +100,8 @@ class SensorDataResponse(BaseModel):
     prediction: Optional[dict] = None
     sensor_health: Optional[dict] = None
     baseline: Optional[dict] = None
+    baseline_range: Optional[dict] = None
+    unusualness: Optional[dict] = None
 
     class Config:
         from_attributes = True
@@ -1,4 +1,4 @@
-from .kalman_filter import kalman_filter
+from .kalman_filter import kalman_bank
 from .aqi_calculator import aqi_calculator
 from .fusion_engine import fusion_engine
 from .weather_service import weather_service
@@ -0,0 +1,305 @@
+"""
+Time-Bucket Aggregation
+Server-side bucketed series (mean/min/max/count and optional percentiles) for the
+analytics API. Buckets that are whole multiples of a rollup resolution are combined
+from the rollup tables (partial rollup buckets at the range edges from finer ones, so
+the series ends exactly at `to`); percentiles, metrics without rollups and odd bucket
+widths are computed from a projected raw-column read streamed into NumPy arrays
+(reduceat over time-ordered bucket segments), so no raw rows leave the server either
+way. Raw reads before the archive watermark (closed, archived months) come from the
+Parquet archive, not sensor_data.
+"""
+import re
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from .. import models
+from .rollups import METRICS as ROLLUP_METRICS, RESOLUTIONS, RollupStore, rollup_store
+from .sensor_archive import SensorArchive, sensor_archive
+
+NUMERIC_METRICS = ("temperature", "humidity", "pressure", "wind_speed", "pm2_5", "pm10", "mq_raw", "gas", "rain", "ph", "trust_score")
+NICE_BUCKETS = ("1m", "5m", "15m", "30m", "1h", "3h", "6h", "12h", "1d", "7d")
+UNITS = {"m": 60, "h": 3600, "d": 86400}
+EPOCH = datetime(1970, 1, 1)
+
+
+def parse_bucket(bucket: str) -> int:
+    """'15m' / '6h' / '1d' -> seconds."""
+    match = re.fullmatch(r"(\d+)([mhd])", bucket or "")
+    if not match or int(match.group(1)) == 0:
+        raise ValueError("bucket must look like 5m, 1h or 1d")
+    return int(match.group(1)) * UNITS[match.group(2)]
+
+
+def auto_bucket(start: datetime, end: datetime, max_points: int) -> str:
+    """Smallest 'nice' bucket that keeps the series within max_points."""
+    span = (end - start).total_seconds()
+    for bucket in NICE_BUCKETS:
+        if span / parse_bucket(bucket) <= max_points:
+            return bucket
+    return NICE_BUCKETS[-1]
+
+
+def parse_metrics(metrics: Optional[str]) -> List[str]:
+    names = [m.strip() for m in (metrics or "temperature,humidity,gas").split(",") if m.strip()]
+    unknown = [m for m in names if m not in NUMERIC_METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(unknown)}. Available: {', '.join(NUMERIC_METRICS)}")
+    return list(dict.fromkeys(names))
+
+
+def parse_percentiles(percentiles: Optional[str]) -> List[float]:
+    if not percentiles:
+        return []
+    try:
+        values = [float(p) for p in percentiles.split(",") if p.strip()]
+    except ValueError:
+        raise ValueError("percentiles must be numbers, e.g. 50,95")
+    if any(p < 0 or p > 100 for p in values):
+        raise ValueError("percentiles must be between 0 and 100")
+    return values
+
+
+def _bucket_index(epoch_seconds: np.ndarray, width: int) -> np.ndarray:
+    return (epoch_seconds // width) * width
+
+
+def _rounded(values: np.ndarray) -> list:
+    return [None if np.isnan(v) else round(float(v), 3) for v in values]
+
+
+def _align(ts: datetime, step: int, up: bool = False) -> datetime:
+    seconds = int((ts - EPOCH).total_seconds())
+    aligned = -(-seconds // step) * step if up else seconds // step * step
+    return EPOCH + timedelta(seconds=aligned)
+
+
+def _reduce(seconds: np.ndarray, values_by_metric: Sequence[np.ndarray], metrics: Sequence[str], width: int):
+    """Per-bucket (sums, counts, mins, maxs) of time-ordered raw columns, plus the bucket offsets."""
+    # Rows are time-ordered, so every bucket is one contiguous segment
+    starts, offsets = np.unique(_bucket_index(seconds, width), return_index=True)
+    totals = {}
+    for metric, values in zip(metrics, values_by_metric):
+        present = ~np.isnan(values)
+        totals[metric] = (
+            np.add.reduceat(np.where(present, values, 0.0), offsets),
+            np.add.reduceat(present.astype(np.int64), offsets),
+            np.minimum.reduceat(np.where(present, values, np.inf), offsets),
+            np.maximum.reduceat(np.where(present, values, -np.inf), offsets),
+        )
+    return starts, offsets, totals
+
+
+def _merge(parts: Sequence[tuple], metrics: Sequence[str]):
+    """Combines (starts, totals) parts that may share buckets into one time-ordered (starts, totals)."""
+    parts = [part for part in parts if len(part[0])]
+    if len(parts) == 1:
+        return parts[0]
+    if not parts:
+        return np.empty(0, dtype=np.int64), {}
+    starts, inverse = np.unique(np.concatenate([part[0] for part in parts]), return_inverse=True)
+    totals = {}
+    for metric in metrics:
+        sums = np.zeros(len(starts))
+        counts = np.zeros(len(starts), dtype=np.int64)
+        mins = np.full(len(starts), np.inf)
+        maxs = np.full(len(starts), -np.inf)
+        columns = [np.concatenate([part[1][metric][i] for part in parts]) for i in range(4)]
+        np.add.at(sums, inverse, columns[0])
+        np.add.at(counts, inverse, columns[1])
+        np.minimum.at(mins, inverse, columns[2])
+        np.maximum.at(maxs, inverse, columns[3])
+        totals[metric] = (sums, counts, mins, maxs)
+    return starts, totals
+
+
+def _series(totals: tuple) -> dict:
+    sums, counts, mins, maxs = totals
+    empty = counts == 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(empty, np.nan, sums / counts)
+    return {
+        "mean": _rounded(mean),
+        "min": _rounded(np.where(empty, np.nan, mins)),
+        "max": _rounded(np.where(empty, np.nan, maxs)),
+        "count": counts.astype(int).tolist(),
+    }
+
+
+class Aggregator:
+    def __init__(self, store: RollupStore, archive: Optional[SensorArchive] = None, chunk_rows: int = 10000):
+        self.store = store
+        self.archive = archive
+        self.chunk_rows = chunk_rows
+
+    def rollup_resolution(self, width: int, metrics: Sequence[str], percentiles: Sequence[float]) -> Optional[str]:
+        """Coarsest rollup resolution the bucket is a whole multiple of (None if rollups can't answer)."""
+        if percentiles or any(m not in ROLLUP_METRICS for m in metrics):
+            return None
+        for resolution in reversed(self.store.resolutions):
+            if width % int(RESOLUTIONS[resolution].total_seconds()) == 0:
+                return resolution
+        return None
+
+    def aggregate(self, db: Session, metrics: Sequence[str], start: datetime, end: datetime, bucket: str,
+                  device_id: Optional[str] = None, percentiles: Sequence[float] = ()) -> dict:
+        width = parse_bucket(bucket)
+        resolution = self.rollup_resolution(width, metrics, percentiles)
+        if resolution:
+            starts, totals = self._from_rollups(db, resolution, metrics, start, end, width, device_id)
+            series = {metric: _series(totals[metric]) if len(starts) else {"mean": [], "min": [], "max": [], "count": []}
+                      for metric in metrics}
+            source = f"rollup:{resolution}"
+        else:
+            starts, series = self._from_raw(db, metrics, start, end, width, device_id, percentiles)
+            source = "raw"
+        return {
+            "device_id": device_id,
+            "from": start,
+            "to": end,
+            "bucket": bucket,
+            "source": source,
+            "buckets": [(EPOCH + timedelta(seconds=int(s))).isoformat() for s in starts],
+            "series": series,
+        }
+
+    def _from_rollups(self, db: Session, resolution: str, metrics: Sequence[str], start: datetime, end: datetime,
+                      width: int, device_id: Optional[str]):
+        """
+        (starts, totals) from the rollup buckets that lie wholly inside [start, end); the
+        partial buckets at either edge come from the next finer resolution, or from raw
+        readings below the finest one, so the series stops exactly at end.
+        """
+        step = int(RESOLUTIONS[resolution].total_seconds())
+        first, last = _align(start, step, up=True), _align(end, step)
+        parts, edges = [], [(start, end)]
+        if first < last:
+            parts.append(self._rollup_totals(db, resolution, metrics, first, last, width, device_id))
+            edges = [(start, first), (last, end)]
+
+        finer = [r for r in self.store.resolutions
+                 if RESOLUTIONS[r] < RESOLUTIONS[resolution] and step % int(RESOLUTIONS[r].total_seconds()) == 0]
+        for edge_start, edge_end in edges:
+            if edge_start >= edge_end:
+                continue
+            if finer:
+                parts.append(self._from_rollups(db, finer[-1], metrics, edge_start, edge_end, width, device_id))
+            else:
+                seconds, values_by_metric = self._raw_columns(db, metrics, edge_start, edge_end, device_id)
+                if len(seconds):
+                    starts, _, totals = _reduce(seconds, values_by_metric, metrics, width)
+                    parts.append((starts, totals))
+        return _merge(parts, metrics)
+
+    def _rollup_totals(self, db: Session, resolution: str, metrics: Sequence[str], start: datetime, end: datetime,
+                       width: int, device_id: Optional[str]):
+        deltas = [
+            item for item in self.store.deltas(db, resolution, start, end, device_id)
+            if start <= item[1] < end
+        ]
+        if not deltas:
+            return np.empty(0, dtype=np.int64), {}
+        seconds = np.array([(bucket_start - EPOCH).total_seconds() for _, bucket_start, _ in deltas], dtype=np.int64)
+        starts, inverse = np.unique(_bucket_index(seconds, width), return_inverse=True)
+
+        totals = {}
+        for metric in metrics:
+            sums = np.zeros(len(starts))
+            counts = np.zeros(len(starts), dtype=np.int64)
+            mins = np.full(len(starts), np.inf)
+            maxs = np.full(len(starts), -np.inf)
+            np.add.at(sums, inverse, [d.sums[metric] for _, _, d in deltas])
+            np.add.at(counts, inverse, [d.counts[metric] for _, _, d in deltas])
+            np.minimum.at(mins, inverse, [np.inf if d.mins[metric] is None else d.mins[metric] for _, _, d in deltas])
+            np.maximum.at(maxs, inverse, [-np.inf if d.maxs[metric] is None else d.maxs[metric] for _, _, d in deltas])
+            totals[metric] = (sums, counts, mins, maxs)
+        return starts, totals
+
+    def _raw_columns(self, db: Session, metrics: Sequence[str], start: datetime, end: datetime,
+                     device_id: Optional[str]):
+        """(epoch seconds, [values per metric]) of the raw readings in [start, end), time-ordered."""
+        parts = []
+        watermark = self.archive.archived_until() if self.archive is not None and self.archive.enabled else None
+        if watermark is not None and start < watermark:
+            parts.append(self._archived_columns(metrics, start, min(end, watermark), device_id))
+            start = watermark
+        if start < end:
+            parts.append(self._db_columns(db, metrics, start, end, device_id))
+        parts = [part for part in parts if len(part[0])]
+        if not parts:
+            return np.empty(0, dtype=np.int64), [np.empty(0) for _ in metrics]
+        if len(parts) == 1:
+            return parts[0]
+        seconds = np.concatenate([part[0] for part in parts])
+        return seconds, [np.concatenate([part[1][i] for part in parts]) for i in range(len(metrics))]
+
+    def _archived_columns(self, metrics: Sequence[str], start: datetime, end: datetime, device_id: Optional[str]):
+        blocks = [
+            self.archive.read(device, start, end, ["timestamp", *metrics])
+            for device in ([device_id] if device_id else self.archive.devices())
+        ]
+        blocks = [block for block in blocks if len(block["timestamp"])]
+        if not blocks:
+            return np.empty(0, dtype=np.int64), [np.empty(0) for _ in metrics]
+        seconds = np.concatenate([block["timestamp"] for block in blocks]).astype("datetime64[s]").astype(np.int64)
+        order = np.argsort(seconds, kind="stable")  # devices are read one after another
+        return seconds[order], [np.concatenate([block[m] for block in blocks])[order] for m in metrics]
+
+    def _db_columns(self, db: Session, metrics: Sequence[str], start: datetime, end: datetime, device_id: Optional[str]):
+        """
+        Streams the projected columns in chunks of chunk_rows into arrays preallocated from a
+        COUNT(*) of the range (grown if rows arrive between the count and the read).
+        """
+        table = models.SensorData.__table__
+        conditions = [table.c.timestamp >= start, table.c.timestamp < end]
+        if device_id:
+            conditions.append(table.c.device_id == device_id)
+        size = db.execute(select(func.count()).select_from(table).where(*conditions)).scalar() or 0
+        seconds = np.empty(size, dtype=np.int64)
+        values = [np.empty(size) for _ in metrics]
+        if not size:
+            return seconds, values
+
+        stmt = select(table.c.timestamp, *[table.c[m] for m in metrics]).where(*conditions).order_by(table.c.timestamp)
+        filled = 0
+        for chunk in db.execute(stmt.execution_options(yield_per=self.chunk_rows)).partitions():
+            n = len(chunk)
+            if filled + n > len(seconds):
+                size = max(filled + n, 2 * len(seconds))
+                seconds = np.resize(seconds, size)
+                values = [np.resize(column, size) for column in values]
+            columns = list(zip(*chunk))
+            seconds[filled:filled + n] = np.array(columns[0], dtype="datetime64[us]").astype("datetime64[s]").astype(np.int64)
+            for i, column in enumerate(columns[1:]):
+                values[i][filled:filled + n] = np.array(column, dtype=float)  # None -> NaN
+            filled += n
+        return seconds[:filled], [column[:filled] for column in values]
+
+    def _from_raw(self, db: Session, metrics: Sequence[str], start: datetime, end: datetime, width: int,
+                  device_id: Optional[str], percentiles: Sequence[float]):
+        seconds, values_by_metric = self._raw_columns(db, metrics, start, end, device_id)
+        if not len(seconds):
+            empty = {"mean": [], "min": [], "max": [], "count": []}
+            empty.update({f"p{p:g}": [] for p in percentiles})
+            return [], {metric: dict(empty) for metric in metrics}
+
+        starts, offsets, totals = _reduce(seconds, values_by_metric, metrics, width)
+        series = {}
+        for metric, values in zip(metrics, values_by_metric):
+            result = _series(totals[metric])
+            if percentiles:
+                segments = np.split(values, offsets[1:])
+                for p in percentiles:
+                    result[f"p{p:g}"] = _rounded(np.array([
+                        np.nanpercentile(segment, p) if np.any(~np.isnan(segment)) else np.nan
+                        for segment in segments
+                    ]))
+            series[metric] = result
+        return starts, series
+
+
+aggregator = Aggregator(rollup_store, sensor_archive)
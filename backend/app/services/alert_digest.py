@@ -0,0 +1,122 @@
+"""
+Alert Digest
+Coalesces threshold breaches per recipient over a window (ALERT_DIGEST_WINDOW_SECONDS)
+into a single "digest" outbox entry that tracks every affected device and metric with
+its peak values. When the window closes the outbox delivers one email per digest;
+recipients whose digests have identical content share a single rendered template.
+"""
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from .. import models
+from .notification_outbox import notification_outbox
+
+logger = logging.getLogger(__name__)
+
+Outbox = models.NotificationOutbox
+CHANNEL = "digest"
+
+
+class AlertDigest:
+    def __init__(self, window_seconds: float = 0.0, merge_margin_seconds: float = 2.0):
+        self.window = timedelta(seconds=window_seconds)
+        # Stop merging into a digest this close to its send time (the dispatcher may be claiming it)
+        self.merge_margin = timedelta(seconds=merge_margin_seconds)
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > timedelta(0)
+
+    def _open_digest(self, db: Session, recipient: str, now: datetime) -> Optional[models.NotificationOutbox]:
+        # Digests created earlier in this (unflushed) transaction
+        staged = db.info.setdefault("open_digests", {})
+        if recipient in staged:
+            return staged[recipient]
+        entry = db.query(Outbox).filter(
+            Outbox.channel == CHANNEL,
+            Outbox.recipient == recipient,
+            Outbox.status == "pending",
+            Outbox.next_attempt_at > now + self.merge_margin,
+        ).order_by(Outbox.id.desc()).first()
+        if entry is not None:
+            staged[recipient] = entry
+        return entry
+
+    def collect(self, db: Session, recipient: str, user_id: Optional[int], device, metrics: Dict[str, Tuple[float, float]],
+                reading_ts: datetime, message: str) -> Tuple[models.NotificationOutbox, bool]:
+        """
+        Merges one reading's breaches (metric -> (value, limit)) into the recipient's open
+        digest on db, creating the digest (and an Alert row per newly affected device).
+        Returns (digest entry, whether it was created).
+        """
+        now = datetime.utcnow()
+        entry = self._open_digest(db, recipient, now)
+        created = entry is None
+        if created:
+            payload = {"window_start": now.isoformat(), "devices": {}, "alert_ids": [], "breaches": 0}
+        else:
+            payload = json.loads(entry.payload)
+
+        devices = payload["devices"]
+        device_state = devices.get(device.id)
+        alert = None
+        if device_state is None:
+            device_state = devices[device.id] = {"name": device.name, "metrics": {}}
+            alert = models.Alert(
+                metric=",".join(metrics),
+                value=next(iter(metrics.values()))[0],
+                message=f"[Digest] {message}",
+                recipient_email=recipient,
+                email_sent=False,
+                timestamp=now,
+                user_id=user_id,
+            )
+            db.add(alert)
+            db.flush([alert])  # id is needed to mark it sent with the digest
+            payload["alert_ids"].append(alert.id)
+
+        for metric, (value, limit) in metrics.items():
+            state = device_state["metrics"].get(metric)
+            if state is None:
+                device_state["metrics"][metric] = {"max": value, "min": value, "limit": limit, "count": 1}
+            else:
+                state["max"] = max(state["max"], value)
+                state["min"] = min(state["min"], value)
+                state["limit"] = limit
+                state["count"] += 1
+        payload["breaches"] += 1
+        payload["last_reading"] = reading_ts.isoformat() if reading_ts else now.isoformat()
+
+        if created:
+            entry = notification_outbox.enqueue(
+                db, CHANNEL, payload, recipient=recipient, user_id=user_id, deliver_at=now + self.window
+            )
+            db.info["open_digests"][recipient] = entry
+        elif entry.id is not None and entry not in db.new:
+            # Conditional update: if the dispatcher already claimed the digest, start a new one
+            updated = db.query(Outbox).filter(Outbox.id == entry.id, Outbox.status == "pending").update(
+                {"payload": json.dumps(payload, default=str)}, synchronize_session=False
+            )
+            if not updated:
+                db.info["open_digests"].pop(recipient, None)
+                if alert is not None:
+                    db.delete(alert)
+                return self.collect(db, recipient, user_id, device, metrics, reading_ts, message)
+            set_committed_value(entry, "payload", json.dumps(payload, default=str))
+        else:
+            entry.payload = json.dumps(payload, default=str)
+        return entry, created
+
+
+def digest_content_key(payload: dict) -> str:
+    """Digests with the same key render to the same email and can share one template."""
+    return json.dumps(payload["devices"], sort_keys=True)
+
+
+alert_digest = AlertDigest(window_seconds=float(os.getenv("ALERT_DIGEST_WINDOW_SECONDS", "0")))
@@ -0,0 +1,109 @@
+"""
+Alert Rule Index
+In-memory index of every active AlertSettings row. Each threshold dimension is kept
+as a sorted NumPy array, so the users breached by one reading are found with one
+binary search per dimension instead of a full settings scan.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+# (reading key, AlertSettings column, default when unset, breach direction)
+# "above": breached when value > threshold, "below": breached when value < threshold
+DIMENSIONS = (
+    ("temperature", "temp_threshold", 45.0, "above"),
+    ("gas", "gas_threshold", 2000.0, "above"),
+    ("humidity", "humidity_max", 80.0, "above"),
+    ("humidity", "humidity_min", 20.0, "below"),
+    ("pm2_5", "pm25_threshold", 150.0, "above"),
+    ("wind_speed", "wind_threshold", 30.0, "above"),
+)
+
+
+class _Snapshot:
+    """Immutable index build; swapped in atomically on refresh."""
+
+    def __init__(self, settings: List[models.AlertSettings]):
+        rows = [s for s in settings if s.user_email]
+        self.emails = [s.user_email for s in rows]
+        # thresholds[i, d] = user i's threshold for DIMENSIONS[d]
+        self.thresholds = np.array(
+            [[getattr(s, column) or default for _, column, default, _ in DIMENSIONS] for s in rows],
+            dtype=float,
+        ).reshape(len(rows), len(DIMENSIONS))
+        self.order = np.argsort(self.thresholds, axis=0, kind="stable")
+        self.sorted = np.take_along_axis(self.thresholds, self.order, axis=0)
+
+
+class AlertRuleIndex:
+    def __init__(self, max_age_seconds: float = 60.0):
+        self.max_age = max_age_seconds
+        self._snapshot: Optional[_Snapshot] = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, db: Session):
+        """Rebuilds the index from the active alert settings."""
+        settings = db.query(models.AlertSettings).filter(models.AlertSettings.is_active == True).all()
+        snapshot = _Snapshot(settings)
+        with self._lock:
+            self._snapshot = snapshot
+            self._built_at = time.monotonic()
+        logger.info(f"Alert rule index rebuilt: {len(snapshot.emails)} active configs")
+
+    def _current(self, db: Session) -> _Snapshot:
+        # Rebuild when cold or stale, so other workers/processes pick up settings changes
+        if self._snapshot is None or time.monotonic() - self._built_at > self.max_age:
+            self.refresh(db)
+        return self._snapshot
+
+    def __len__(self):
+        return len(self._snapshot.emails) if self._snapshot else 0
+
+    def breaches(self, db: Session, reading: Dict[str, float], metrics: Optional[set] = None) -> List[dict]:
+        """
+        Returns one entry per breached config: {"user_email", "thresholds", "breached"}.
+        thresholds maps AlertSettings column -> effective value; breached lists the columns crossed.
+        Only dimensions whose reading key is in metrics (default: all present keys) are checked.
+        """
+        snap = self._current(db)
+        if not snap.emails:
+            return []
+
+        hits: Dict[int, List[str]] = {}
+        for d, (key, column, _, direction) in enumerate(DIMENSIONS):
+            if metrics is not None and key not in metrics:
+                continue
+            value = reading.get(key)
+            if value is None:
+                continue
+            col = snap.sorted[:, d]
+            if direction == "above":
+                # threshold < value  <=>  the prefix before the first threshold >= value
+                users = snap.order[:np.searchsorted(col, value, side="left"), d]
+            else:
+                # threshold > value  <=>  the suffix after the last threshold <= value
+                users = snap.order[np.searchsorted(col, value, side="right"):, d]
+            for i in users.tolist():
+                hits.setdefault(i, []).append(column)
+
+        return [
+            {
+                "user_email": snap.emails[i],
+                "thresholds": {column: float(snap.thresholds[i, d]) for d, (_, column, _, _) in enumerate(DIMENSIONS)},
+                "breached": breached,
+            }
+            for i, breached in sorted(hits.items())
+        ]
+
+
+alert_index = AlertRuleIndex(max_age_seconds=float(os.getenv("ALERT_INDEX_MAX_AGE_SECONDS", "60")))
@@ -0,0 +1,130 @@
+"""
+Alert Worker Pool
+Runs alert delivery (history lookup, rendering, SMTP/push) off the request path.
+The notification outbox dispatcher enqueues claimed entries into a bounded queue that
+a configurable thread or process pool drains; jobs beyond the bound are dropped and counted.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AlertWorkerPool:
+    def __init__(self, max_workers: int = 4, max_queue: int = 1000, kind: str = "thread"):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.kind = kind
+        self._handler: Optional[Callable] = None
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+
+        # Stats
+        self.pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self._latencies = deque(maxlen=512)  # enqueue -> done (ms)
+
+    @property
+    def running(self) -> bool:
+        return self._executor is not None
+
+    def start(self, handler: Callable):
+        """
+        handler(*args) runs one job submitted with submit(*args).
+        In process mode it must be a module-level function so it can be pickled.
+        """
+        if self.running:
+            return
+        self._handler = handler
+        if self.kind == "process":
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="alert-worker")
+        logger.info(f"Alert worker pool started ({self.kind}, workers={self.max_workers}, queue={self.max_queue})")
+
+    def free_slots(self) -> int:
+        if not self.running:
+            return 0
+        return max(0, self.max_queue - self.pending)
+
+    def submit(self, *args) -> bool:
+        """Enqueues one job without blocking. Returns False if dropped."""
+        with self._lock:
+            if not self.running or self.pending >= self.max_queue:
+                self.dropped += 1
+                return False
+            self.pending += 1
+            self.submitted += 1
+
+        enqueued_at = time.perf_counter()
+        try:
+            future = self._executor.submit(self._handler, *args)
+        except RuntimeError:
+            # Executor shut down between the check and the submit
+            with self._lock:
+                self.pending -= 1
+                self.dropped += 1
+            return False
+        future.add_done_callback(lambda f: self._on_done(f, enqueued_at))
+        return True
+
+    def _on_done(self, future, enqueued_at: float):
+        latency = (time.perf_counter() - enqueued_at) * 1000.0
+        error = future.exception()
+        with self._lock:
+            self.pending -= 1
+            self._latencies.append(latency)
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+        if error is not None:
+            logger.error(f"Alert job failed: {error}")
+
+    def stop(self, wait: bool = True):
+        """Stops accepting jobs; with wait=True, finishes the queued ones first."""
+        executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                "running": self.running,
+                "kind": self.kind,
+                "workers": self.max_workers,
+                "depth": self.pending,
+                "max_queue": self.max_queue,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "dropped": self.dropped,
+            }
+
+        def pct(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 2)
+
+        stats["job_latency_ms"] = {
+            "p50": pct(0.50),
+            "p95": pct(0.95),
+            "max": round(latencies[-1], 2) if latencies else None,
+        }
+        return stats
+
+
+alert_pool = AlertWorkerPool(
+    max_workers=int(os.getenv("ALERT_WORKERS", "4")),
+    max_queue=int(os.getenv("ALERT_QUEUE_MAX_SIZE", "1000")),
+    kind=os.getenv("ALERT_POOL_KIND", "thread"),
+)
@@ -0,0 +1,122 @@
+"""
+Anomaly Scorer
+Micro-batches IsolationForest scoring for the ingestion endpoints. Readings that
+arrive within a few milliseconds of each other (concurrent posts, a gateway batch)
+are buffered on the event loop; the batch is scored off the loop as one matrix per
+model, and the flag is derived from the same score_samples pass. Callers await a
+future that resolves to (is_anomaly, score).
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..ml_engine import IoTAnomalyDetector, anomaly_detector, score_samples
+
+logger = logging.getLogger(__name__)
+
+
+def _score_groups(groups: Dict[int, Tuple[object, List[np.ndarray]]]) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """Runs in the scorer thread: one score_samples call per model."""
+    return {key: score_samples(model, np.vstack(rows)) for key, (model, rows) in groups.items()}
+
+
+class AnomalyScorer:
+    def __init__(self, detector: IoTAnomalyDetector, window_ms: float = 5.0, max_batch: int = 256):
+        self.detector = detector
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._pending: List[tuple] = []  # (device_id, fitted, scaled row, future)
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()  # running batches (keeps a reference until they finish)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="anomaly-scorer")
+
+        # Stats
+        self.batches = 0
+        self.scored = 0
+        self.unscored = 0
+        self._batch_sizes = deque(maxlen=256)
+        self._latencies = deque(maxlen=256)  # flush -> results (ms)
+
+    async def score(self, feature_vector: Sequence[float], device_id: str = "default") -> Tuple[bool, float]:
+        """Buffers the reading for the device and resolves once its batch has been scored."""
+        scaled, fitted = self.detector.observe(feature_vector, device_id)
+        if fitted is None:
+            self.unscored += 1
+            return False, 0.0
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((device_id, fitted, scaled, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    async def score_many(self, items: Sequence[Tuple[Sequence[float], str]]) -> List[Tuple[bool, float]]:
+        """Scores (feature_vector, device_id) pairs in order; they share batches."""
+        return list(await asyncio.gather(*[self.score(features, device_id) for features, device_id in items]))
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[tuple]):
+        groups: Dict[int, Tuple[object, List[np.ndarray]]] = {}
+        for _, fitted, scaled, _ in batch:
+            groups.setdefault(id(fitted), (fitted.model, []))[1].append(scaled)
+        started = time.perf_counter()
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self._executor, _score_groups, groups)
+        except Exception as e:
+            logger.error(f"Anomaly scoring failed for {len(batch)} readings: {e}")
+            for *_, future in batch:
+                if not future.done():
+                    future.set_result((False, 0.0))
+            return
+
+        self.batches += 1
+        self.scored += len(batch)
+        self._batch_sizes.append(len(batch))
+        self._latencies.append((time.perf_counter() - started) * 1000.0)
+        offsets: Dict[int, int] = {}
+        for device_id, fitted, _, future in batch:
+            i = offsets.get(id(fitted), 0)
+            offsets[id(fitted)] = i + 1
+            flags, scores = results[id(fitted)]
+            is_anomaly = bool(flags[i])
+            self.detector.record_outcome(device_id, is_anomaly)
+            if not future.done():
+                future.set_result((is_anomaly, float(scores[i])))
+
+    def stats(self) -> dict:
+        sizes = list(self._batch_sizes)
+        latencies = sorted(self._latencies)
+        return {
+            "window_ms": self.window * 1000.0,
+            "max_batch": self.max_batch,
+            "batches": self.batches,
+            "scored": self.scored,
+            "unscored": self.unscored,
+            "pending": len(self._pending),
+            "avg_batch": round(sum(sizes) / len(sizes), 1) if sizes else None,
+            "score_ms_p50": round(latencies[len(latencies) // 2], 2) if latencies else None,
+        }
+
+
+anomaly_scorer = AnomalyScorer(
+    anomaly_detector,
+    window_ms=float(os.getenv("ANOMALY_SCORE_WINDOW_MS", "5")),
+    max_batch=int(os.getenv("ANOMALY_SCORE_MAX_BATCH", "256")),
+)
@@ -0,0 +1,202 @@
+"""
+Alert Cooldown Store
+Tracks when an alert was last sent per (device, recipient) key. Senders "claim" a
+cooldown slot before sending, so only one worker wins each slot.
+
+Backends (ALERT_COOLDOWN_BACKEND):
+- memory: per-process LRU + TTL dict (single worker / development)
+- db: alert_cooldowns table on the app database (SQLite/Postgres), shared by every
+  worker and kept across restarts; claims are atomic compare-and-set statements. When
+  the caller passes its session the claim joins that transaction (it commits or rolls
+  back with the staged alert, and SQLite never sees a second writer connection).
+  Expired rows are deleted by the storage maintenance task, not on the claim path.
+"""
+import abc
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+
+class CooldownStore(abc.ABC):
+    """Interface shared by the cooldown backends."""
+
+    def __init__(self, cooldown: timedelta):
+        self.cooldown = cooldown
+
+    @abc.abstractmethod
+    def claim(self, key: str, now: datetime, db: Optional[Session] = None) -> bool:
+        """
+        Atomically takes the slot if nothing was sent within the cooldown. True if claimed.
+        Backends that store cooldowns in the app database run the claim in db's transaction.
+        """
+
+    @abc.abstractmethod
+    def release(self, key: str, claimed_at: datetime):
+        """Gives back a slot claimed at claimed_at (e.g. the send failed)."""
+
+    @abc.abstractmethod
+    def get(self, key: str, db: Optional[Session] = None) -> Optional[datetime]:
+        """Last-sent time of a key, if any."""
+
+    @abc.abstractmethod
+    def snapshot(self) -> Dict[str, datetime]:
+        """Last-sent time of every key still inside its cooldown."""
+
+    @abc.abstractmethod
+    def reset(self) -> int:
+        """Clears every cooldown. Returns the number of entries removed."""
+
+    def prune(self, now: Optional[datetime] = None) -> int:
+        """Deletes expired cooldowns. Returns the number removed (0 for backends that prune inline)."""
+        return 0
+
+
+class MemoryCooldownStore(CooldownStore):
+    def __init__(self, cooldown: timedelta, max_entries: int = 10000):
+        super().__init__(cooldown)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, datetime]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prune(self, now: datetime):
+        # Oldest entries sit at the front: drop expired ones, then trim to capacity
+        while self._entries:
+            key, last_sent = next(iter(self._entries.items()))
+            if now - last_sent < self.cooldown and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+
+    def claim(self, key: str, now: datetime, db: Optional[Session] = None) -> bool:
+        with self._lock:
+            last_sent = self._entries.get(key)
+            if last_sent and now - last_sent < self.cooldown:
+                return False
+            self._entries[key] = now
+            self._entries.move_to_end(key)
+            self._prune(now)
+            return True
+
+    def release(self, key: str, claimed_at: datetime):
+        with self._lock:
+            if self._entries.get(key) == claimed_at:
+                del self._entries[key]
+
+    def get(self, key: str, db: Optional[Session] = None) -> Optional[datetime]:
+        with self._lock:
+            return self._entries.get(key)
+
+    def snapshot(self) -> Dict[str, datetime]:
+        with self._lock:
+            self._prune(datetime.utcnow())
+            return dict(self._entries)
+
+    def reset(self) -> int:
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            return count
+
+
+class SQLCooldownStore(CooldownStore):
+    def __init__(self, engine, cooldown: timedelta):
+        super().__init__(cooldown)
+        self.engine = engine
+        self.table = models.AlertCooldown.__table__
+
+    def _insert_if_absent(self, key: str, now: datetime):
+        """INSERT that does nothing (rowcount 0) when another claimer already created the row."""
+        dialect = self.engine.dialect.name
+        if dialect == "postgresql":
+            return postgresql.insert(self.table).values(key=key, last_sent=now).on_conflict_do_nothing()
+        if dialect == "sqlite":
+            return sqlite.insert(self.table).values(key=key, last_sent=now).on_conflict_do_nothing()
+        return None
+
+    def _claim(self, conn, key: str, now: datetime) -> bool:
+        t = self.table
+        # 1. Take over an expired slot (compare-and-set on last_sent)
+        result = conn.execute(
+            update(t).where(t.c.key == key, t.c.last_sent <= now - self.cooldown).values(last_sent=now)
+        )
+        if result.rowcount == 1:
+            return True
+        # 2. No row yet: the first insert wins
+        stmt = self._insert_if_absent(key, now)
+        if stmt is not None:
+            return conn.execute(stmt).rowcount == 1
+        with conn.begin_nested():
+            conn.execute(insert(t).values(key=key, last_sent=now))
+        return True
+
+    def claim(self, key: str, now: datetime, db: Optional[Session] = None) -> bool:
+        try:
+            if db is None:
+                with self.engine.begin() as conn:
+                    return self._claim(conn, key, now)
+            if self.engine.dialect.name == "sqlite":
+                # A failed statement leaves SQLite's transaction usable, and pysqlite would
+                # turn a SAVEPOINT taken before the session's first write into the outer
+                # transaction (its RELEASE would commit the claim early)
+                return self._claim(db, key, now)
+            # Postgres aborts the whole transaction on an error: confine it to a SAVEPOINT
+            with db.begin_nested():
+                return self._claim(db, key, now)
+        except IntegrityError:
+            return False  # lost the insert race (dialects without ON CONFLICT)
+        except OperationalError as e:
+            # e.g. a locked database: skip this alert rather than fail the caller's transaction
+            logger.error(f"Cooldown claim for {key} failed, treating as not claimed: {e}")
+            return False
+
+    def release(self, key: str, claimed_at: datetime):
+        t = self.table
+        with self.engine.begin() as conn:
+            conn.execute(delete(t).where(t.c.key == key, t.c.last_sent == claimed_at))
+
+    def get(self, key: str, db: Optional[Session] = None) -> Optional[datetime]:
+        t = self.table
+        stmt = select(t.c.last_sent).where(t.c.key == key)
+        if db is not None:
+            return db.execute(stmt).scalar()
+        with self.engine.connect() as conn:
+            return conn.execute(stmt).scalar()
+
+    def prune(self, now: Optional[datetime] = None) -> int:
+        now = now or datetime.utcnow()
+        with self.engine.begin() as conn:
+            return conn.execute(delete(self.table).where(self.table.c.last_sent <= now - self.cooldown)).rowcount
+
+    def snapshot(self) -> Dict[str, datetime]:
+        t = self.table
+        cutoff = datetime.utcnow() - self.cooldown
+        with self.engine.connect() as conn:
+            return {key: last_sent for key, last_sent in
+                    conn.execute(select(t.c.key, t.c.last_sent).where(t.c.last_sent > cutoff))}
+
+    def reset(self) -> int:
+        with self.engine.begin() as conn:
+            return conn.execute(delete(self.table)).rowcount
+
+
+def create_cooldown_store() -> CooldownStore:
+    cooldown = timedelta(minutes=float(os.getenv("ALERT_COOLDOWN_MINUTES", "10")))
+    backend = os.getenv("ALERT_COOLDOWN_BACKEND", "memory").lower()
+    if backend == "db":
+        from ..database import engine
+        return SQLCooldownStore(engine, cooldown)
+    return MemoryCooldownStore(cooldown, max_entries=int(os.getenv("ALERT_COOLDOWN_MAX_ENTRIES", "10000")))
+
+
+cooldown_store = create_cooldown_store()
@@ -0,0 +1,215 @@
+"""
+Dashboard Snapshots
+Precomputed /api/filtered/latest payloads. Whenever the displayed reading changes
+(ESP32_MAIN, else the newest reading of any device), the AQI, health recommendations
+and rainfall prediction are computed once, user threshold breaches are resolved for
+every interested user (anyone who polled recently) with one alert-index lookup, and
+each payload is stored as serialized JSON with an ETag hashed from the bytes (so every
+worker and restart tags the same payload alike). Polls are a dict lookup and answer 304
+when the client's ETag is still current.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .aqi_calculator import aqi_calculator
+from .alert_index import alert_index
+from .latest_readings import LatestReadings, latest_readings
+from .weather_service import weather_service
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_DEVICE = "ESP32_MAIN"
+NO_DATA = {"status": "no_data", "message": "No ESP32 data available"}
+
+
+def _serialize(payload: dict) -> Tuple[str, bytes]:
+    """(ETag, JSON body) of a payload; the tag depends only on the body."""
+    body = json.dumps(payload, separators=(",", ":"), default=str).encode()
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"', body
+
+
+def build_payload(reading: SimpleNamespace) -> dict:
+    """Dashboard payload of one reading without user breaches (the former per-request computation)."""
+    aqi_result = aqi_calculator.calculate_overall_aqi({"pm25": reading.pm2_5})
+    health_recs = aqi_calculator.get_health_recommendations(
+        aqi_result.get("aqi"), aqi_result.get("dominant_pollutant_key")
+    )
+    prediction = weather_service.calculate_rainfall_prediction(
+        reading.humidity,
+        reading.wind_speed or 0.0,
+        reading.pressure or 1013.0
+    )
+    return {
+        "status": "ok",
+        "timestamp": reading.timestamp.isoformat(),
+        "deviceId": reading.device_id,
+        "filtered": {
+            "temperature": reading.temperature,
+            "humidity": reading.humidity,
+            "pm25": reading.pm2_5,
+            "mq_smoothed": reading.pm10,
+            "pressure": reading.pressure,
+            "wind_speed": reading.wind_speed or 0.0
+        },
+        "air_quality": {
+            "aqi": aqi_result.get("aqi"),
+            "category": aqi_result.get("category"),
+            "color": aqi_result.get("color"),
+            "dominant_pollutant": aqi_result.get("dominant_pollutant")
+        },
+        "health": health_recs,
+        "weather": prediction,
+        "smart_metrics": {
+            "trust_score": reading.trust_score,
+            "anomaly_label": reading.anomaly_label,
+            "insight": reading.smart_insight,
+            "ph": reading.ph,
+            "risk_level": "SAFE",
+            "user_breaches": []
+        }
+    }
+
+
+def with_breaches(payload: dict, breaches: List[str]) -> dict:
+    smart_metrics = dict(payload["smart_metrics"], risk_level="CRITICAL" if breaches else "SAFE", user_breaches=breaches)
+    return dict(payload, smart_metrics=smart_metrics)
+
+
+def user_breaches(db: Session, reading: SimpleNamespace) -> Dict[str, List[str]]:
+    """Breach messages per user whose active temperature/gas limits the reading exceeds."""
+    temp = reading.temperature or 0.0
+    gas = reading.gas or 0.0
+    breaches: Dict[str, List[str]] = {}
+    for hit in alert_index.breaches(db, {"temperature": temp, "gas": gas}, metrics={"temperature", "gas"}):
+        messages = breaches.setdefault(hit["user_email"], [])
+        if "temp_threshold" in hit["breached"]:
+            messages.append(f"Temperature exceeds your limit ({temp}°C > {hit['thresholds']['temp_threshold']}°C)")
+        if "gas_threshold" in hit["breached"]:
+            messages.append(f"Gas level exceeds your limit ({gas} > {hit['thresholds']['gas_threshold']})")
+    return breaches
+
+
+class DashboardSnapshots:
+    def __init__(self, readings: LatestReadings, interest_ttl_seconds: float = 3600.0, max_users: int = 10000):
+        self.readings = readings
+        self.interest_ttl = interest_ttl_seconds
+        self.max_users = max_users
+        self.session_factory = None
+        self.version = 0
+        self._reading: Optional[SimpleNamespace] = None
+        self._payload: dict = NO_DATA
+        self._base: Tuple[str, bytes] = _serialize(NO_DATA)      # (ETag, payload) without user breaches
+        self._bodies: Dict[str, Tuple[str, bytes]] = {}          # interested user -> (ETag, payload), _base when unbreached
+        self._interest: Dict[str, float] = {}            # user email -> monotonic time of last poll
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.served = 0
+        self.not_modified = 0
+
+    def attach(self, session_factory):
+        """Rebuilds on every change of the latest readings; sessions are only used for alert-index refreshes."""
+        self.session_factory = session_factory
+        self.readings.add_listener(self.on_readings_changed)
+
+    def _displayed(self) -> Optional[SimpleNamespace]:
+        return self.readings.peek(PRIMARY_DEVICE) or self.readings.peek()
+
+    def on_readings_changed(self):
+        reading = self._displayed()
+        if reading is not None and reading is not self._reading:
+            self.publish(reading)
+
+    # --- Building ---
+    def _prune_interest(self):
+        cutoff = time.monotonic() - self.interest_ttl
+        for email in [e for e, seen in self._interest.items() if seen < cutoff]:
+            del self._interest[email]
+        if len(self._interest) > self.max_users:
+            for email, _ in sorted(self._interest.items(), key=lambda item: item[1])[:len(self._interest) - self.max_users]:
+                del self._interest[email]
+
+    def publish(self, reading: SimpleNamespace, db: Optional[Session] = None):
+        """Builds and swaps in the payloads of a new reading."""
+        with self._lock:
+            if self._reading is not None and reading.timestamp is not None and self._reading.timestamp is not None \
+                    and reading.timestamp < self._reading.timestamp and reading.device_id == self._reading.device_id:
+                return  # a slower ingest thread lost the race
+            self._prune_interest()
+            breaches = {}
+            if self._interest:
+                own_session = db is None
+                db = db or self.session_factory()
+                try:
+                    breaches = user_breaches(db, reading)
+                finally:
+                    if own_session:
+                        db.close()
+            payload = build_payload(reading)
+            base = _serialize(payload)
+            self._bodies = {
+                email: _serialize(with_breaches(payload, breaches[email])) if email in breaches else base
+                for email in self._interest
+            }
+            self._payload = payload
+            self._base = base
+            self._reading = reading
+            self.version += 1
+            self.builds += 1
+
+    def refresh(self, db: Session):
+        """Re-renders the current reading, e.g. after alert settings changed."""
+        reading = self._reading or self._displayed()
+        if reading is not None:
+            self.publish(reading, db)
+
+    # --- Serving ---
+    def get(self, db: Session, user_email: Optional[str] = None) -> Tuple[str, bytes]:
+        """(ETag, serialized payload) for a user; registers the user's interest."""
+        self.readings.ensure_loaded(db)  # cold start / multi-worker refresh (publishes via the listener)
+        if self._reading is None:
+            reading = self._displayed()
+            if reading is None:
+                return self._base
+            self.publish(reading, db)
+        self.served += 1
+        if not user_email:
+            with self._lock:
+                return self._base
+        with self._lock:
+            self._interest[user_email] = time.monotonic()
+            body = self._bodies.get(user_email)
+            if body is None:
+                # First poll of this user: render their payload once, later versions include it
+                breaches = user_breaches(db, self._reading).get(user_email)
+                body = _serialize(with_breaches(self._payload, breaches)) if breaches else self._base
+                self._bodies[user_email] = body
+            return body
+
+    def record_not_modified(self):
+        """Counts a poll answered with 304 (the route compares the ETag)."""
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "builds": self.builds,
+            "interested_users": len(self._interest),
+            "served": self.served,
+            "not_modified": self.not_modified,
+        }
+
+
+dashboard_snapshots = DashboardSnapshots(
+    latest_readings,
+    interest_ttl_seconds=float(os.getenv("DASHBOARD_INTEREST_TTL_SECONDS", "3600")),
+    max_users=int(os.getenv("DASHBOARD_MAX_USERS", "10000")),
+)
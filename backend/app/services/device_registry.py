@@ -0,0 +1,218 @@
+"""
+Device Registry
+In-memory cache of device and user-id resolution for the ingestion hot path.
+Loaded at startup, invalidated by the device CRUD routes, and flushes buffered
+last_seen/status updates to the database in batches instead of once per reading.
+
+Other workers do not see a route's invalidation, so cached entries are re-read from
+the database once they are older than entry_ttl seconds, and a flush only writes what
+readings changed (last_seen/status, a location the device reported, a user link for a
+device that has none) - never cached copies of fields a user may have edited elsewhere.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceEntry:
+    """Cached view of a devices row (exposes the same attributes ingestion reads from models.Device)."""
+    __slots__ = ("id", "name", "user_id", "lat", "lon", "status", "last_seen", "loaded_at")
+
+    def __init__(self, id, name, user_id=None, lat=None, lon=None, status=None, last_seen=None):
+        self.id = id
+        self.name = name
+        self.user_id = user_id
+        self.lat = lat
+        self.lon = lon
+        self.status = status
+        self.last_seen = last_seen
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def from_model(cls, device: models.Device) -> "DeviceEntry":
+        return cls(device.id, device.name, device.user_id, device.lat, device.lon, device.status, device.last_seen)
+
+
+class DeviceRegistry:
+    def __init__(self, flush_interval: float = 5.0, user_miss_ttl: float = 60.0, entry_ttl: float = 60.0):
+        self.flush_interval = flush_interval
+        self.user_miss_ttl = user_miss_ttl
+        self.entry_ttl = entry_ttl
+        self._devices: Dict[str, DeviceEntry] = {}
+        self._user_ids: Dict[str, int] = {}          # email -> user id
+        self._user_misses: Dict[str, float] = {}     # email -> monotonic time of last failed lookup
+        self._pending: Dict[str, dict] = {}          # device id -> columns readings changed since the last flush
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    # --- Loading / invalidation ---
+    def load(self, db: Session):
+        """Warms the cache with every device and user id."""
+        devices = db.query(models.Device).all()
+        users = db.query(models.User.id, models.User.email).all()
+        with self._lock:
+            self._devices = {d.id: DeviceEntry.from_model(d) for d in devices}
+            self._user_ids = {email: uid for uid, email in users}
+            self._user_misses.clear()
+            self.loaded = True
+        logger.info(f"Device registry loaded: {len(self._devices)} devices, {len(self._user_ids)} users")
+
+    def invalidate(self, device_id: Optional[str] = None):
+        """Drops one cached device (or all of them) so the next reading re-reads it from the DB."""
+        with self._lock:
+            if device_id is None:
+                self._devices.clear()
+            else:
+                self._devices.pop(device_id, None)
+
+    def register(self, devices: Iterable[models.Device]):
+        """Caches devices after they have been committed."""
+        with self._lock:
+            for device in devices:
+                self._devices[device.id] = DeviceEntry.from_model(device)
+
+    # --- Lookups ---
+    def get_many(self, db: Session, device_ids: Iterable[str]) -> Dict[str, DeviceEntry]:
+        """
+        Returns cached entries, loading misses and entries older than entry_ttl with a
+        single query. Unknown (e.g. deleted) ids are omitted.
+        """
+        device_ids = list(device_ids)
+        cutoff = time.monotonic() - self.entry_ttl
+        with self._lock:
+            found = {
+                d: self._devices[d] for d in device_ids
+                if d in self._devices and self._devices[d].loaded_at >= cutoff
+            }
+        missing = [d for d in device_ids if d not in found]
+        if missing:
+            rows = db.query(models.Device).filter(models.Device.id.in_(missing)).all()
+            loaded = {d.id: DeviceEntry.from_model(d) for d in rows}
+            with self._lock:
+                for device_id in missing:
+                    entry = loaded.get(device_id)
+                    if entry is None:
+                        self._devices.pop(device_id, None)  # deleted on another worker
+                        continue
+                    cached = self._devices.get(device_id)
+                    if cached is None or cached.loaded_at < cutoff:
+                        self._devices[device_id] = cached = entry
+                    found[device_id] = cached
+        return found
+
+    def user_ids_for(self, db: Session, emails: Iterable[str]) -> Dict[str, int]:
+        """Resolves user ids by email, querying only emails that are neither cached nor recently missed."""
+        now = time.monotonic()
+        result = {}
+        to_query = []
+        with self._lock:
+            for email in set(e for e in emails if e):
+                if email in self._user_ids:
+                    result[email] = self._user_ids[email]
+                elif now - self._user_misses.get(email, float("-inf")) > self.user_miss_ttl:
+                    to_query.append(email)
+        if to_query:
+            rows = db.query(models.User.id, models.User.email).filter(models.User.email.in_(to_query)).all()
+            with self._lock:
+                for uid, email in rows:
+                    self._user_ids[email] = uid
+                    self._user_misses.pop(email, None)
+                    result[email] = uid
+                for email in to_query:
+                    if email not in result:
+                        self._user_misses[email] = now
+        return result
+
+    # --- Buffered status updates ---
+    def touch(self, entry: DeviceEntry, last_seen, status: str = "online", lat=None, lon=None, user_id=None):
+        """Records a reading for a cached device; written to the DB on the next flush."""
+        with self._lock:
+            pending = self._pending.setdefault(entry.id, {})
+            entry.last_seen = pending["last_seen"] = last_seen
+            entry.status = pending["status"] = status
+            if lat and lon:
+                entry.lat = pending["lat"] = lat
+                entry.lon = pending["lon"] = lon
+            if user_id and not entry.user_id:
+                entry.user_id = pending["user_id"] = user_id
+
+    def flush(self, db: Session) -> int:
+        """
+        Writes the buffered reading updates: last_seen/status for every touched device, the
+        location where a reading reported one, and user links only where none is set yet.
+        One executemany UPDATE per kind.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        table = models.Device.__table__
+        statements = [
+            (
+                update(table).where(table.c.id == bindparam("b_id")).values(
+                    last_seen=bindparam("last_seen"), status=bindparam("status")),
+                [{"b_id": d, "last_seen": p["last_seen"], "status": p["status"]} for d, p in pending.items()],
+            ),
+            (
+                update(table).where(table.c.id == bindparam("b_id")).values(lat=bindparam("lat"), lon=bindparam("lon")),
+                [{"b_id": d, "lat": p["lat"], "lon": p["lon"]} for d, p in pending.items() if "lat" in p],
+            ),
+            (
+                update(table).where(table.c.id == bindparam("b_id"), table.c.user_id.is_(None)).values(
+                    user_id=bindparam("user_id")),
+                [{"b_id": d, "user_id": p["user_id"]} for d, p in pending.items() if "user_id" in p],
+            ),
+        ]
+        try:
+            for stmt, rows in statements:
+                if rows:
+                    db.execute(stmt, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                for device_id, columns in pending.items():
+                    # Keep anything newer that was buffered meanwhile
+                    self._pending[device_id] = {**columns, **self._pending.get(device_id, {})}
+            raise
+        return len(pending)
+
+    async def run_flusher(self, session_factory):
+        """Background task: flushes buffered device updates every flush_interval seconds."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self._flush_with_session, session_factory)
+            except Exception as e:
+                logger.error(f"Device registry flush failed: {e}")
+
+    def _flush_with_session(self, session_factory):
+        db = session_factory()
+        try:
+            self.flush(db)
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "devices": len(self._devices),
+            "users": len(self._user_ids),
+            "pending_updates": len(self._pending),
+        }
+
+
+device_registry = DeviceRegistry(
+    flush_interval=float(os.getenv("DEVICE_TOUCH_FLUSH_SECONDS", "5")),
+    entry_ttl=float(os.getenv("DEVICE_CACHE_TTL_SECONDS", "60")),
+)
@@ -1,19 +1,27 @@
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
 from dotenv import load_dotenv
 import logging
 
+from .smtp_pool import SMTPConnectionPool
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
 class EmailService:
     def __init__(self):
-        self.smtp_server = "smtp.gmail.com"
-        self.smtp_port = 587
+        self.smtp_server = os.getenv("SMTP_HOST", "smtp.gmail.com")
+        self.smtp_port = int(os.getenv("SMTP_PORT", "587"))
         self.sender_email = os.getenv("EMAIL_USER")
         self.sender_password = os.getenv("EMAIL_PASS").replace(" ", "") if os.getenv("EMAIL_PASS") else None
+        # Shared by every email path (alerts, OTP, signup)
+        self.pool = SMTPConnectionPool(
+            self.smtp_server, self.smtp_port, self.sender_email, self.sender_password,
+            max_connections=int(os.getenv("SMTP_POOL_SIZE", "4")),
+            idle_timeout=float(os.getenv("SMTP_IDLE_TIMEOUT_SECONDS", "240")),
+            noop_after=float(os.getenv("SMTP_NOOP_AFTER_SECONDS", "30")),
+        )
         
         if not self.sender_email or not self.sender_password:
             logger.warning("⚠️ Email Service: Credentials missing in .env")
@@ -235,20 +243,14 @@ class EmailService:
             msg['Subject'] = f"{title}: {device_name}"
             msg.attach(MIMEText(html_body, 'html'))
 
-            print(f"🔄 SMTP: Connecting to {self.smtp_server}:{self.smtp_port}...")
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
-            print("🔑 SMTP: Logging in...")
-            server.login(self.sender_email, self.sender_password)
-            
             for recipient in recipients:
+                del msg['To']
                 msg['To'] = recipient
                 print(f"📨 SMTP: Sending to {recipient}...")
-                server.sendmail(self.sender_email, recipient, msg.as_string())
+                self.pool.sendmail(self.sender_email, recipient, msg.as_string())
                 logger.info(f"📧 Rich Email sent to {recipient}")
                 print(f"✅ SMTP: Sent to {recipient}")
 
-            server.quit()
             return True
 
         except Exception as e:
@@ -267,11 +269,8 @@ def send_email_notification(to_email, subject, body):
     msg['To'] = to_email
 
     try:
-        with smtplib.SMTP(email_notifier.smtp_server, email_notifier.smtp_port) as server:
-            server.starttls()
-            server.login(email_notifier.sender_email, email_notifier.sender_password)
-            server.sendmail(email_notifier.sender_email, [to_email], msg.as_string())
-            logger.info(f"📧 Legacy Email sent to {to_email}")
+        email_notifier.pool.sendmail(email_notifier.sender_email, [to_email], msg.as_string())
+        logger.info(f"📧 Legacy Email sent to {to_email}")
         return True
     except Exception as e:
         logger.error(f"❌ Legacy Email Error: {e}")
@@ -0,0 +1,216 @@
+"""
+Structured Event Log
+Buffered JSON-lines logger for the alert/ML activity trail (alert_system.log).
+Callers only append a record to an in-memory ring buffer; a background thread
+writes batches through one open file handle and rotates the file by size and age.
+With several worker processes each one writes and rotates its own file
+(alert_system.<pid>.log), so no process renames a file another is still writing;
+files left behind by processes that have exited are removed once they are older
+than the rotation keeps files (rotate_seconds * (backups + 1)).
+Chatty categories can be sampled (EVENT_LOG_SAMPLE_<CATEGORY>, 0..1); warnings and
+errors are always kept. If the buffer fills faster than it drains the oldest
+records are dropped (and counted) instead of blocking the caller.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "alert_system.log")
+
+
+class EventLogger:
+    def __init__(self, path: str, buffer_size: int = 10000, flush_interval: float = 1.0, batch_size: int = 500,
+                 max_bytes: int = 10 * 1024 * 1024, rotate_seconds: float = 86400.0, backups: int = 5,
+                 sample_rates: Optional[Dict[str, float]] = None, per_process: bool = True):
+        self.base_path = path
+        self.per_process = per_process
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backups = backups
+        self.sample_rates = sample_rates or {}
+        self._buffer = deque(maxlen=buffer_size)  # append/popleft are thread-safe
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()               # serialises writers (thread + explicit flush)
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None             # process that started the writer thread
+        self._file = None
+        self._opened_at = 0.0
+
+        # Stats
+        self.logged = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.written = 0
+        self.rotations = 0
+
+    def log(self, category: str, message: str, level: str = "info", **fields):
+        """Queues one record; never blocks on I/O."""
+        rate = self.sample_rates.get(category, 1.0)
+        if level == "info" and rate < 1.0 and random.random() >= rate:
+            self.sampled_out += 1
+            return
+        record = {"ts": datetime.utcnow().isoformat(timespec="milliseconds"), "cat": category, "level": level, "msg": message}
+        if fields:
+            record.update(fields)
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(record)
+        self.logged += 1
+        if self._thread is None or self._pid != os.getpid():
+            self._start()
+        elif len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    @property
+    def path(self) -> str:
+        """File this process writes to."""
+        if not self.per_process:
+            return self.base_path
+        root, ext = os.path.splitext(self.base_path)
+        return f"{root}.{os.getpid()}{ext}"
+
+    def _start(self):
+        if self._pid is not None and self._pid != os.getpid():
+            # Forked child: the writer thread and file handle belong to the parent
+            self._lock = threading.Lock()
+            self._wake = threading.Event()
+            self._stop = threading.Event()
+            self._file = None
+            self._thread = None
+        with self._lock:
+            if self._thread is None:
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Writes everything buffered so far in batched writes."""
+        with self._lock:
+            while self._buffer:
+                lines = []
+                while self._buffer and len(lines) < self.batch_size:
+                    lines.append(json.dumps(self._buffer.popleft(), ensure_ascii=False, default=str))
+                try:
+                    self._write("\n".join(lines) + "\n")
+                    self.written += len(lines)
+                except Exception as e:
+                    self.dropped += len(lines)
+                    logger.error(f"Event log write failed: {e}")
+                    self._close_file()
+
+    def _write(self, data: str):
+        if self._file is not None and self._should_rotate():
+            self._rotate()
+        if self._file is None:
+            if self._opened_at == 0.0:
+                self._remove_stale_files()
+            self._file = open(self.path, "a", encoding="utf-8")
+            self._opened_at = time.time()
+        self._file.write(data)
+        self._file.flush()
+
+    def _should_rotate(self) -> bool:
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            return True
+        return bool(self.rotate_seconds) and time.time() - self._opened_at >= self.rotate_seconds
+
+    def _rotate(self):
+        self._close_file()
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.rotations += 1
+
+    def _remove_stale_files(self):
+        """Deletes the per-process files (and their backups) of exited processes past the retention."""
+        if not self.per_process or not self.rotate_seconds or os.name != "posix":
+            return
+        root, ext = os.path.splitext(self.base_path)
+        cutoff = time.time() - self.rotate_seconds * (self.backups + 1)
+        for path in glob.glob(f"{glob.escape(root)}.*{ext}*"):
+            pid = path[len(root) + 1:].split(".", 1)[0]
+            if not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                os.kill(int(pid), 0)
+                continue  # still running
+            except ProcessLookupError:
+                pass
+            except OSError:
+                continue  # running under another user
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception:
+                pass
+            self._file = None
+
+    def close(self):
+        """Stops the writer thread and flushes what is left (called at exit)."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+        with self._lock:
+            self._close_file()
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "buffered": len(self._buffer),
+            "logged": self.logged,
+            "written": self.written,
+            "sampled_out": self.sampled_out,
+            "dropped": self.dropped,
+            "rotations": self.rotations,
+        }
+
+
+def _sample_rates() -> Dict[str, float]:
+    prefix = "EVENT_LOG_SAMPLE_"
+    return {key[len(prefix):].lower(): float(value) for key, value in os.environ.items() if key.startswith(prefix)}
+
+
+event_log = EventLogger(
+    os.getenv("EVENT_LOG_FILE", DEFAULT_LOG_FILE),
+    buffer_size=int(os.getenv("EVENT_LOG_BUFFER_SIZE", "10000")),
+    flush_interval=float(os.getenv("EVENT_LOG_FLUSH_SECONDS", "1")),
+    max_bytes=int(os.getenv("EVENT_LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+    rotate_seconds=float(os.getenv("EVENT_LOG_ROTATE_SECONDS", "86400")),
+    backups=int(os.getenv("EVENT_LOG_BACKUPS", "5")),
+    sample_rates=_sample_rates(),
+    per_process=os.getenv("EVENT_LOG_PER_PROCESS", "true").lower() == "true",
+)
+atexit.register(event_log.close)
@@ -0,0 +1,334 @@
+"""
+Historical Context Service
+Answers "same time yesterday / same time last week / 7-day mean" for a device from
+per-device hourly aggregates that are updated incrementally at ingest, instead of
+re-reading a week of raw sensor_data rows per alert or dashboard request.
+
+Hourly buckets live in memory with running 7-day totals and are loaded from the
+1h rows of sensor_rollups, re-read every rollup flush interval so every worker
+sees what the others flushed; persisting new readings is left to the RollupStore
+(services/rollups.py). The rendered context (incl. narrative) is cached for a short TTL.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .. import models
+from .api_cache import APICache
+from .rollups import RollupStore, rollup_store, sample_of
+
+logger = logging.getLogger(__name__)
+
+RESOLUTION = "1h"
+BUCKET = timedelta(hours=1)
+WINDOW = timedelta(days=7)
+MATCH_WINDOW = timedelta(minutes=30)  # "same time" = newest reading within ±30 min
+
+METRICS = ("temperature", "humidity", "gas")
+LAST_FIELDS = ("temperature", "humidity", "gas", "rain", "anomaly_label", "smart_insight")
+
+
+def floor_hour(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+class _Bucket:
+    """Sums/counts of one hour plus its newest reading."""
+    __slots__ = ("sums", "counts", "last_ts", "last")
+
+    def __init__(self):
+        self.sums = [0.0] * len(METRICS)
+        self.counts = [0] * len(METRICS)
+        self.last_ts: Optional[datetime] = None
+        self.last: Optional[dict] = None
+
+    def add(self, sample: dict):
+        for i, metric in enumerate(METRICS):
+            value = sample.get(metric)
+            if value is not None:
+                self.sums[i] += value
+                self.counts[i] += 1
+        self.set_last(sample["timestamp"], sample)
+
+    def set_last(self, ts: Optional[datetime], values: Optional[dict]):
+        if ts is not None and (self.last_ts is None or ts >= self.last_ts):
+            self.last_ts = ts
+            self.last = {field: values.get(field) for field in LAST_FIELDS}
+
+    @classmethod
+    def from_row(cls, row: models.SensorRollup) -> "_Bucket":
+        bucket = cls()
+        for i, metric in enumerate(METRICS):
+            bucket.sums[i] = getattr(row, f"{metric}_sum") or 0.0
+            bucket.counts[i] = getattr(row, f"{metric}_count") or 0
+        bucket.set_last(row.last_ts, {field: getattr(row, f"last_{field}") for field in LAST_FIELDS})
+        return bucket
+
+
+class _DeviceHistory:
+    """Hourly buckets of one device and running totals over the 7-day window."""
+
+    def __init__(self):
+        self.buckets: Dict[datetime, _Bucket] = {}
+        self.week_sums = [0.0] * len(METRICS)
+        self.week_counts = [0] * len(METRICS)
+        self.cutoff: Optional[datetime] = None  # oldest bucket start counted in the totals
+
+    def bucket(self, start: datetime) -> _Bucket:
+        bucket = self.buckets.get(start)
+        if bucket is None:
+            bucket = self.buckets[start] = _Bucket()
+        return bucket
+
+    def add(self, start: datetime, sums, counts):
+        if self.cutoff is not None and start < self.cutoff:
+            return
+        for i in range(len(METRICS)):
+            self.week_sums[i] += sums[i]
+            self.week_counts[i] += counts[i]
+
+    def add_sample(self, start: datetime, sample: dict):
+        if start not in self.buckets:
+            self.advance(start - WINDOW)
+        if self.cutoff is not None and start < self.cutoff - BUCKET:
+            return False
+        self.bucket(start).add(sample)
+        if self.cutoff is not None and start < self.cutoff:
+            return True
+        for i, metric in enumerate(METRICS):
+            value = sample.get(metric)
+            if value is not None:
+                self.week_sums[i] += value
+                self.week_counts[i] += 1
+        return True
+
+    def advance(self, cutoff: datetime):
+        """
+        Slides the window forward, subtracting buckets that fell out of it. The hour
+        before the window is kept (uncounted) for same-time-last-week lookups.
+        """
+        if self.cutoff is not None and cutoff <= self.cutoff:
+            return
+        previous, self.cutoff = self.cutoff, cutoff
+        for start in [s for s in self.buckets if s < cutoff]:
+            if previous is None or start >= previous:
+                expired = self.buckets[start]
+                for i in range(len(METRICS)):
+                    self.week_sums[i] -= expired.sums[i]
+                    self.week_counts[i] -= expired.counts[i]
+            if start < cutoff - BUCKET:
+                del self.buckets[start]
+
+    def nearest(self, target: datetime) -> Tuple[Optional[datetime], Optional[dict]]:
+        """Newest reading of the target's hour or the hour before, whichever is closer (within ±30 min)."""
+        best_ts, best = None, None
+        for start in (floor_hour(target), floor_hour(target) - BUCKET):
+            bucket = self.buckets.get(start)
+            if bucket is None or bucket.last_ts is None:
+                continue
+            distance = abs(bucket.last_ts - target)
+            if distance <= MATCH_WINDOW and (best_ts is None or distance < abs(best_ts - target)):
+                best_ts, best = bucket.last_ts, bucket.last
+        return best_ts, best
+
+
+class HistoricalContextService:
+    def __init__(self, store: RollupStore, ttl_seconds: int = 30):
+        self.store = store
+        self._devices: Dict[str, _DeviceHistory] = {}
+        self._cache = APICache(ttl_seconds=ttl_seconds)
+        self._lock = threading.Lock()
+        self.loaded = False
+        self._loaded_at = 0.0
+        self.records = 0
+
+    # --- Ingest ---
+    sample = staticmethod(sample_of)
+
+    def record_many(self, samples: Iterable[dict]):
+        """
+        Adds committed readings to their hourly buckets and the running 7-day totals,
+        and hands them to the rollup store for persistence.
+        """
+        samples = list(samples)
+        self.store.record_many(samples)
+        with self._lock:
+            for sample in samples:
+                ts = sample.get("timestamp")
+                if ts is None:
+                    continue
+                start = floor_hour(ts)
+                history = self._devices.get(sample["device_id"])
+                if history is None:
+                    history = self._devices[sample["device_id"]] = _DeviceHistory()
+                if history.add_sample(start, sample):
+                    self.records += 1
+
+    def record(self, sample: dict):
+        self.record_many([sample])
+
+    # --- Loading ---
+    def load(self, db: Session):
+        """Loads the last 7 days of hourly rollups; on the first load, backfills them from sensor_data if the table is empty."""
+        cutoff = floor_hour(datetime.utcnow()) - WINDOW
+        if not self.loaded and db.query(models.SensorRollup.id).first() is None \
+                and db.query(models.SensorData.id).first() is not None:
+            # One-off migration (older history: scripts/backfill_rollups.py)
+            self.store.rebuild(db, since=cutoff - BUCKET)
+        rows = db.query(models.SensorRollup).filter(
+            models.SensorRollup.resolution == RESOLUTION,
+            models.SensorRollup.bucket_start >= cutoff - BUCKET,
+        ).all()
+
+        devices: Dict[str, _DeviceHistory] = {}
+        for row in rows:
+            history = devices.setdefault(row.device_id, _DeviceHistory())
+            history.cutoff = cutoff
+            bucket = history.buckets[row.bucket_start] = _Bucket.from_row(row)
+            history.add(row.bucket_start, bucket.sums, bucket.counts)
+
+        with self._lock:
+            # Keep readings recorded locally but not yet flushed
+            for device_id, start, pending in self.store.pending(RESOLUTION):
+                if start < cutoff - BUCKET:
+                    continue
+                history = devices.setdefault(device_id, _DeviceHistory())
+                history.cutoff = history.cutoff or cutoff
+                bucket = history.bucket(start)
+                sums = [pending.sums[metric] for metric in METRICS]
+                counts = [pending.counts[metric] for metric in METRICS]
+                for i in range(len(METRICS)):
+                    bucket.sums[i] += sums[i]
+                    bucket.counts[i] += counts[i]
+                bucket.set_last(pending.last_ts, pending.last or {})
+                history.add(start, sums, counts)
+            self._devices = devices
+            self._cache.clear()
+            self.loaded = True
+            self._loaded_at = time.monotonic()
+
+        logger.info(f"Historical context loaded: {len(self._devices)} devices, {len(rows)} hourly rollups")
+
+    def _ensure_loaded(self, db: Session):
+        # Every worker re-reads the flushed rollups once per flush interval (load() merges this
+        # worker's unflushed deltas on top), so readings ingested by other workers show up too
+        stale = time.monotonic() - self._loaded_at > self.store.flush_interval
+        if not self.loaded or stale:
+            self.load(db)
+
+    # --- Queries ---
+    def context(self, db: Session, device_id: Optional[str] = None, now: Optional[datetime] = None) -> dict:
+        """
+        Same-time-last-week and same-time-yesterday readings, 7-day averages and the
+        narrative for one device (or all devices when device_id is None).
+        """
+        key = device_id or "*"
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        self._ensure_loaded(db)
+        now = now or datetime.utcnow()
+        with self._lock:
+            if device_id is None:
+                histories = list(self._devices.values())
+            else:
+                histories = [self._devices[device_id]] if device_id in self._devices else []
+            cutoff = floor_hour(now) - WINDOW
+            for history in histories:
+                history.advance(cutoff)
+
+            sums = [sum(h.week_sums[i] for h in histories) for i in range(len(METRICS))]
+            counts = [sum(h.week_counts[i] for h in histories) for i in range(len(METRICS))]
+            week_avg = {
+                metric: round(sums[i] / counts[i], 1) if counts[i] else None
+                for i, metric in enumerate(METRICS)
+            }
+            last_week = self._nearest(histories, now - timedelta(days=7))
+            yesterday = self._nearest(histories, now - timedelta(days=1))
+
+        context = {
+            "last_week": last_week,
+            "yesterday": yesterday,
+            "week_averages": week_avg,
+            "last_week_day": (now - timedelta(days=7)).strftime("%A"),
+            "time_str": now.strftime("%I:%M %p"),
+            "generated_at": now.isoformat(),
+        }
+        context["narrative"] = self._narrative(context)
+        self._cache.set(key, context)
+        return context
+
+    @staticmethod
+    def _nearest(histories: List[_DeviceHistory], target: datetime) -> Optional[dict]:
+        best_ts, best = None, None
+        for history in histories:
+            ts, values = history.nearest(target)
+            if ts is not None and (best_ts is None or abs(ts - target) < abs(best_ts - target)):
+                best_ts, best = ts, values
+        if best is None:
+            return None
+        return {
+            "timestamp": best_ts.isoformat(),
+            "temperature": round(best["temperature"], 1) if best.get("temperature") is not None else None,
+            "humidity": round(best["humidity"], 1) if best.get("humidity") is not None else None,
+            "gas": round(best["gas"], 1) if best.get("gas") is not None else None,
+            "rain": best.get("rain"),
+            "anomaly_label": best.get("anomaly_label") or "Normal",
+            "smart_insight": best.get("smart_insight") or "",
+        }
+
+    @staticmethod
+    def _narrative(context: dict) -> str:
+        lines = []
+        day_name = context["last_week_day"]
+        time_str = context["time_str"]
+        last_week_snap = context["last_week"]
+        yesterday_snap = context["yesterday"]
+        week_avg = context["week_averages"]
+
+        if last_week_snap and last_week_snap.get("temperature") is not None:
+            lw_insight = last_week_snap.get("smart_insight") or ""
+            lines.append(
+                f"📅 Last {day_name} at {time_str}: Temperature was {last_week_snap['temperature']}°C, "
+                f"Humidity {last_week_snap.get('humidity', 'N/A')}%, Gas {last_week_snap.get('gas', 'N/A')} ppm. "
+                f"Status: {last_week_snap.get('anomaly_label') or 'Normal'}."
+                + (f" AI noted: {lw_insight}" if lw_insight else "")
+            )
+        else:
+            lines.append(f"📅 No data recorded last {day_name} at this time.")
+
+        if yesterday_snap and yesterday_snap.get("temperature") is not None:
+            lines.append(
+                f"🕐 Yesterday at {time_str}: Temperature was {yesterday_snap['temperature']}°C, "
+                f"Humidity {yesterday_snap.get('humidity', 'N/A')}%. Status: {yesterday_snap.get('anomaly_label') or 'Normal'}."
+            )
+        else:
+            lines.append(f"🕐 No data recorded yesterday at this time.")
+
+        if week_avg.get("temperature") is not None:
+            lines.append(
+                f"📊 7-Day Averages: Temperature {week_avg['temperature']}°C, "
+                f"Humidity {week_avg['humidity']}%, Gas {week_avg['gas']} ppm."
+            )
+
+        return " | ".join(lines)
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "devices": len(self._devices),
+            "buckets": sum(len(h.buckets) for h in self._devices.values()),
+            "records": self.records,
+        }
+
+
+historical_service = HistoricalContextService(
+    rollup_store,
+    ttl_seconds=int(os.getenv("HISTORY_CONTEXT_TTL_SECONDS", "30")),
+)
@@ -0,0 +1,232 @@
+"""
+Write-Behind Ingestion Queue
+Bounded in-process queue that decouples the /iot/data response from the database
+commit. A single writer task drains the queue and commits rows in groups, either
+when a group reaches batch_size items or max_wait_ms after its first item arrived.
+Failed groups are retried with exponential backoff, then split so that only rows
+that fail on their own are handed to the dead-letter hook; stop() commits the group
+in progress and everything still queued.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    def __init__(self, max_size: int = 10000, batch_size: int = 200, max_wait_ms: int = 250,
+                 max_retries: int = 5, retry_backoff_seconds: float = 0.5):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff_seconds
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._group: List[Any] = []  # items taken off the queue but not yet committed (drained by stop)
+        self._committing = False
+        self._closing = False
+        self._persist: Optional[Callable[[List[Any]], Any]] = None
+        self._after_commit: Optional[Callable[[List[Any], Any], Awaitable[None]]] = None
+        self._dead_letter: Optional[Callable[[List[Any], Exception], None]] = None
+
+        # Stats
+        self.enqueued = 0
+        self.rejected = 0
+        self.committed_rows = 0
+        self.failed_rows = 0
+        self.retries = 0
+        self.batches = 0
+        self._latencies = deque(maxlen=512)  # commit latency (ms) of recent groups
+        self._batch_sizes = deque(maxlen=512)
+
+    @property
+    def running(self) -> bool:
+        return self._writer is not None and not self._writer.done()
+
+    def start(self, persist: Callable[[List[Any]], Any], after_commit: Optional[Callable[[List[Any], Any], Awaitable[None]]] = None,
+              dead_letter: Optional[Callable[[List[Any], Exception], None]] = None):
+        """
+        Starts the writer task. persist(items) runs in a worker thread and must commit
+        the whole group or nothing; after_commit(items, result) runs on the event loop
+        afterwards. dead_letter(items, error) receives rows that still fail on their own
+        after the retries (it runs in a worker thread).
+        """
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._persist = persist
+        self._after_commit = after_commit
+        self._dead_letter = dead_letter
+        self._closing = False
+        self._writer = asyncio.create_task(self._run())
+        logger.info(f"Write-behind queue started (batch={self.batch_size}, wait={int(self.max_wait * 1000)}ms, max={self.max_size})")
+
+    def free_slots(self) -> int:
+        if self._queue is None:
+            return 0
+        return self.max_size - self._queue.qsize()
+
+    def submit(self, item: Any) -> bool:
+        """Enqueues one item without blocking. Returns False if the queue is full or not running."""
+        if not self.running or self._closing:
+            self.rejected += 1
+            return False
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    async def _fill_group(self):
+        """Moves queued items into self._group until batch_size, or max_wait after the first one."""
+        loop = asyncio.get_running_loop()
+        if not self._group:
+            self._group.append(await self._queue.get())
+        deadline = loop.time() + self.max_wait
+        while len(self._group) < self.batch_size:
+            try:
+                self._group.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                self._group.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def _try_persist(self, items: List[Any]):
+        return await asyncio.to_thread(self._persist, items)
+
+    async def _commit_group(self):
+        """
+        Commits self._group. A failing group is retried with exponential backoff; if it
+        still fails it is split in halves recursively, so only the rows that fail on their
+        own are dead-lettered and the rest are stored.
+        """
+        group = self._group
+        started = time.perf_counter()
+        committed: List[tuple] = []  # (items, persist result)
+        self._committing = True
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    committed.append((group, await self._try_persist(group)))
+                    break
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        logger.error(f"Write-behind commit of {len(group)} rows failed {attempt + 1} times, isolating bad rows: {e}")
+                        await self._bisect(group, committed, e)
+                        break
+                    delay = self.retry_backoff * 2 ** attempt
+                    self.retries += 1
+                    logger.warning(f"Write-behind commit of {len(group)} rows failed, retrying in {delay:.1f}s: {e}")
+                    await asyncio.sleep(delay)
+        finally:
+            self._committing = False
+            self._group = []
+            for _ in group:
+                self._queue.task_done()
+
+        stored = sum(len(items) for items, _ in committed)
+        self._latencies.append((time.perf_counter() - started) * 1000.0)
+        self._batch_sizes.append(stored)
+        self.committed_rows += stored
+        self.batches += 1
+
+        if self._after_commit:
+            for items, result in committed:
+                try:
+                    await self._after_commit(items, result)
+                except Exception as e:
+                    logger.error(f"Write-behind post-commit hook failed: {e}")
+
+    async def _bisect(self, items: List[Any], committed: List[tuple], error: Exception):
+        if len(items) == 1:
+            self.failed_rows += 1
+            logger.error(f"Write-behind row dead-lettered: {error}")
+            if self._dead_letter:
+                try:
+                    await asyncio.to_thread(self._dead_letter, items, error)
+                except Exception as e:
+                    logger.error(f"Write-behind dead-letter hook failed: {e}")
+            return
+        mid = len(items) // 2
+        for half in (items[:mid], items[mid:]):
+            try:
+                committed.append((half, await self._try_persist(half)))
+            except Exception as e:
+                await self._bisect(half, committed, e)
+
+    async def _run(self):
+        while not self._closing:
+            await self._fill_group()
+            await self._commit_group()
+
+    async def stop(self):
+        """Stops accepting items, commits the group in progress and whatever is still queued."""
+        if not self.running:
+            return
+        self._closing = True
+        if self._committing:
+            await asyncio.shield(self._writer)  # let the commit in flight finish; the loop then exits
+        else:
+            self._writer.cancel()  # waiting for items; anything collected stays in self._group
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+        while self._group or not self._queue.empty():
+            while len(self._group) < self.batch_size and not self._queue.empty():
+                self._group.append(self._queue.get_nowait())
+            await self._commit_group()
+        self._writer = None
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def pct(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 2)
+
+        return {
+            "running": self.running,
+            "depth": self._queue.qsize() if self._queue else 0,
+            "max_size": self.max_size,
+            "batch_size": self.batch_size,
+            "max_wait_ms": int(self.max_wait * 1000),
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "committed_rows": self.committed_rows,
+            "failed_rows": self.failed_rows,
+            "retries": self.retries,
+            "batches": self.batches,
+            "avg_batch_size": round(sum(self._batch_sizes) / len(self._batch_sizes), 1) if self._batch_sizes else None,
+            "commit_latency_ms": {
+                "last": round(self._latencies[-1], 2) if self._latencies else None,
+                "p50": pct(0.50),
+                "p95": pct(0.95),
+                "max": round(latencies[-1], 2) if latencies else None,
+            },
+        }
+
+
+# Shared instance (enabled with IOT_WRITE_BEHIND=true)
+ingest_queue = WriteBehindQueue(
+    max_size=int(os.getenv("INGEST_QUEUE_MAX_SIZE", "10000")),
+    batch_size=int(os.getenv("INGEST_COMMIT_BATCH_SIZE", "200")),
+    max_wait_ms=int(os.getenv("INGEST_COMMIT_MAX_WAIT_MS", "250")),
+    max_retries=int(os.getenv("INGEST_COMMIT_RETRIES", "5")),
+    retry_backoff_seconds=float(os.getenv("INGEST_COMMIT_RETRY_BACKOFF_SECONDS", "0.5")),
+)
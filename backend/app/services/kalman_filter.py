@@ -1,82 +1,209 @@
-import numpy as np
-
-class KalmanFilter:
-    def __init__(self):
-        # Initialize Kalman filter parameters
-        self.x = np.zeros((2, 1))  # State estimate
-        self.P = np.eye(2)         # Covariance matrix
-        self.F = np.array([[1, 1], [0, 1]])  # State transition matrix
-        self.H = np.array([[1, 0]])          # Measurement matrix
-        self.Q = np.eye(2) * 0.1             # Process noise covariance
-        self.R = np.array([[0.1]])           # Measurement noise covariance
-
-    def filter_temperature(self, measurement):
-        """Apply Kalman filter to temperature data"""
-        # Prediction step
-        self.x = self.F @ self.x
-        self.P = self.F @ self.P @ self.F.T + self.Q
-
-        # Update step
-        S = self.H @ self.P @ self.H.T + self.R
-        K = self.P @ self.H.T @ np.linalg.inv(S)
-        self.x = self.x + K @ (measurement - self.H @ self.x)
-        self.P = (np.eye(2) - K @ self.H) @ self.P
+"""
+Kalman Filter Bank
+Independent constant-velocity Kalman filters per (device_id, metric), with all
+states packed in NumPy arrays so many devices are stepped in one vectorized
+predict/update. Each filter is seeded with its device's first measurement. Devices
+idle for longer than max_idle_seconds are dropped by the periodic storage maintenance
+job; when the bank is full the least recently used device is evicted.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence
 
-        return float(self.x[0, 0]), float(np.sqrt(self.P[0, 0]))
-
-    def filter_humidity(self, measurement):
-        """Apply Kalman filter to humidity data"""
-        # Prediction step
-        self.x = self.F @ self.x
-        self.P = self.F @ self.P @ self.F.T + self.Q
+import numpy as np
 
-        # Update step
-        S = self.H @ self.P @ self.H.T + self.R
-        K = self.P @ self.H.T @ np.linalg.inv(S)
-        self.x = self.x + K @ (measurement - self.H @ self.x)
-        self.P = (np.eye(2) - K @ self.H) @ self.P
 
-        return float(self.x[0, 0]), float(np.sqrt(self.P[0, 0]))
+class KalmanFilterBank:
+    METRICS = ("temperature", "humidity", "pm25")
+
+    def __init__(self, max_devices: int = 1024, mq_window: int = 5, max_idle_seconds: float = 86400.0):
+        self.max_devices = max_devices
+        self.max_idle_seconds = max_idle_seconds
+        self.mq_window = mq_window
+        n_metrics = len(self.METRICS)
+
+        # Model (shared by every filter)
+        self.F = np.array([[1.0, 1.0], [0.0, 1.0]])  # State transition matrix
+        self.Q = np.eye(2) * 0.1                      # Process noise covariance
+        self.R = 0.1                                  # Measurement noise (H = [1, 0])
+
+        # Packed state: one row per device slot, one filter per metric
+        self.x = np.zeros((max_devices, n_metrics, 2))
+        self.P = np.tile(np.eye(2), (max_devices, n_metrics, 1, 1))
+        self.initialized = np.zeros((max_devices, n_metrics), dtype=bool)
+
+        # MQ moving-average window per device slot
+        self.mq_buffer = np.zeros((max_devices, mq_window))
+        self.mq_initialized = np.zeros(max_devices, dtype=bool)
+
+        self._slots: "OrderedDict[str, int]" = OrderedDict()  # device_id -> row (LRU order)
+        self._last_seen: Dict[str, float] = {}
+        self._free: List[int] = list(range(max_devices - 1, -1, -1))
+        self._lock = threading.Lock()
+        # restore_hook(device_id) -> saved filter state or None; consulted when a device gets a slot
+        self.restore_hook: Optional[Callable[[str], Optional[dict]]] = None
+
+    # --- Slot management ---
+    def _reset_slot(self, row: int):
+        self.x[row] = 0.0
+        self.P[row] = np.eye(2)
+        self.initialized[row] = False
+        self.mq_buffer[row] = 0.0
+        self.mq_initialized[row] = False
+
+    def _slot_for(self, device_id: str) -> int:
+        row = self._slots.get(device_id)
+        if row is not None:
+            self._slots.move_to_end(device_id)
+        else:
+            if not self._free:
+                # Evict the least recently used device
+                evicted, row = self._slots.popitem(last=False)
+                self._last_seen.pop(evicted, None)
+            else:
+                row = self._free.pop()
+            self._reset_slot(row)
+            self._slots[device_id] = row
+            state = self.restore_hook(device_id) if self.restore_hook else None
+            if state is not None:
+                self._load_slot(row, state)
+        self._last_seen[device_id] = time.monotonic()
+        return row
+
+    def evict_idle(self, max_idle_seconds: Optional[float] = None) -> int:
+        """Drops devices that have not reported within max_idle_seconds (default: the bank's). Returns the count evicted."""
+        if max_idle_seconds is None:
+            max_idle_seconds = self.max_idle_seconds
+        if max_idle_seconds <= 0:
+            return 0
+        cutoff = time.monotonic() - max_idle_seconds
+        with self._lock:
+            idle = [d for d, seen in self._last_seen.items() if seen < cutoff]
+            for device_id in idle:
+                self._free.append(self._slots.pop(device_id))
+                del self._last_seen[device_id]
+        return len(idle)
+
+    def __len__(self):
+        return len(self._slots)
+
+    # --- Checkpointing ---
+    def export(self) -> Dict[str, dict]:
+        """Copies of the filter state of every device in the bank."""
+        with self._lock:
+            return {
+                device_id: {
+                    "x": self.x[row].copy(),
+                    "P": self.P[row].copy(),
+                    "initialized": self.initialized[row].copy(),
+                    "mq_buffer": self.mq_buffer[row].copy(),
+                    "mq_initialized": bool(self.mq_initialized[row]),
+                }
+                for device_id, row in self._slots.items()
+            }
+
+    def _load_slot(self, row: int, state: dict):
+        self.x[row] = state["x"]
+        self.P[row] = state["P"]
+        self.initialized[row] = state["initialized"]
+        if len(state["mq_buffer"]) == self.mq_window:
+            self.mq_buffer[row] = state["mq_buffer"]
+            self.mq_initialized[row] = state["mq_initialized"]
+
+    # --- Vectorized filtering ---
+    def _step(self, rows: np.ndarray, z: np.ndarray):
+        """
+        One predict/update for every (row, metric) in z (shape: len(rows) x n_metrics).
+        A fresh filter starts at its first measurement with zero velocity; the former
+        per-device filter started at x = 0, so its first outputs were pulled toward zero
+        (about 5% of the reading on the first step) until that start-up error died out.
+        """
+        fresh = ~self.initialized[rows]
+        if fresh.any():
+            x = self.x[rows]
+            x[..., 0] = np.where(fresh, z, x[..., 0])
+            self.x[rows] = x
+            self.initialized[rows] = True
 
-    def filter_pm25(self, measurement):
-        """Apply Kalman filter to PM2.5 data"""
         # Prediction step
-        self.x = self.F @ self.x
-        self.P = self.F @ self.P @ self.F.T + self.Q
-
-        # Update step
-        S = self.H @ self.P @ self.H.T + self.R
-        K = self.P @ self.H.T @ np.linalg.inv(S)
-        self.x = self.x + K @ (measurement - self.H @ self.x)
-        self.P = (np.eye(2) - K @ self.H) @ self.P
-
-        return float(self.x[0, 0]), float(np.sqrt(self.P[0, 0]))
-
-    def clean_mq_data(self, raw_value):
-        """Clean and filter MQ gas sensor data"""
-        # Simple moving average filter
-        window_size = 5
-        if not hasattr(self, 'mq_buffer'):
-            self.mq_buffer = [raw_value] * window_size
-
-        self.mq_buffer.pop(0)
-        self.mq_buffer.append(raw_value)
-
-        smoothed_value = sum(self.mq_buffer) / window_size
-
-        # Z-score for outlier detection
-        mean = sum(self.mq_buffer) / window_size
-        variance = sum((x - mean) ** 2 for x in self.mq_buffer) / window_size
-        std_dev = np.sqrt(variance) if variance > 0 else 1
-        z_score = (raw_value - mean) / std_dev if std_dev > 0 else 0
-
-        is_outlier = abs(z_score) > 2
-
-        return {
-            "smoothed": float(smoothed_value),
-            "is_outlier": bool(is_outlier),
-            "z_score": float(z_score)
-        }
-
-# Initialize Kalman filter instance
-kalman_filter = KalmanFilter()
\ No newline at end of file
+        x = self.x[rows] @ self.F.T
+        P = self.F @ self.P[rows] @ self.F.T + self.Q
+
+        # Update step (H = [1, 0] so S is scalar and no matrix inverse is needed)
+        S = P[..., 0, 0] + self.R
+        K = P[..., :, 0] / S[..., None]
+        y = z - x[..., 0]
+        x = x + K * y[..., None]
+        P = P - K[..., :, None] * P[..., None, 0, :]
+
+        self.x[rows] = x
+        self.P[rows] = P
+        return x[..., 0].copy(), np.sqrt(P[..., 0, 0])
+
+    def _clean_mq(self, rows: np.ndarray, raw: np.ndarray):
+        """Moving-average smoothing and z-score outlier check of MQ gas readings."""
+        fresh = ~self.mq_initialized[rows]
+        if fresh.any():
+            self.mq_buffer[rows[fresh]] = raw[fresh, None]
+            self.mq_initialized[rows[fresh]] = True
+
+        buf = self.mq_buffer[rows]
+        buf = np.concatenate([buf[:, 1:], raw[:, None]], axis=1)
+        self.mq_buffer[rows] = buf
+
+        mean = buf.mean(axis=1)
+        std = buf.std(axis=1)
+        std = np.where(std > 0, std, 1.0)
+        z_score = (raw - mean) / std
+        return mean, z_score, np.abs(z_score) > 2
+
+    def filter_batch(self, device_ids: Sequence[str], values: np.ndarray, mq_raw: np.ndarray) -> List[dict]:
+        """
+        Filters a batch of readings. values has one column per METRICS entry.
+        Readings for the same device are applied in order; distinct devices are
+        stepped together in one vectorized pass.
+        """
+        values = np.asarray(values, dtype=float).reshape(len(device_ids), len(self.METRICS))
+        mq_raw = np.asarray(mq_raw, dtype=float).reshape(len(device_ids))
+        results: List[Optional[dict]] = [None] * len(device_ids)
+
+        with self._lock:
+            # Split into waves so each wave holds at most one reading per device
+            waves: List[List[int]] = []
+            depth: Dict[str, int] = {}
+            for i, device_id in enumerate(device_ids):
+                d = depth.get(device_id, 0)
+                depth[device_id] = d + 1
+                if d == len(waves):
+                    waves.append([])
+                waves[d].append(i)
+
+            for wave in waves:
+                idx = np.array(wave)
+                rows = np.array([self._slot_for(device_ids[i]) for i in wave])
+                filtered, confidence = self._step(rows, values[idx])
+                smoothed, z_score, is_outlier = self._clean_mq(rows, mq_raw[idx])
+
+                for k, i in enumerate(wave):
+                    result = {
+                        metric: (float(filtered[k, m]), float(confidence[k, m]))
+                        for m, metric in enumerate(self.METRICS)
+                    }
+                    result["mq"] = {
+                        "smoothed": float(smoothed[k]),
+                        "is_outlier": bool(is_outlier[k]),
+                        "z_score": float(z_score[k])
+                    }
+                    results[i] = result
+
+        return results
+
+    def filter_reading(self, device_id: str, temperature: float, humidity: float, pm25: float, mq_raw: float) -> dict:
+        """Filters a single reading for one device."""
+        return self.filter_batch([device_id], [[temperature, humidity, pm25]], [mq_raw])[0]
+
+
+# Initialize the shared filter bank
+kalman_bank = KalmanFilterBank(max_idle_seconds=float(os.getenv("KALMAN_MAX_IDLE_HOURS", "24")) * 3600)
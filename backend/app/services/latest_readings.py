@@ -0,0 +1,174 @@
+"""
+Latest Readings
+In-memory registry of the newest sensor reading per device (and overall), updated by
+the ingestion paths after every commit. Dashboard polling, the fusion endpoints and the
+assistant's status answer read from here instead of sorting sensor_data for the top
+row. The registry is filled from the database once on a cold start. With several
+worker processes, reads check MAX(sensor_data.id) (a primary-key lookup) at most every
+LATEST_READING_CHECK_SECONDS and pull in only the devices with rows newer than the
+highest id seen, so readings ingested by another worker show up within that interval;
+a full reload every LATEST_READING_REFRESH_SECONDS covers ids committed out of order.
+"""
+import logging
+import os
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+# Every column except the primary key (not assigned until flush, expired after commit)
+FIELDS = tuple(column.name for column in models.SensorData.__table__.columns if column.name != "id")
+
+
+def snapshot(measurement) -> SimpleNamespace:
+    """Detached copy of a SensorData row exposing the same attributes; take it before the commit."""
+    return SimpleNamespace(**{field: getattr(measurement, field) for field in FIELDS})
+
+
+class LatestReadings:
+    def __init__(self, refresh_seconds: float = 60.0, check_seconds: float = 1.0):
+        self.refresh_seconds = refresh_seconds
+        self.check_seconds = check_seconds
+        self._devices: Dict[str, SimpleNamespace] = {}
+        self._newest: Optional[SimpleNamespace] = None
+        self._lock = threading.Lock()
+        self._loaded_at: Optional[float] = None
+        self._checked_at = 0.0
+        self._max_id = 0  # highest sensor_data id read from the database
+        self._listeners: List[Callable[[], None]] = []
+        self.hits = 0
+        self.loads = 0
+        self.catch_ups = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    # --- Loading ---
+    @staticmethod
+    def _newest_rows(db: Session, after_id: int = 0, up_to_id: Optional[int] = None) -> List[models.SensorData]:
+        """Newest row of every device with rows in (after_id, up_to_id] (one index lookup per device via the group-by)."""
+        newest = db.query(models.SensorData.device_id, func.max(models.SensorData.timestamp).label("timestamp"))
+        if after_id:
+            newest = newest.filter(models.SensorData.id > after_id)
+        if up_to_id is not None:
+            newest = newest.filter(models.SensorData.id <= up_to_id)
+        newest = newest.group_by(models.SensorData.device_id).subquery()
+        return db.query(models.SensorData).join(
+            newest,
+            (models.SensorData.device_id == newest.c.device_id) & (models.SensorData.timestamp == newest.c.timestamp),
+        ).order_by(models.SensorData.id).all()
+
+    def load(self, db: Session):
+        """Reads the newest row of every device."""
+        max_id = db.query(func.max(models.SensorData.id)).scalar() or 0
+        rows = self._newest_rows(db, up_to_id=max_id)
+        devices = {row.device_id: snapshot(row) for row in rows}  # highest id wins on equal timestamps
+        with self._lock:
+            # Keep anything ingested while the query ran
+            for device_id, reading in self._devices.items():
+                if self._is_newer(reading, devices.get(device_id)):
+                    devices[device_id] = reading
+            self._devices = devices
+            self._newest = max(devices.values(), key=lambda r: r.timestamp, default=None)
+            self._max_id = max(self._max_id, max_id)
+            self._loaded_at = self._checked_at = time.monotonic()
+            self.loads += 1
+        self._notify()
+
+    def catch_up(self, db: Session) -> int:
+        """Merges in the devices with rows above the highest id seen (e.g. from other workers); returns how many."""
+        self._checked_at = time.monotonic()
+        max_id = db.query(func.max(models.SensorData.id)).scalar() or 0
+        if max_id <= self._max_id:
+            return 0
+        rows = self._newest_rows(db, after_id=self._max_id, up_to_id=max_id)
+        self._max_id = max(self._max_id, max_id)
+        self.catch_ups += 1
+        self.record_many([snapshot(row) for row in rows])
+        return len(rows)
+
+    def ensure_loaded(self, db: Session):
+        now = time.monotonic()
+        if not self.loaded or (self.refresh_seconds > 0 and now - self._loaded_at > self.refresh_seconds):
+            self.load(db)
+        elif self.check_seconds > 0 and now - self._checked_at > self.check_seconds:
+            self.catch_up(db)
+
+    # --- Ingestion ---
+    @staticmethod
+    def _is_newer(reading: SimpleNamespace, current: Optional[SimpleNamespace]) -> bool:
+        if current is None:
+            return True
+        if reading.timestamp is None:
+            return False
+        return current.timestamp is None or reading.timestamp >= current.timestamp
+
+    def record(self, reading: SimpleNamespace):
+        self.record_many([reading])
+
+    def record_many(self, readings: Iterable[SimpleNamespace]):
+        """Registers committed readings (snapshots), keeping the newest per device."""
+        changed = False
+        with self._lock:
+            for reading in readings:
+                if self._is_newer(reading, self._devices.get(reading.device_id)):
+                    self._devices[reading.device_id] = reading
+                    changed = True
+                if self._is_newer(reading, self._newest):
+                    self._newest = reading
+        if changed:
+            self._notify()
+
+    # --- Listeners ---
+    def add_listener(self, callback: Callable[[], None]):
+        """callback() runs after every change, on the ingesting thread."""
+        self._listeners.append(callback)
+
+    def _notify(self):
+        for callback in self._listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Latest reading listener failed: {e}")
+
+    # --- Reads ---
+    def get(self, db: Session, device_id: Optional[str] = None) -> Optional[SimpleNamespace]:
+        """Newest reading of a device (or of any device); None when there is none."""
+        self.ensure_loaded(db)
+        self.hits += 1
+        if device_id is None:
+            return self._newest
+        return self._devices.get(device_id)
+
+    def peek(self, device_id: Optional[str] = None) -> Optional[SimpleNamespace]:
+        """Like get, without loading or refreshing (None on a cold registry)."""
+        if device_id is None:
+            return self._newest
+        return self._devices.get(device_id)
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "devices": len(self._devices),
+            "newest": self._newest.timestamp.isoformat() if self._newest and self._newest.timestamp else None,
+            "reads": self.hits,
+            "loads": self.loads,
+            "catch_ups": self.catch_ups,
+            "max_id": self._max_id,
+            "refresh_seconds": self.refresh_seconds,
+            "check_seconds": self.check_seconds,
+        }
+
+
+latest_readings = LatestReadings(
+    refresh_seconds=float(os.getenv("LATEST_READING_REFRESH_SECONDS", "60")),
+    check_seconds=float(os.getenv("LATEST_READING_CHECK_SECONDS", "1")),
+)
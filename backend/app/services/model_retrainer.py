@@ -0,0 +1,116 @@
+"""
+Model Retrainer
+Runs anomaly-model fits off the event loop in a process (or thread) pool. Callers
+submit a picklable fit function and a snapshot of the training samples per key
+(device); at most one fit per key is in flight, and the fitted model is handed to
+the caller's callback, which swaps it in. Inference keeps using the previous model
+until then.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRetrainer:
+    def __init__(self, max_workers: int = 1, kind: str = "process"):
+        self.max_workers = max_workers
+        self.kind = kind
+        self._executor: Optional[Executor] = None
+        self._in_flight: Dict[str, float] = {}  # key -> submit time
+        self._lock = threading.Lock()
+
+        # Stats
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self._durations = deque(maxlen=128)  # submit -> swapped (ms)
+
+    @property
+    def running(self) -> bool:
+        return self._executor is not None
+
+    def start(self):
+        with self._lock:
+            if self._executor is not None:
+                return
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="model-fit")
+        logger.info(f"Model retrainer started ({self.kind}, workers={self.max_workers})")
+
+    def busy(self, key: str) -> bool:
+        return key in self._in_flight
+
+    def submit(self, key: str, fit: Callable, samples, on_done: Callable) -> bool:
+        """
+        Runs fit(samples) in the pool and calls on_done(model) with the result (on a pool
+        callback thread). fit must be a module-level function in process mode.
+        Returns False if a fit for key is already running.
+        """
+        if not self.running:
+            self.start()
+        with self._lock:
+            if key in self._in_flight:
+                return False
+            self._in_flight[key] = time.perf_counter()
+            self.submitted += 1
+        try:
+            future = self._executor.submit(fit, samples)
+        except RuntimeError:
+            # Executor shut down between the check and the submit
+            with self._lock:
+                self._in_flight.pop(key, None)
+            return False
+        future.add_done_callback(lambda f: self._on_done(key, f, on_done))
+        return True
+
+    def _on_done(self, key: str, future, on_done: Callable):
+        error = future.exception()
+        try:
+            if error is None:
+                on_done(future.result())
+        except Exception as e:
+            error = e
+        with self._lock:
+            started = self._in_flight.pop(key, None)
+            if error is None:
+                self.completed += 1
+                if started is not None:
+                    self._durations.append((time.perf_counter() - started) * 1000.0)
+            else:
+                self.failed += 1
+        if error is not None:
+            logger.error(f"Model fit for {key} failed: {error}")
+
+    def stop(self, wait: bool = False):
+        executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            durations = sorted(self._durations)
+            return {
+                "running": self.running,
+                "kind": self.kind,
+                "workers": self.max_workers,
+                "in_flight": len(self._in_flight),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "fit_ms_p50": round(durations[len(durations) // 2], 1) if durations else None,
+                "fit_ms_max": round(durations[-1], 1) if durations else None,
+            }
+
+
+model_retrainer = ModelRetrainer(
+    max_workers=int(os.getenv("ANOMALY_RETRAIN_WORKERS", "1")),
+    kind=os.getenv("ANOMALY_RETRAIN_POOL", "process"),
+)
@@ -0,0 +1,214 @@
+"""
+Notification Outbox
+Durable queue of alert notifications. Entries are added to the caller's session, so
+they commit atomically with the measurement that triggered them and survive restarts.
+A dispatcher task claims due entries in batches (with a lease, so entries held by a
+crashed worker are picked up again) and hands them to the alert worker pool; failed
+deliveries are retried with exponential backoff until max_attempts. Channels with a
+batch handler (e.g. digests) receive all their claimed entries in one job.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+Outbox = models.NotificationOutbox
+
+
+class NotificationOutbox:
+    def __init__(self, batch_size: int = 50, poll_interval: float = 1.0, max_attempts: int = 8,
+                 base_backoff: float = 30.0, max_backoff: float = 3600.0, lease_seconds: float = 300.0):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.lease = timedelta(seconds=lease_seconds)
+        # channel -> handler(db, entry, payload) returning True when delivered
+        self._handlers: Dict[str, Callable[[Session, models.NotificationOutbox, dict], bool]] = {}
+        # channel -> handler(db, entries, payloads) returning one bool per entry
+        self._batch_handlers: Dict[str, Callable[[Session, list, list], List[bool]]] = {}
+
+        # Stats (this process)
+        self.claimed = 0
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+
+    def register(self, channel: str, handler: Callable[[Session, models.NotificationOutbox, dict], bool]):
+        self._handlers[channel] = handler
+
+    def register_batch(self, channel: str, handler: Callable[[Session, list, list], List[bool]]):
+        self._batch_handlers[channel] = handler
+
+    # --- Producer side ---
+    @staticmethod
+    def enqueue(db: Session, channel: str, payload: dict, recipient: Optional[str] = None,
+                user_id: Optional[int] = None, device_id: Optional[str] = None,
+                alert: Optional[models.Alert] = None, deliver_at: Optional[datetime] = None) -> models.NotificationOutbox:
+        """Adds an entry to db's transaction (the caller commits it with its own rows)."""
+        entry = Outbox(
+            channel=channel,
+            recipient=recipient,
+            user_id=user_id,
+            device_id=device_id,
+            payload=json.dumps(payload, default=str),
+            status="pending",
+            attempts=0,
+            next_attempt_at=deliver_at or datetime.utcnow(),
+            alert=alert,
+        )
+        db.add(entry)
+        return entry
+
+    # --- Dispatcher side ---
+    @staticmethod
+    def _due(now: datetime):
+        return or_(
+            and_(Outbox.status == "pending", Outbox.next_attempt_at <= now),
+            and_(Outbox.status == "sending", Outbox.locked_until < now),  # lease expired (worker died)
+        )
+
+    def claim(self, db: Session, limit: int) -> List[Tuple[int, str, str]]:
+        """Leases up to limit due entries to this dispatcher. Returns (entry id, channel, claim token)."""
+        now = datetime.utcnow()
+        ids = [row.id for row in db.query(Outbox.id).filter(self._due(now)).order_by(Outbox.next_attempt_at).limit(limit)]
+        if not ids:
+            return []
+        token = uuid.uuid4().hex
+        # Re-checking the due condition makes the UPDATE a compare-and-set against other dispatchers
+        db.query(Outbox).filter(Outbox.id.in_(ids), self._due(now)).update(
+            {"status": "sending", "locked_until": now + self.lease, "claim_token": token},
+            synchronize_session=False,
+        )
+        db.commit()
+        claimed = [(row.id, row.channel, token) for row in db.query(Outbox.id, Outbox.channel).filter(Outbox.claim_token == token)]
+        self.claimed += len(claimed)
+        return claimed
+
+    def backoff(self, attempts: int) -> timedelta:
+        delay = min(self.max_backoff, self.base_backoff * (2 ** max(0, attempts - 1)))
+        return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+    def deliver(self, db: Session, entry_ids: List[int], token: str):
+        """Delivers claimed entries and records each outcome (runs on an alert worker)."""
+        entries = [
+            entry for entry in db.query(Outbox).filter(Outbox.id.in_(entry_ids)).order_by(Outbox.id)
+            if entry.status == "sending" and entry.claim_token == token  # else the lease was lost
+        ]
+        if not entries:
+            return
+
+        errors: Dict[int, Optional[str]] = {}
+        by_channel: Dict[str, list] = {}
+        for entry in entries:
+            by_channel.setdefault(entry.channel, []).append(entry)
+        for channel, group in by_channel.items():
+            payloads = [json.loads(entry.payload) for entry in group]
+            try:
+                if channel in self._batch_handlers:
+                    results = self._batch_handlers[channel](db, group, payloads)
+                elif channel in self._handlers:
+                    results = []
+                    for entry, payload in zip(group, payloads):
+                        try:
+                            results.append(self._handlers[channel](db, entry, payload))
+                        except Exception as e:
+                            db.rollback()
+                            results.append(f"{type(e).__name__}: {e}")
+                else:
+                    raise RuntimeError(f"No handler for channel '{channel}'")
+            except Exception as e:
+                db.rollback()
+                results = [f"{type(e).__name__}: {e}"] * len(group)
+            for entry, result in zip(group, results):
+                errors[entry.id] = None if result is True else (result or "Delivery failed")
+
+        for entry in entries:
+            self._record(entry, errors[entry.id])
+        db.commit()
+
+    def _record(self, entry: models.NotificationOutbox, error: Optional[str]):
+        now = datetime.utcnow()
+        entry.attempts = (entry.attempts or 0) + 1
+        entry.locked_until = None
+        entry.claim_token = None
+        if error is None:
+            entry.status = "sent"
+            entry.sent_at = now
+            entry.last_error = None
+            if entry.alert is not None and entry.channel == "email":
+                entry.alert.email_sent = True
+            self.delivered += 1
+        elif entry.attempts >= self.max_attempts:
+            entry.status = "failed"
+            entry.last_error = error
+            self.failed += 1
+            logger.error(f"Outbox entry {entry.id} failed permanently after {entry.attempts} attempts: {error}")
+        else:
+            entry.status = "pending"
+            entry.next_attempt_at = now + self.backoff(entry.attempts)
+            entry.last_error = error
+            self.retried += 1
+            logger.warning(f"Outbox entry {entry.id} attempt {entry.attempts} failed ({error}), retry at {entry.next_attempt_at}")
+
+    async def run(self, session_factory, pool):
+        """Background task: claims due entries and submits them to pool (an AlertWorkerPool)."""
+        while True:
+            claimed = []
+            try:
+                free = min(self.batch_size, pool.free_slots())
+                if free > 0:
+                    claimed = await asyncio.to_thread(self._claim_with_session, session_factory, free)
+                    batches: Dict[str, List[int]] = {}
+                    for entry_id, channel, token in claimed:
+                        if channel in self._batch_handlers:
+                            batches.setdefault(channel, []).append(entry_id)
+                        else:
+                            # A rejected job keeps its lease and is reclaimed when the lease expires
+                            pool.submit([entry_id], token)
+                    for entry_ids in batches.values():
+                        pool.submit(entry_ids, claimed[0][2])
+            except Exception as e:
+                logger.error(f"Outbox dispatch failed: {e}")
+            # Keep draining while there is a backlog
+            await asyncio.sleep(0 if len(claimed) == self.batch_size else self.poll_interval)
+
+    def _claim_with_session(self, session_factory, limit: int):
+        db = session_factory()
+        try:
+            return self.claim(db, limit)
+        finally:
+            db.close()
+
+    def stats(self, db: Session) -> dict:
+        counts = dict(db.query(Outbox.status, func.count(Outbox.id)).group_by(Outbox.status).all())
+        oldest = db.query(func.min(Outbox.created_at)).filter(Outbox.status.in_(("pending", "sending"))).scalar()
+        return {
+            "by_status": counts,
+            "oldest_undelivered_age_s": round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else None,
+            "claimed": self.claimed,
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+notification_outbox = NotificationOutbox(
+    batch_size=int(os.getenv("OUTBOX_BATCH_SIZE", "50")),
+    poll_interval=float(os.getenv("OUTBOX_POLL_SECONDS", "1")),
+    max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8")),
+    base_backoff=float(os.getenv("OUTBOX_BACKOFF_SECONDS", "30")),
+    max_backoff=float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "3600")),
+)
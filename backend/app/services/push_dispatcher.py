@@ -0,0 +1,159 @@
+"""
+Web Push Dispatcher
+Fans a notification out to many push subscriptions concurrently (bounded thread pool
+over one keep-alive HTTP session). VAPID headers are signed once per push-service
+origin and reused until shortly before they expire, and subscriptions the push
+service reports as gone (404/410) are deactivated with a single UPDATE.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from py_vapid import Vapid
+from pywebpush import WebPusher
+from sqlalchemy.orm import Session
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+GONE_STATUSES = (404, 410)
+
+
+class PushDispatcher:
+    def __init__(self, private_key: Optional[str], public_key: Optional[str], contact: str,
+                 max_workers: int = 16, vapid_ttl: int = 12 * 3600, timeout: float = 10.0):
+        self.private_key = private_key
+        self.public_key = public_key
+        self.contact = contact
+        self.max_workers = max_workers
+        self.vapid_ttl = vapid_ttl          # JWT lifetime (push services accept at most 24h)
+        self.timeout = timeout
+        self._vapid: Optional[Vapid] = None
+        self._headers: Dict[str, Tuple[dict, float]] = {}  # origin -> (headers, expires_at)
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._session: Optional[requests.Session] = None
+
+        # Stats
+        self.sent = 0
+        self.failed = 0
+        self.gone = 0
+        self.signed = 0
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.private_key and self.public_key)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._executor is None:
+                self._vapid = Vapid.from_string(private_key=self.private_key)
+                self._session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=8, pool_maxsize=self.max_workers)
+                self._session.mount("https://", adapter)
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="push")
+
+    def vapid_headers(self, endpoint: str) -> dict:
+        """Signed VAPID headers for the endpoint's push service, re-signed when close to expiry."""
+        url = urlparse(endpoint)
+        origin = f"{url.scheme}://{url.netloc}"
+        now = time.time()
+        with self._lock:
+            cached = self._headers.get(origin)
+            if cached and cached[1] - now > 300:
+                return cached[0]
+            expires_at = int(now) + self.vapid_ttl
+            headers = self._vapid.sign({"sub": self.contact, "aud": origin, "exp": expires_at})
+            self._headers[origin] = (headers, expires_at)
+            self.signed += 1
+            return headers
+
+    def _send_one(self, subscription: models.PushSubscription, data: str) -> Optional[int]:
+        """Returns None on success, otherwise the HTTP status (0 for transport errors)."""
+        subscription_info = {"endpoint": subscription.endpoint, "keys": {"p256dh": subscription.p256dh, "auth": subscription.auth}}
+        try:
+            headers = dict(self.vapid_headers(subscription.endpoint))
+            response = WebPusher(subscription_info, requests_session=self._session).send(
+                data, headers, ttl=0, timeout=self.timeout
+            )
+        except Exception as e:
+            logger.error(f"Push failed for subscription {subscription.id}: {e}")
+            return 0
+        if response.status_code > 202:
+            logger.warning(f"Push failed for subscription {subscription.id}: {response.status_code} {response.reason}")
+            return response.status_code
+        return None
+
+    def send(self, db: Session, subscriptions: List[models.PushSubscription], payload: dict) -> dict:
+        """
+        Sends payload to every subscription concurrently; returns {"sent", "failed", "gone"}.
+        Takes as long as the slowest endpoint, not the sum of them.
+        """
+        if not self.configured:
+            raise RuntimeError("VAPID keys not configured")
+        if not subscriptions:
+            return {"sent": 0, "failed": 0, "gone": 0}
+        self._ensure_started()
+
+        data = json.dumps(payload)
+        statuses = list(self._executor.map(lambda sub: self._send_one(sub, data), subscriptions))
+        gone_ids = [sub.id for sub, status in zip(subscriptions, statuses) if status in GONE_STATUSES]
+        sent = sum(status is None for status in statuses)
+
+        with self._lock:
+            self.sent += sent
+            self.failed += len(statuses) - sent
+            self.gone += len(gone_ids)
+        if gone_ids:
+            self.deactivate(db, gone_ids)
+        return {"sent": sent, "failed": len(statuses) - sent, "gone": len(gone_ids)}
+
+    @staticmethod
+    def deactivate(db: Session, subscription_ids: Iterable[int]):
+        """Marks expired subscriptions inactive in one UPDATE."""
+        db.query(models.PushSubscription).filter(
+            models.PushSubscription.id.in_(list(subscription_ids))
+        ).update({"is_active": False}, synchronize_session=False)
+        db.commit()
+
+    def send_to_users(self, db: Session, user_ids: Iterable[int], payload: dict) -> dict:
+        """Fans payload out to every active subscription of the given users (one query, one concurrent send)."""
+        subscriptions = db.query(models.PushSubscription).filter(
+            models.PushSubscription.user_id.in_(list(user_ids)),
+            models.PushSubscription.is_active == True
+        ).all()
+        return self.send(db, subscriptions, payload)
+
+    def stop(self):
+        executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=True)
+        if self._session:
+            self._session.close()
+
+    def stats(self) -> dict:
+        return {
+            "configured": self.configured,
+            "workers": self.max_workers,
+            "vapid_origins": len(self._headers),
+            "signed": self.signed,
+            "sent": self.sent,
+            "failed": self.failed,
+            "gone": self.gone,
+        }
+
+
+push_dispatcher = PushDispatcher(
+    os.getenv("VAPID_PRIVATE_KEY"),
+    os.getenv("VAPID_PUBLIC_KEY"),
+    os.getenv("VAPID_CONTACT", "mailto:admin@example.com"),
+    max_workers=int(os.getenv("PUSH_WORKERS", "16")),
+)
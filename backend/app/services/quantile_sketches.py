@@ -0,0 +1,257 @@
+"""
+Quantile Sketches
+Streaming per-(device, metric) value distributions for the insight baselines. Each
+metric is a KLL sketch: a stack of compactors whose capacities shrink geometrically
+towards the bottom level, so a sketch holds O(k) values however many readings it has
+seen while answering quantile and rank queries within ~1.7/k of the exact answer.
+Sketches are mergeable - across workers (merge an exported state into the local one)
+and across time windows or devices (merge several into a fresh sketch) - and are
+saved with the device state by the state checkpoints.
+"""
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Mapping, Optional, Sequence
+
+import numpy as np
+
+BASELINE_QUANTILES = (0.05, 0.5, 0.95)
+
+
+class QuantileSketch:
+    """KLL sketch of one metric (deterministic compaction: alternating odd/even halves per level)."""
+
+    C = 2.0 / 3.0  # capacity ratio between adjacent levels
+
+    def __init__(self, k: int = 200):
+        self.k = k
+        self.levels = [[]]      # level h holds values of weight 2**h
+        self.offsets = [0]      # which half the next compaction of a level keeps
+        self.n = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self._size = 0
+        self._max_size = self._capacity(0)
+
+    def __len__(self):
+        return self.n
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - 1 - level
+        return max(2, int(math.ceil(self.k * self.C ** depth)))
+
+    # --- Updates ---
+    def update(self, value: float):
+        value = float(value)
+        if math.isnan(value):
+            return
+        self.levels[0].append(value)
+        self.n += 1
+        self._size += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if self._size >= self._max_size:
+            self._compress()
+
+    def merge(self, other: "QuantileSketch"):
+        """Folds another sketch (of the same metric) into this one."""
+        if not other.n:
+            return
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+            self.offsets.append(0)
+        for level, values in enumerate(other.levels):
+            self.levels[level].extend(values)
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._size = sum(len(values) for values in self.levels)
+        self._max_size = sum(self._capacity(h) for h in range(len(self.levels)))
+        while self._size >= self._max_size:
+            self._compress()
+
+    def _compress(self):
+        for level, values in enumerate(self.levels):
+            if len(values) < self._capacity(level):
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+                self.offsets.append(0)
+            values.sort()
+            odd = len(values) % 2
+            keep = values[-1:] if odd else []  # an odd value out stays on this level
+            pairs = values[:len(values) - odd]
+            self.levels[level + 1].extend(pairs[self.offsets[level]::2])
+            self.offsets[level] ^= 1
+            self.levels[level] = keep
+            break
+        self._size = sum(len(values) for values in self.levels)
+        self._max_size = sum(self._capacity(h) for h in range(len(self.levels)))
+
+    # --- Queries ---
+    def _weighted(self):
+        values = np.fromiter((v for level in self.levels for v in level), dtype=float, count=self._size)
+        weights = np.concatenate([np.full(len(level), 1 << h, dtype=np.int64) for h, level in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        return values[order], np.cumsum(weights[order])
+
+    def describe(self, qs: Sequence[float], value: Optional[float] = None):
+        """
+        (values at the quantiles qs, rank of value) from one pass over the sketch; the
+        exact min/max at q=0 and q=1, rank None without a value. (None, None) when empty.
+        """
+        if not self.n:
+            return None, None
+        values, cumulative = self._weighted()
+        qs = np.asarray(qs, dtype=float)
+        picked = values[np.minimum(np.searchsorted(cumulative, qs * cumulative[-1], side="left"), len(values) - 1)]
+        picked = np.where(qs <= 0.0, self.min, np.where(qs >= 1.0, self.max, picked))
+        rank = None
+        if value is not None:
+            # Fraction of seen values below value, ties counting half
+            below = np.searchsorted(values, value, side="left")
+            through = np.searchsorted(values, value, side="right")
+            weight_below = cumulative[below - 1] if below else 0
+            weight_through = cumulative[through - 1] if through else 0
+            rank = float((weight_below + weight_through) / 2.0 / cumulative[-1])
+        return picked, rank
+
+    def quantile(self, q: float) -> Optional[float]:
+        picked, _ = self.describe((q,))
+        return None if picked is None else float(picked[0])
+
+    def rank(self, value: float) -> Optional[float]:
+        return self.describe((), value)[1]
+
+    # --- Checkpointing ---
+    def state(self) -> dict:
+        return {
+            "values": np.fromiter((v for level in self.levels for v in level), dtype=float, count=self._size),
+            "level_sizes": np.array([len(level) for level in self.levels], dtype=np.int64),
+            "offsets": np.array(self.offsets, dtype=np.int8),
+            "n": self.n,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_state(cls, state: Mapping, k: int = 200) -> "QuantileSketch":
+        sketch = cls(k)
+        values = np.asarray(state["values"], dtype=float)
+        bounds = np.cumsum(np.asarray(state["level_sizes"], dtype=np.int64))
+        sketch.levels = [chunk.tolist() for chunk in np.split(values, bounds[:-1])] or [[]]
+        offsets = [int(o) for o in np.asarray(state.get("offsets", []))]
+        sketch.offsets = (offsets + [0] * len(sketch.levels))[:len(sketch.levels)]
+        sketch.n = int(state["n"])
+        sketch.min = float(state["min"])
+        sketch.max = float(state["max"])
+        sketch._size = len(values)
+        sketch._max_size = sum(sketch._capacity(h) for h in range(len(sketch.levels)))
+        while sketch._size >= sketch._max_size:
+            sketch._compress()
+        return sketch
+
+
+class QuantileSketchStore:
+    """One sketch per (device, metric); least recently used devices are evicted."""
+
+    def __init__(self, metrics: Sequence[str], k: int = 200, min_samples: int = 30, max_devices: int = 4096):
+        self.metrics = tuple(metrics)
+        self.k = k
+        self.min_samples = min_samples
+        self.max_devices = max_devices
+        self._devices: "OrderedDict[str, Dict[str, QuantileSketch]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # restore_hook(device_id) -> {metric: saved state} or None; consulted for new devices
+        self.restore_hook: Optional[Callable[[str], Optional[Dict[str, dict]]]] = None
+        self.evicted = 0
+
+    def _sketches(self, device_id: str) -> Dict[str, QuantileSketch]:
+        # Caller holds the lock
+        sketches = self._devices.get(device_id)
+        if sketches is None:
+            saved = self.restore_hook(device_id) if self.restore_hook else None
+            sketches = self._devices[device_id] = {
+                metric: QuantileSketch.from_state(saved[metric], self.k) if saved and metric in saved
+                else QuantileSketch(self.k)
+                for metric in self.metrics
+            }
+            while len(self._devices) > self.max_devices:
+                self._devices.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._devices.move_to_end(device_id)
+        return sketches
+
+    def observe(self, device_id: str, values: Mapping[str, Optional[float]]) -> Dict[str, dict]:
+        """
+        Scores a reading against the device's distribution so far, then adds it.
+        Returns {metric: {"p5", "p50", "p95", "samples", "percentile", "unusualness"}} for
+        the metrics with at least min_samples earlier values; unusualness is 0 at the
+        median and approaches 1 at the tails (2 * |rank - 0.5|).
+        """
+        profile = {}
+        with self._lock:
+            sketches = self._sketches(device_id)
+            for metric, sketch in sketches.items():
+                value = values.get(metric)
+                numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+                if sketch.n >= self.min_samples:
+                    picked, rank = sketch.describe(BASELINE_QUANTILES, value if numeric else None)
+                    p5, p50, p95 = (round(float(q), 3) for q in picked)
+                    entry = {"p5": p5, "p50": p50, "p95": p95, "samples": sketch.n}
+                    if rank is not None:
+                        entry["percentile"] = round(rank * 100.0, 1)
+                        entry["unusualness"] = round(abs(rank - 0.5) * 2.0, 3)
+                    profile[metric] = entry
+                if numeric:
+                    sketch.update(value)
+        return profile
+
+    def merge_state(self, device_id: str, saved: Mapping[str, dict]):
+        """Merges sketches exported elsewhere (another worker, an older checkpoint) into a device's."""
+        with self._lock:
+            sketches = self._sketches(device_id)
+            for metric, state in saved.items():
+                if metric in sketches:
+                    sketches[metric].merge(QuantileSketch.from_state(state, self.k))
+
+    def merged(self, metric: str, device_ids: Optional[Iterable[str]] = None) -> QuantileSketch:
+        """One sketch of a metric across devices (all tracked devices by default)."""
+        combined = QuantileSketch(self.k)
+        with self._lock:
+            ids = list(self._devices) if device_ids is None else [d for d in device_ids if d in self._devices]
+            for device_id in ids:
+                combined.merge(self._devices[device_id][metric])
+        return combined
+
+    def export(self) -> Dict[str, Dict[str, dict]]:
+        """Saved states of every device's sketches, for checkpoints."""
+        with self._lock:
+            return {
+                device_id: {metric: sketch.state() for metric, sketch in sketches.items() if sketch.n}
+                for device_id, sketches in self._devices.items()
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            retained = sum(s._size for sketches in self._devices.values() for s in sketches.values())
+        return {
+            "devices": len(self._devices),
+            "metrics": list(self.metrics),
+            "k": self.k,
+            "min_samples": self.min_samples,
+            "retained_values": retained,
+            "evicted": self.evicted,
+        }
+
+
+quantile_sketches = QuantileSketchStore(
+    ("temperature", "gas", "humidity", "ph"),
+    k=int(os.getenv("BASELINE_SKETCH_K", "200")),
+    min_samples=int(os.getenv("BASELINE_MIN_SAMPLES", "30")),
+    max_devices=int(os.getenv("ROLLING_WINDOW_MAX_DEVICES", "4096")),
+)
@@ -0,0 +1,210 @@
+"""
+Rolling Window Store
+Per-device rolling windows of recent readings for the ML components (trust scoring,
+sensor-health and trend checks, anomaly-model training buffers). Each window is a
+preallocated NumPy ring buffer with one column per metric that keeps running
+count/sum/sum-of-squares and monotonic min/max queues per column, so pushing a
+reading and reading the window mean, std, min or max are O(1) (amortized) - no
+list copies or comprehensions per reading.
+"""
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Iterable, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+RESYNC_LAPS = 64  # recompute the running sums from the buffer every N passes, against float drift
+
+
+class RollingWindow:
+    def __init__(self, columns: Sequence[str], capacity: int, track_stats: bool = True):
+        self.columns = tuple(columns)
+        self.index = {name: i for i, name in enumerate(self.columns)}
+        self.capacity = capacity
+        self.track_stats = track_stats
+        self.data = np.full((capacity, len(self.columns)), np.nan)
+        self.next = 0
+        self.size = 0
+        self.pushed = 0  # readings ever pushed (not capped by the capacity)
+        if track_stats:
+            self._reset_stats()
+
+    def _reset_stats(self):
+        width = len(self.columns)
+        self.counts = np.zeros(width, dtype=np.int64)
+        self.sums = np.zeros(width)
+        self.sumsq = np.zeros(width)
+        self._mins = [deque() for _ in range(width)]  # (push sequence, value), increasing values
+        self._maxs = [deque() for _ in range(width)]  # (push sequence, value), decreasing values
+
+    def __len__(self):
+        return self.size
+
+    # --- Updates ---
+    def push(self, row: Iterable[float]):
+        """Appends one row (NaN = missing), evicting the oldest when full."""
+        row = np.asarray(row, dtype=float)
+        if self.track_stats:
+            if self.size == self.capacity:
+                old = self.data[self.next]
+                present = ~np.isnan(old)
+                self.counts -= present
+                self.sums -= np.where(present, old, 0.0)
+                self.sumsq -= np.where(present, old * old, 0.0)
+            present = ~np.isnan(row)
+            self.counts += present
+            self.sums += np.where(present, row, 0.0)
+            self.sumsq += np.where(present, row * row, 0.0)
+            seq, expired = self.pushed, self.pushed - self.capacity
+            for i in np.flatnonzero(present):
+                value = row[i]
+                mins, maxs = self._mins[i], self._maxs[i]
+                while mins and mins[-1][1] >= value:
+                    mins.pop()
+                mins.append((seq, value))
+                while maxs and maxs[-1][1] <= value:
+                    maxs.pop()
+                maxs.append((seq, value))
+            for queues in (self._mins, self._maxs):
+                for queue in queues:
+                    while queue and queue[0][0] <= expired:
+                        queue.popleft()
+
+        self.data[self.next] = row
+        self.next = (self.next + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.pushed += 1
+        if self.track_stats and self.next == 0 and self.pushed % (self.capacity * RESYNC_LAPS) == 0:
+            self._resync_sums()
+
+    def push_values(self, values: Mapping[str, Optional[float]]):
+        """Appends a reading dict; missing, None and non-numeric values are stored as NaN."""
+        row = np.full(len(self.columns), np.nan)
+        for name, i in self.index.items():
+            value = values.get(name)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                row[i] = value
+        self.push(row)
+
+    def _resync_sums(self):
+        rows = self.snapshot()
+        present = ~np.isnan(rows)
+        self.counts = present.sum(axis=0)
+        self.sums = np.where(present, rows, 0.0).sum(axis=0)
+        self.sumsq = np.where(present, rows * rows, 0.0).sum(axis=0)
+
+    # --- Reads ---
+    def snapshot(self) -> np.ndarray:
+        """Copy of the buffered rows, oldest first."""
+        if self.size < self.capacity:
+            return self.data[:self.size].copy()
+        return np.concatenate((self.data[self.next:], self.data[:self.next]))
+
+    def tail(self, name: str, n: int) -> np.ndarray:
+        """Last n values of a column (oldest first); n is small, so this is constant work."""
+        n = min(n, self.size)
+        positions = (self.next - n + np.arange(n)) % self.capacity
+        return self.data[positions, self.index[name]]
+
+    def count(self, name: str) -> int:
+        return int(self.counts[self.index[name]])
+
+    def mean(self, name: str) -> Optional[float]:
+        i = self.index[name]
+        return float(self.sums[i] / self.counts[i]) if self.counts[i] else None
+
+    def std(self, name: str) -> Optional[float]:
+        """Population standard deviation of the window (like np.std)."""
+        i = self.index[name]
+        if not self.counts[i]:
+            return None
+        mean = self.sums[i] / self.counts[i]
+        return float(np.sqrt(max(0.0, self.sumsq[i] / self.counts[i] - mean * mean)))
+
+    def min(self, name: str) -> Optional[float]:
+        queue = self._mins[self.index[name]]
+        return float(queue[0][1]) if queue else None
+
+    def max(self, name: str) -> Optional[float]:
+        queue = self._maxs[self.index[name]]
+        return float(queue[0][1]) if queue else None
+
+    # --- Checkpointing ---
+    def state(self) -> dict:
+        return {"data": self.snapshot(), "pushed": self.pushed}
+
+    def load(self, state: dict):
+        """Replaces the contents with a saved state (stats are rebuilt by re-pushing)."""
+        self.data[:] = np.nan
+        self.next = self.size = self.pushed = 0
+        if self.track_stats:
+            self._reset_stats()
+        rows = np.asarray(state["data"], dtype=float)
+        if rows.ndim != 2 or rows.shape[1] != len(self.columns):
+            return
+        for row in rows[-self.capacity:]:
+            self.push(row)
+        self.pushed = max(self.pushed, int(state.get("pushed", 0)))
+
+
+class RollingWindowStore:
+    """Named window kinds, instantiated per device on first use; least recently used devices are evicted."""
+
+    def __init__(self, max_devices: int = 4096):
+        self.max_devices = max_devices
+        self._specs: Dict[str, Tuple[Tuple[str, ...], int, bool]] = {}
+        self._devices: "OrderedDict[str, Dict[str, RollingWindow]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # restore_hook(device_id) -> {window name: saved state} or None; consulted for new devices
+        self.restore_hook: Optional[Callable[[str], Optional[Dict[str, dict]]]] = None
+        self.evicted = 0
+
+    def define(self, name: str, columns: Sequence[str], capacity: int, track_stats: bool = True):
+        self._specs[name] = (tuple(columns), capacity, track_stats)
+
+    def window(self, device_id: str, name: str) -> RollingWindow:
+        with self._lock:
+            windows = self._devices.get(device_id)
+            if windows is None:
+                windows = self._devices[device_id] = {}
+                saved = self.restore_hook(device_id) if self.restore_hook else None
+                for saved_name, state in (saved or {}).items():
+                    if saved_name in self._specs:
+                        windows[saved_name] = self._create(saved_name)
+                        windows[saved_name].load(state)
+                while len(self._devices) > self.max_devices:
+                    self._devices.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self._devices.move_to_end(device_id)
+            window = windows.get(name)
+            if window is None:
+                window = windows[name] = self._create(name)
+            return window
+
+    def peek(self, device_id: str, name: str) -> Optional[RollingWindow]:
+        """A device's window if it exists, without creating it or refreshing its recency."""
+        with self._lock:
+            return self._devices.get(device_id, {}).get(name)
+
+    def _create(self, name: str) -> RollingWindow:
+        columns, capacity, track_stats = self._specs[name]
+        return RollingWindow(columns, capacity, track_stats)
+
+    def export(self) -> Dict[str, Dict[str, dict]]:
+        """Saved states of every window of every device, for checkpoints."""
+        with self._lock:
+            devices = [(device_id, list(windows.items())) for device_id, windows in self._devices.items()]
+        return {device_id: {name: window.state() for name, window in windows} for device_id, windows in devices}
+
+    def stats(self) -> dict:
+        return {
+            "devices": len(self._devices),
+            "max_devices": self.max_devices,
+            "windows": {name: capacity for name, (_, capacity, _) in self._specs.items()},
+            "evicted": self.evicted,
+        }
+
+
+rolling_windows = RollingWindowStore(max_devices=int(os.getenv("ROLLING_WINDOW_MAX_DEVICES", "4096")))
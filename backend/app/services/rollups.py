@@ -0,0 +1,367 @@
+"""
+Sensor Rollups
+Per-device aggregates of sensor_data at 1 minute / 1 hour / 1 day resolution
+(readings, plus count, sum, min, max and the newest value per metric), maintained incrementally
+as readings are committed. Deltas are buffered in memory and flushed to the
+sensor_rollups table additively, so several workers can share it. Range queries read
+the coarsest table that still gives enough points instead of scanning raw rows.
+
+rebuild() recomputes rollups from sensor_data (see scripts/backfill_rollups.py).
+"""
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, case, delete, func, or_, update
+from sqlalchemy.orm import Session
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+RESOLUTIONS = {
+    "1m": timedelta(minutes=1),
+    "1h": timedelta(hours=1),
+    "1d": timedelta(days=1),
+}
+METRICS = ("temperature", "humidity", "gas", "pm2_5")
+LAST_FIELDS = METRICS + ("rain", "anomaly_label", "smart_insight")
+SAMPLE_FIELDS = ("timestamp",) + LAST_FIELDS
+
+
+def floor_to(ts: datetime, resolution: str) -> datetime:
+    if resolution == "1m":
+        return ts.replace(second=0, microsecond=0)
+    if resolution == "1h":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def month_start(ts: datetime) -> datetime:
+    return ts.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(ts: datetime) -> datetime:
+    return (month_start(ts) + timedelta(days=32)).replace(day=1)
+
+
+def sample_of(measurement) -> dict:
+    """Plain copy of the fields the rollups need (take it before the commit expires the row)."""
+    sample = {field: getattr(measurement, field, None) for field in SAMPLE_FIELDS}
+    sample["device_id"] = measurement.device_id
+    return sample
+
+
+class RollupDelta:
+    """Aggregates of one bucket (or the not yet flushed part of it)."""
+    __slots__ = ("samples", "sums", "counts", "mins", "maxs", "last_ts", "last")
+
+    def __init__(self):
+        self.samples = 0
+        self.sums = dict.fromkeys(METRICS, 0.0)
+        self.counts = dict.fromkeys(METRICS, 0)
+        self.mins: Dict[str, Optional[float]] = dict.fromkeys(METRICS)
+        self.maxs: Dict[str, Optional[float]] = dict.fromkeys(METRICS)
+        self.last_ts: Optional[datetime] = None
+        self.last: Optional[dict] = None
+
+    def add(self, sample: dict):
+        self.samples += 1
+        for metric in METRICS:
+            value = sample.get(metric)
+            if value is not None:
+                self.sums[metric] += value
+                self.counts[metric] += 1
+                if self.mins[metric] is None or value < self.mins[metric]:
+                    self.mins[metric] = value
+                if self.maxs[metric] is None or value > self.maxs[metric]:
+                    self.maxs[metric] = value
+        self.set_last(sample["timestamp"], sample)
+
+    def merge(self, other: "RollupDelta"):
+        self.samples += other.samples
+        for metric in METRICS:
+            self.sums[metric] += other.sums[metric]
+            self.counts[metric] += other.counts[metric]
+            if other.mins[metric] is not None and (self.mins[metric] is None or other.mins[metric] < self.mins[metric]):
+                self.mins[metric] = other.mins[metric]
+            if other.maxs[metric] is not None and (self.maxs[metric] is None or other.maxs[metric] > self.maxs[metric]):
+                self.maxs[metric] = other.maxs[metric]
+        self.set_last(other.last_ts, other.last)
+
+    def set_last(self, ts: Optional[datetime], values: Optional[dict]):
+        if ts is not None and (self.last_ts is None or ts >= self.last_ts):
+            self.last_ts = ts
+            self.last = {field: values.get(field) for field in LAST_FIELDS}
+
+
+Key = Tuple[str, str, datetime]  # (device_id, resolution, bucket_start)
+
+
+class RollupStore:
+    def __init__(self, flush_interval: float = 30.0, resolutions: Iterable[str] = tuple(RESOLUTIONS)):
+        self.flush_interval = flush_interval
+        self.resolutions = tuple(resolutions)
+        self._pending: Dict[Key, RollupDelta] = {}
+        self._lock = threading.Lock()
+        self.records = 0
+        self.flushed = 0
+
+    # --- Ingest ---
+    def record_many(self, samples: Iterable[dict]):
+        """Adds committed readings to the buffered deltas of every resolution."""
+        with self._lock:
+            self._accumulate(self._pending, samples)
+
+    def _accumulate(self, pending: Dict[Key, RollupDelta], samples: Iterable[dict]) -> int:
+        count = 0
+        for sample in samples:
+            ts = sample.get("timestamp")
+            if ts is None:
+                continue
+            for resolution in self.resolutions:
+                key = (sample["device_id"], resolution, floor_to(ts, resolution))
+                delta = pending.get(key)
+                if delta is None:
+                    delta = pending[key] = RollupDelta()
+                delta.add(sample)
+            count += 1
+        if pending is self._pending:
+            self.records += count
+        return count
+
+    def pending(self, resolution: str) -> List[Tuple[str, datetime, RollupDelta]]:
+        """Unflushed deltas of one resolution as (device_id, bucket_start, delta)."""
+        with self._lock:
+            return [(device_id, start, delta) for (device_id, res, start), delta in self._pending.items() if res == resolution]
+
+    # --- Persistence ---
+    def flush(self, db: Session) -> int:
+        """Adds buffered deltas to sensor_rollups (UPDATE existing rows, INSERT new ones)."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            self._write(db, pending)
+        except Exception:
+            db.rollback()
+            # Put the deltas back so the next flush retries them
+            with self._lock:
+                for key, delta in pending.items():
+                    self._pending.setdefault(key, RollupDelta()).merge(delta)
+            raise
+        self.flushed += len(pending)
+        return len(pending)
+
+    @staticmethod
+    def _write(db: Session, pending: Dict[Key, RollupDelta]):
+        table = models.SensorRollup.__table__
+        rows = []
+        for (device_id, resolution, start), delta in pending.items():
+            row = {"b_device_id": device_id, "b_resolution": resolution, "b_bucket_start": start,
+                   "b_sample_count": delta.samples, "b_last_ts": delta.last_ts}
+            for metric in METRICS:
+                row[f"b_{metric}_sum"] = delta.sums[metric]
+                row[f"b_{metric}_count"] = delta.counts[metric]
+                row[f"b_{metric}_min"] = delta.mins[metric]
+                row[f"b_{metric}_max"] = delta.maxs[metric]
+            for field in LAST_FIELDS:
+                row[f"b_last_{field}"] = (delta.last or {}).get(field)
+            rows.append(row)
+
+        existing = set(
+            db.query(models.SensorRollup.device_id, models.SensorRollup.resolution, models.SensorRollup.bucket_start).filter(
+                models.SensorRollup.device_id.in_({device_id for device_id, _, _ in pending}),
+                models.SensorRollup.bucket_start >= min(start for _, _, start in pending),
+            ).all()
+        )
+        updates = [r for r in rows if (r["b_device_id"], r["b_resolution"], r["b_bucket_start"]) in existing]
+        inserts = [r for r in rows if (r["b_device_id"], r["b_resolution"], r["b_bucket_start"]) not in existing]
+
+        if updates:
+            newer = or_(table.c.last_ts.is_(None), table.c.last_ts <= bindparam("b_last_ts"))
+            values = {"sample_count": table.c.sample_count + bindparam("b_sample_count")}
+            for m in METRICS:
+                new_min, new_max = bindparam(f"b_{m}_min"), bindparam(f"b_{m}_max")
+                values[f"{m}_sum"] = table.c[f"{m}_sum"] + bindparam(f"b_{m}_sum")
+                values[f"{m}_count"] = table.c[f"{m}_count"] + bindparam(f"b_{m}_count")
+                # Portable LEAST/GREATEST that ignores NULLs on either side
+                values[f"{m}_min"] = case(
+                    (table.c[f"{m}_min"].is_(None), new_min),
+                    (new_min < table.c[f"{m}_min"], new_min),
+                    else_=table.c[f"{m}_min"],
+                )
+                values[f"{m}_max"] = case(
+                    (table.c[f"{m}_max"].is_(None), new_max),
+                    (new_max > table.c[f"{m}_max"], new_max),
+                    else_=table.c[f"{m}_max"],
+                )
+            values["last_ts"] = case((newer, bindparam("b_last_ts")), else_=table.c.last_ts)
+            values.update({
+                f"last_{f}": case((newer, bindparam(f"b_last_{f}")), else_=table.c[f"last_{f}"])
+                for f in LAST_FIELDS
+            })
+            stmt = update(table).where(
+                table.c.device_id == bindparam("b_device_id"),
+                table.c.resolution == bindparam("b_resolution"),
+                table.c.bucket_start == bindparam("b_bucket_start"),
+            ).values(**values)
+            db.execute(stmt, updates)
+        if inserts:
+            db.execute(table.insert(), [{key[2:]: value for key, value in r.items()} for r in inserts])
+        db.commit()
+
+    async def run_flusher(self, session_factory):
+        """Background task: flushes rollup deltas every flush_interval seconds."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self._flush_with_session, session_factory)
+            except Exception as e:
+                logger.error(f"Rollup flush failed: {e}")
+
+    def _flush_with_session(self, session_factory):
+        db = session_factory()
+        try:
+            self.flush(db)
+        finally:
+            db.close()
+
+    def rebuild(self, db: Session, since: Optional[datetime] = None, device_id: Optional[str] = None,
+                chunk_size: int = 20000) -> int:
+        """
+        Recomputes rollups from sensor_data (from the start of since's day, or everything).
+        Existing rollups in that range are replaced; days whose raw rows were already
+        removed by retention are left alone. Readings buffered by a running server for
+        the same range would be counted twice, so run it with ingestion paused.
+        """
+        oldest = db.query(func.min(models.SensorData.timestamp))
+        if device_id:
+            oldest = oldest.filter(models.SensorData.device_id == device_id)
+        oldest = oldest.scalar()
+        if oldest is None:
+            return 0
+        start = floor_to(max(since, oldest) if since else oldest, "1d")
+        stmt = delete(models.SensorRollup).where(
+            models.SensorRollup.resolution.in_(self.resolutions),
+            models.SensorRollup.bucket_start >= start,
+        )
+        if device_id:
+            stmt = stmt.where(models.SensorRollup.device_id == device_id)
+        db.execute(stmt)
+        db.commit()
+
+        columns = [models.SensorData.device_id] + [getattr(models.SensorData, f) for f in SAMPLE_FIELDS]
+        query = db.query(*columns).filter(models.SensorData.timestamp >= start).order_by(models.SensorData.timestamp)
+        if device_id:
+            query = query.filter(models.SensorData.device_id == device_id)
+
+        total = 0
+        batch: List[dict] = []
+        chunk: Dict[Key, RollupDelta] = {}
+        for row in query.yield_per(5000):
+            batch.append(dict(zip(("device_id",) + SAMPLE_FIELDS, row)))
+            if len(batch) >= 5000:
+                total += self._accumulate(chunk, batch)
+                batch = []
+                if len(chunk) >= chunk_size:
+                    # Deltas are additive, so buckets split across chunks add up correctly
+                    self._write(db, chunk)
+                    chunk = {}
+        total += self._accumulate(chunk, batch)
+        if chunk:
+            self._write(db, chunk)
+        logger.info(f"Rollups rebuilt from {total} sensor_data rows")
+        return total
+
+    # --- Queries ---
+    def choose_resolution(self, start: datetime, end: datetime, max_points: int) -> str:
+        """Finest resolution that keeps a series over [start, end) within max_points buckets."""
+        span = end - start
+        for resolution in self.resolutions:
+            if span / RESOLUTIONS[resolution] <= max_points:
+                return resolution
+        return self.resolutions[-1]
+
+    def deltas(self, db: Session, resolution: str, start: datetime, end: Optional[datetime] = None,
+               device_id: Optional[str] = None) -> List[Tuple[str, datetime, RollupDelta]]:
+        """
+        (device_id, bucket_start, aggregates) of one resolution in [start, end), ordered by
+        time, including this worker's unflushed deltas.
+        """
+        query = db.query(models.SensorRollup).filter(
+            models.SensorRollup.resolution == resolution,
+            models.SensorRollup.bucket_start >= floor_to(start, resolution),
+        )
+        if end is not None:
+            query = query.filter(models.SensorRollup.bucket_start < end)
+        if device_id:
+            query = query.filter(models.SensorRollup.device_id == device_id)
+
+        buckets: Dict[Tuple[str, datetime], RollupDelta] = {}
+        for row in query:
+            buckets[(row.device_id, row.bucket_start)] = self.delta_from_row(row)
+        for pending_device, bucket_start, delta in self.pending(resolution):
+            if (device_id and pending_device != device_id) or bucket_start < floor_to(start, resolution):
+                continue
+            if end is not None and bucket_start >= end:
+                continue
+            buckets.setdefault((pending_device, bucket_start), RollupDelta()).merge(delta)
+
+        return [
+            (device, bucket_start, delta)
+            for (device, bucket_start), delta in sorted(buckets.items(), key=lambda item: (item[0][1], item[0][0]))
+        ]
+
+    def series(self, db: Session, resolution: str, start: datetime, end: Optional[datetime] = None,
+               device_id: Optional[str] = None) -> List[dict]:
+        """Chart points of one resolution in [start, end) (see to_point)."""
+        return [
+            self.to_point(device, bucket_start, resolution, delta)
+            for device, bucket_start, delta in self.deltas(db, resolution, start, end, device_id)
+        ]
+
+    @staticmethod
+    def delta_from_row(row: models.SensorRollup) -> RollupDelta:
+        delta = RollupDelta()
+        delta.samples = row.sample_count or 0
+        for metric in METRICS:
+            delta.sums[metric] = getattr(row, f"{metric}_sum") or 0.0
+            delta.counts[metric] = getattr(row, f"{metric}_count") or 0
+            delta.mins[metric] = getattr(row, f"{metric}_min")
+            delta.maxs[metric] = getattr(row, f"{metric}_max")
+        delta.set_last(row.last_ts, {field: getattr(row, f"last_{field}") for field in LAST_FIELDS})
+        return delta
+
+    @staticmethod
+    def to_point(device_id: str, bucket_start: datetime, resolution: str, delta: RollupDelta) -> dict:
+        """Chart point shaped like a sensor_data row (metric = bucket mean) plus min/max/last/count."""
+        point = {
+            "device_id": device_id,
+            "timestamp": bucket_start,
+            "resolution": resolution,
+            "samples": delta.samples,
+        }
+        for metric in METRICS:
+            count = delta.counts[metric]
+            point[metric] = round(delta.sums[metric] / count, 2) if count else None
+            point[f"{metric}_min"] = delta.mins[metric]
+            point[f"{metric}_max"] = delta.maxs[metric]
+            point[f"{metric}_last"] = (delta.last or {}).get(metric)
+            point[f"{metric}_count"] = count
+        return point
+
+    def stats(self) -> dict:
+        return {
+            "resolutions": list(self.resolutions),
+            "pending_buckets": len(self._pending),
+            "records": self.records,
+            "flushed_buckets": self.flushed,
+        }
+
+
+rollup_store = RollupStore(flush_interval=float(os.getenv("ROLLUP_FLUSH_SECONDS", "30")))
@@ -0,0 +1,228 @@
+"""
+Sensor Data Archive
+Exports closed months of sensor_data to compressed Parquet files, one per device and
+month (<SENSOR_ARCHIVE_DIR>/<device>/<YYYY-MM>.parquet), and reads them back without
+touching the database: only the requested columns are decoded, row groups outside the
+requested time range are skipped, and files are memory-mapped. Results come back as
+NumPy arrays, ready for analytics, model training and backtests.
+
+The storage maintenance job archives closed months before raw retention removes them
+and then records the archive's watermark (the first month not archived), so readers
+can serve everything before it from Parquet.
+"""
+import logging
+import os
+import re
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .. import models
+from .rollups import month_start, next_month
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "archive")
+
+SCHEMA = pa.schema([
+    ("timestamp", pa.timestamp("us")),
+    ("temperature", pa.float64()),
+    ("humidity", pa.float64()),
+    ("pressure", pa.float64()),
+    ("wind_speed", pa.float64()),
+    ("pm2_5", pa.float64()),
+    ("pm10", pa.float64()),
+    ("mq_raw", pa.float64()),
+    ("gas", pa.float64()),
+    ("rain", pa.float64()),
+    ("motion", pa.int32()),
+    ("ph", pa.float64()),
+    ("trust_score", pa.float64()),
+    ("anomaly_label", pa.string()),
+])
+COLUMNS = tuple(SCHEMA.names)
+WATERMARK_FILE = "archived_until"
+
+# Feature order of ml_engine.Preprocessor: [temp, pressure, vibration, wind, uv, soil_temp, soil_moist, pm25, pm10, no2, solar]
+FEATURE_COLUMNS = ("temperature", "pressure", None, "wind_speed", None, None, None, "pm2_5", "pm10", None, None)
+
+
+class SensorArchive:
+    def __init__(self, root: str, enabled: bool = False, compression: str = "zstd", row_group_size: int = 8192):
+        self.root = root
+        self.enabled = enabled
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.exported_files = 0
+        self.exported_rows = 0
+
+    # --- Layout ---
+    @staticmethod
+    def _safe(device_id: str) -> str:
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", device_id)
+
+    def path(self, device_id: str, month: datetime) -> str:
+        return os.path.join(self.root, self._safe(device_id), f"{month:%Y-%m}.parquet")
+
+    def devices(self) -> List[str]:
+        """Archived device directories (sanitised device ids, which read() accepts as-is)."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+
+    def archived_until(self) -> Optional[datetime]:
+        """Watermark of the last completed archive run: every closed month before it is in Parquet."""
+        try:
+            with open(os.path.join(self.root, WATERMARK_FILE)) as f:
+                return datetime.strptime(f.read().strip(), "%Y-%m")
+        except (OSError, ValueError):
+            return None
+
+    def _set_archived_until(self, month: datetime):
+        path = os.path.join(self.root, WATERMARK_FILE)
+        os.makedirs(self.root, exist_ok=True)
+        with open(f"{path}.tmp", "w") as f:
+            f.write(f"{month:%Y-%m}")
+        os.replace(f"{path}.tmp", path)
+
+    def months(self, device_id: str) -> List[datetime]:
+        """Archived months of a device, oldest first."""
+        directory = os.path.join(self.root, self._safe(device_id))
+        if not os.path.isdir(directory):
+            return []
+        found = []
+        for name in os.listdir(directory):
+            match = re.match(r"^(\d{4})-(\d{2})\.parquet$", name)
+            if match:
+                found.append(datetime(int(match.group(1)), int(match.group(2)), 1))
+        return sorted(found)
+
+    # --- Export ---
+    def export_month(self, db: Session, device_id: str, month: datetime) -> int:
+        """Writes one device-month to Parquet (atomically); returns the number of rows."""
+        start, end = month_start(month), next_month(month)
+        query = db.query(*[getattr(models.SensorData, c) for c in COLUMNS]).filter(
+            models.SensorData.device_id == device_id,
+            models.SensorData.timestamp >= start,
+            models.SensorData.timestamp < end,
+        ).order_by(models.SensorData.timestamp)
+
+        columns: Dict[str, list] = {c: [] for c in COLUMNS}
+        for row in query.yield_per(10000):
+            for name, value in zip(COLUMNS, row):
+                columns[name].append(value)
+        if not columns["timestamp"]:
+            return 0
+
+        table = pa.Table.from_pydict(columns, schema=SCHEMA)
+        path = self.path(device_id, start)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        pq.write_table(table, tmp_path, compression=self.compression, row_group_size=self.row_group_size)
+        os.replace(tmp_path, path)
+        self.exported_files += 1
+        self.exported_rows += table.num_rows
+        return table.num_rows
+
+    def archive_closed_months(self, db: Session, now: Optional[datetime] = None, overwrite: bool = False) -> List[Tuple[str, str, int]]:
+        """Exports every device-month before the current month that has no archive file yet."""
+        current = month_start(now or datetime.utcnow())
+        oldest = db.query(func.min(models.SensorData.timestamp)).scalar()
+        exported = []
+        month = month_start(oldest) if oldest else current
+        while month < current:
+            end = next_month(month)
+            devices = [row[0] for row in db.query(models.SensorData.device_id).filter(
+                models.SensorData.timestamp >= month, models.SensorData.timestamp < end
+            ).distinct()]
+            for device_id in devices:
+                if not overwrite and os.path.exists(self.path(device_id, month)):
+                    continue
+                rows = self.export_month(db, device_id, month)
+                exported.append((device_id, f"{month:%Y-%m}", rows))
+            month = end
+        self._set_archived_until(current)
+        if exported:
+            logger.info(f"Archived {len(exported)} device-months to {self.root}")
+        return exported
+
+    # --- Read API ---
+    def read_table(self, device_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                   columns: Optional[Sequence[str]] = None) -> pa.Table:
+        """Arrow table of the archived readings of a device in [start, end), only the given columns."""
+        wanted = list(columns or COLUMNS)
+        unknown = set(wanted) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown archive columns: {', '.join(sorted(unknown))}")
+        read_columns = wanted if "timestamp" in wanted or (start is None and end is None) else wanted + ["timestamp"]
+
+        filters = []
+        if start is not None:
+            filters.append(("timestamp", ">=", start))
+        if end is not None:
+            filters.append(("timestamp", "<", end))
+
+        tables = []
+        for month in self.months(device_id):
+            if (start is not None and next_month(month) <= start) or (end is not None and month >= end):
+                continue
+            tables.append(pq.read_table(
+                self.path(device_id, month), columns=read_columns, filters=filters or None, memory_map=True
+            ))
+        if not tables:
+            return SCHEMA.empty_table().select(wanted)
+        return pa.concat_tables(tables).select(wanted)
+
+    def read(self, device_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+             columns: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+        """Same as read_table, as NumPy arrays (floats use NaN for missing values)."""
+        table = self.read_table(device_id, start, end, columns)
+        arrays = {}
+        for name in table.column_names:
+            column = table.column(name)
+            if pa.types.is_floating(column.type):
+                arrays[name] = column.to_numpy().astype(np.float64, copy=False) if column.null_count == 0 \
+                    else column.fill_null(np.nan).to_numpy()
+            else:
+                arrays[name] = column.to_numpy(zero_copy_only=False)
+        return arrays
+
+    def training_matrix(self, device_ids: Iterable[str], start: Optional[datetime] = None,
+                        end: Optional[datetime] = None) -> np.ndarray:
+        """
+        Feature matrix (rows x 11, ml_engine.Preprocessor order) for offline training and
+        backtests; missing sensors are 0 as in the live path, rows without a temperature are dropped.
+        """
+        needed = [c for c in FEATURE_COLUMNS if c] + ["timestamp"]
+        blocks = []
+        for device_id in device_ids:
+            data = self.read(device_id, start, end, needed)
+            rows = len(data["timestamp"])
+            if not rows:
+                continue
+            block = np.zeros((rows, len(FEATURE_COLUMNS)))
+            for i, name in enumerate(FEATURE_COLUMNS):
+                if name:
+                    block[:, i] = np.nan_to_num(data[name], nan=0.0)
+            blocks.append(block[~np.isnan(data["temperature"])])
+        return np.vstack(blocks) if blocks else np.empty((0, len(FEATURE_COLUMNS)))
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "root": self.root,
+            "exported_files": self.exported_files,
+            "exported_rows": self.exported_rows,
+        }
+
+
+sensor_archive = SensorArchive(
+    os.getenv("SENSOR_ARCHIVE_DIR", DEFAULT_ARCHIVE_DIR),
+    enabled=os.getenv("SENSOR_ARCHIVE_ENABLED", "false").lower() == "true",
+    compression=os.getenv("SENSOR_ARCHIVE_COMPRESSION", "zstd"),
+)
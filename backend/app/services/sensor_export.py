@@ -0,0 +1,128 @@
+"""
+Sensor Data Export
+Keyset-paginated, column-projected reads of sensor_data for /api/data. Pages are
+ordered by (timestamp, id) and continue from an opaque cursor instead of OFFSET, and
+only the requested columns are selected (plain rows, no ORM objects). The streaming
+formats (NDJSON / CSV) pull rows through a server-side cursor in chunks, so an export
+of any size runs in constant memory.
+"""
+import base64
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session
+
+from .. import models
+
+Data = models.SensorData
+COLUMNS = tuple(column.name for column in Data.__table__.columns)
+FORMATS = ("json", "ndjson", "csv")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    """Comma-separated column list -> validated column names (all columns when empty)."""
+    if not fields:
+        return list(COLUMNS)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(COLUMNS)}")
+    return list(dict.fromkeys(names))
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{row_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def build_query(fields: Sequence[str], device_id: Optional[str] = None, start: Optional[datetime] = None,
+                end: Optional[datetime] = None, cursor: Optional[str] = None, descending: bool = True):
+    """SELECT of the requested columns (+ the keyset columns) in (timestamp, id) order."""
+    columns = list(dict.fromkeys(list(fields) + ["timestamp", "id"]))
+    stmt = select(*[Data.__table__.c[name] for name in columns])
+    if device_id:
+        stmt = stmt.where(Data.device_id == device_id)
+    if start is not None:
+        stmt = stmt.where(Data.timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(Data.timestamp < end)
+    if cursor:
+        ts, row_id = decode_cursor(cursor)
+        if descending:
+            stmt = stmt.where(or_(Data.timestamp < ts, and_(Data.timestamp == ts, Data.id < row_id)))
+        else:
+            stmt = stmt.where(or_(Data.timestamp > ts, and_(Data.timestamp == ts, Data.id > row_id)))
+    if descending:
+        return stmt.order_by(Data.timestamp.desc(), Data.id.desc())
+    return stmt.order_by(Data.timestamp.asc(), Data.id.asc())
+
+
+def fetch_page(db: Session, fields: Sequence[str], limit: int, **filters) -> Tuple[List[dict], Optional[str]]:
+    """One page of rows (dicts of the requested fields) and the cursor of the next page (None at the end)."""
+    rows = db.execute(build_query(fields, **filters).limit(limit + 1)).mappings().all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["timestamp"], rows[-1]["id"])
+    return [{name: row[name] for name in fields} for row in rows], next_cursor
+
+
+def stream(session_factory, fields: Sequence[str], export_format: str, limit: Optional[int] = None,
+           chunk_size: int = 1000, **filters) -> Iterator[str]:
+    """
+    Yields the export in text chunks of chunk_size rows, reading through a server-side
+    cursor on its own session (the request's session is gone by the time it streams).
+    """
+    stmt = build_query(fields, **filters)
+    if limit:
+        stmt = stmt.limit(limit)
+    db = session_factory()
+    try:
+        result = db.execute(stmt.execution_options(stream_results=True, yield_per=chunk_size)).mappings()
+        if export_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(fields)
+            for partition in result.partitions(chunk_size):
+                for row in partition:
+                    writer.writerow([_csv_value(row[name]) for name in fields])
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+        else:
+            for partition in result.partitions(chunk_size):
+                yield "".join(
+                    json.dumps({name: row[name] for name in fields}, default=_json_default) + "\n"
+                    for row in partition
+                )
+    finally:
+        db.close()
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
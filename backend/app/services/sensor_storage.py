@@ -0,0 +1,222 @@
+"""
+Sensor Data Storage Maintenance
+Keeps sensor_data fast as history grows:
+- makes sure the (device_id, timestamp) / timestamp indexes and newer rollup columns
+  exist on databases created before they were added to the models;
+- on Postgres with a month-partitioned sensor_data (scripts/partition_sensor_data.py),
+  creates the partitions for the coming months ahead of time;
+- runs the retention job: raw readings older than SENSOR_RAW_RETENTION_DAYS are removed
+  once the daily rollups account for every one of them (whole partitions are dropped
+  on Postgres, otherwise rows are deleted month by month in small batches), and 1-minute
+  rollups are trimmed after ROLLUP_1M_RETENTION_DAYS. With the Parquet archive enabled,
+  closed months are exported first and only those are eligible for removal.
+Each run also drops the Kalman filters of devices that have been idle for longer than
+KALMAN_MAX_IDLE_HOURS and deletes expired alert cooldowns from the shared store.
+"""
+import asyncio
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import delete, func, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .. import models
+from .cooldown_store import cooldown_store
+from .kalman_filter import kalman_bank
+from .rollups import month_start, next_month
+from .sensor_archive import sensor_archive
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r"^sensor_data_p(\d{4})(\d{2})$")
+
+
+def partition_name(start: datetime) -> str:
+    return f"sensor_data_p{start:%Y%m}"
+
+
+class SensorStorage:
+    def __init__(self, raw_retention_days: int = 0, minute_rollup_retention_days: int = 30,
+                 interval_hours: float = 24.0, months_ahead: int = 2, batch_size: int = 5000):
+        self.raw_retention_days = raw_retention_days
+        self.minute_rollup_retention_days = minute_rollup_retention_days
+        self.interval = interval_hours * 3600
+        self.months_ahead = months_ahead
+        self.batch_size = batch_size
+        self.last_run: Optional[dict] = None
+
+    # --- Schema ---
+    @staticmethod
+    def ensure_schema(engine: Engine):
+        """Adds indexes and rollup columns that create_all does not add to existing tables."""
+        for index in models.SensorData.__table__.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+        table = models.SensorRollup.__table__
+        existing = {column["name"] for column in inspect(engine).get_columns(table.name)}
+        with engine.begin() as conn:
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                    logger.info(f"Added column {table.name}.{column.name}")
+
+    @staticmethod
+    def is_partitioned(db: Session) -> bool:
+        if db.bind.dialect.name != "postgresql":
+            return False
+        return db.execute(text(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('sensor_data')"
+        )).first() is not None
+
+    def partitions(self, db: Session) -> List[Tuple[str, datetime]]:
+        """Monthly partitions of sensor_data as (name, month start), oldest first."""
+        rows = db.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass('sensor_data')"
+        )).scalars()
+        found = []
+        for name in rows:
+            match = PARTITION_NAME.match(name)
+            if match:
+                found.append((name, datetime(int(match.group(1)), int(match.group(2)), 1)))
+        return sorted(found, key=lambda p: p[1])
+
+    def ensure_partitions(self, db: Session, now: Optional[datetime] = None) -> List[str]:
+        """Creates the current and the next months_ahead monthly partitions if missing."""
+        start = month_start(now or datetime.utcnow())
+        created = []
+        for _ in range(self.months_ahead + 1):
+            end = next_month(start)
+            name = partition_name(start)
+            if db.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is None:
+                db.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF sensor_data "
+                    f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+                ))
+                db.commit()
+                created.append(name)
+            start = end
+        if created:
+            logger.info(f"Created sensor_data partitions: {', '.join(created)}")
+        return created
+
+    # --- Retention ---
+    @staticmethod
+    def covered(db: Session, start: datetime, end: datetime, device_id: Optional[str] = None) -> bool:
+        """True when the daily rollups account for every raw reading in [start, end)."""
+        raw = db.query(func.count(models.SensorData.id)).filter(
+            models.SensorData.timestamp >= start, models.SensorData.timestamp < end
+        )
+        rolled = db.query(func.coalesce(func.sum(models.SensorRollup.sample_count), 0)).filter(
+            models.SensorRollup.resolution == "1d",
+            models.SensorRollup.bucket_start >= start,
+            models.SensorRollup.bucket_start < end,
+        )
+        if device_id:
+            raw = raw.filter(models.SensorData.device_id == device_id)
+            rolled = rolled.filter(models.SensorRollup.device_id == device_id)
+        return raw.scalar() == rolled.scalar()
+
+    def _delete_range(self, db: Session, start: datetime, end: datetime) -> int:
+        """Deletes raw rows in [start, end) in batches so writers are never blocked for long."""
+        deleted = 0
+        while True:
+            ids = [row.id for row in db.query(models.SensorData.id).filter(
+                models.SensorData.timestamp >= start, models.SensorData.timestamp < end
+            ).limit(self.batch_size)]
+            if not ids:
+                return deleted
+            db.execute(delete(models.SensorData).where(models.SensorData.id.in_(ids)))
+            db.commit()
+            deleted += len(ids)
+
+    def apply_retention(self, db: Session, now: Optional[datetime] = None) -> dict:
+        now = now or datetime.utcnow()
+        result = {"dropped_partitions": [], "deleted_rows": 0, "skipped_months": [], "minute_rollups_deleted": 0}
+
+        if self.raw_retention_days > 0:
+            cutoff = (now - timedelta(days=self.raw_retention_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+            if sensor_archive.enabled:
+                cutoff = min(cutoff, month_start(now))  # only closed (archived) months
+            if self.is_partitioned(db):
+                for name, start in self.partitions(db):
+                    end = next_month(start)
+                    if end > cutoff:
+                        break
+                    if not self.covered(db, start, end):
+                        result["skipped_months"].append(f"{start:%Y-%m}")
+                        continue
+                    db.execute(text(f"ALTER TABLE sensor_data DETACH PARTITION {name}"))
+                    db.execute(text(f"DROP TABLE {name}"))
+                    db.commit()
+                    result["dropped_partitions"].append(name)
+            else:
+                oldest = db.query(func.min(models.SensorData.timestamp)).scalar()
+                start = month_start(oldest) if oldest else cutoff
+                while start < cutoff:
+                    end = min(next_month(start), cutoff)
+                    if self.covered(db, start, end):
+                        result["deleted_rows"] += self._delete_range(db, start, end)
+                    else:
+                        result["skipped_months"].append(f"{start:%Y-%m}")
+                    start = end
+            if result["skipped_months"]:
+                logger.warning(
+                    f"Retention kept raw data for {', '.join(result['skipped_months'])}: "
+                    f"not fully covered by rollups (run scripts/backfill_rollups.py)"
+                )
+
+        if self.minute_rollup_retention_days > 0:
+            minute_cutoff = now - timedelta(days=self.minute_rollup_retention_days)
+            result["minute_rollups_deleted"] = db.execute(delete(models.SensorRollup).where(
+                models.SensorRollup.resolution == "1m",
+                models.SensorRollup.bucket_start < minute_cutoff,
+            )).rowcount or 0
+            db.commit()
+        return result
+
+    def run_once(self, session_factory) -> dict:
+        db = session_factory()
+        try:
+            result = {"created_partitions": self.ensure_partitions(db) if self.is_partitioned(db) else []}
+            if sensor_archive.enabled:
+                result["archived"] = len(sensor_archive.archive_closed_months(db))
+            result.update(self.apply_retention(db))
+            result["evicted_filters"] = kalman_bank.evict_idle()
+            result["pruned_cooldowns"] = cooldown_store.prune()
+            result["finished_at"] = datetime.utcnow().isoformat()
+            self.last_run = result
+            logger.info(f"Sensor storage maintenance: {result}")
+            return result
+        finally:
+            db.close()
+
+    async def run(self, session_factory):
+        """Background task: partition upkeep and retention every interval_hours."""
+        while True:
+            try:
+                await asyncio.to_thread(self.run_once, session_factory)
+            except Exception as e:
+                logger.error(f"Sensor storage maintenance failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {
+            "raw_retention_days": self.raw_retention_days,
+            "minute_rollup_retention_days": self.minute_rollup_retention_days,
+            "last_run": self.last_run,
+            "archive": sensor_archive.stats(),
+        }
+
+
+sensor_storage = SensorStorage(
+    raw_retention_days=int(os.getenv("SENSOR_RAW_RETENTION_DAYS", "0")),
+    minute_rollup_retention_days=int(os.getenv("ROLLUP_1M_RETENTION_DAYS", "30")),
+    interval_hours=float(os.getenv("SENSOR_RETENTION_INTERVAL_HOURS", "24")),
+    months_ahead=int(os.getenv("SENSOR_PARTITION_MONTHS_AHEAD", "2")),
+)
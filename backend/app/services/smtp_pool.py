@@ -0,0 +1,142 @@
+"""
+SMTP Connection Pool
+Keeps authenticated SMTP sessions open between emails, so alerts/OTP/signup mails
+skip the connect + STARTTLS + login handshake. Idle sessions are health-checked with
+NOOP before reuse, broken ones are replaced, and concurrent sessions are capped.
+"""
+import logging
+import smtplib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Union
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the session is gone (retry on a fresh one); other SMTP errors are real send failures
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, OSError)
+
+
+class SMTPConnectionPool:
+    def __init__(self, host: str, port: int, username: str, password: str, max_connections: int = 4,
+                 idle_timeout: float = 240.0, noop_after: float = 30.0, timeout: float = 15.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout   # close sessions idle longer than this (servers drop them anyway)
+        self.noop_after = noop_after       # NOOP-check sessions idle longer than this before reuse
+        self.timeout = timeout
+        self._idle = deque()               # (smtp, last_used monotonic)
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+
+        # Stats
+        self.opened = 0
+        self.reused = 0
+        self.discarded = 0
+        self.sent = 0
+        self.failed = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            server.starttls()
+            server.login(self.username, self.password)
+        except Exception:
+            self._close(server)
+            raise
+        self.opened += 1
+        logger.info(f"SMTP session opened to {self.host}:{self.port}")
+        return server
+
+    @staticmethod
+    def _close(server: smtplib.SMTP):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _healthy(self, server: smtplib.SMTP, last_used: float) -> bool:
+        idle = time.monotonic() - last_used
+        if idle > self.idle_timeout:
+            return False
+        if idle > self.noop_after:
+            try:
+                return server.noop()[0] == 250
+            except Exception:
+                return False
+        return True
+
+    def _checkout(self) -> smtplib.SMTP:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, last_used = self._idle.pop()  # most recently used first
+            if self._healthy(server, last_used):
+                self.reused += 1
+                return server
+            self.discarded += 1
+            self._close(server)
+        return self._connect()
+
+    @contextmanager
+    def connection(self):
+        """Yields an authenticated session; it goes back to the pool unless the block raised."""
+        if not self._slots.acquire(timeout=self.timeout * 2):
+            raise TimeoutError(f"No SMTP session available ({self.max_connections} in use)")
+        try:
+            server = self._checkout()
+            try:
+                yield server
+            except Exception:
+                self.discarded += 1
+                self._close(server)
+                raise
+            with self._lock:
+                self._idle.append((server, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def sendmail(self, from_addr: str, to_addrs: Union[str, List[str]], message: str, retries: int = 1):
+        """Sends one message, retrying on a fresh session if the pooled one was dropped by the server."""
+        for attempt in range(retries + 1):
+            try:
+                with self.connection() as server:
+                    server.sendmail(from_addr, to_addrs, message)
+                self.sent += 1
+                return
+            except RECONNECT_ERRORS as e:
+                # SMTPException subclasses OSError: only retry disconnects and socket errors
+                if isinstance(e, smtplib.SMTPException) and not isinstance(e, smtplib.SMTPServerDisconnected):
+                    self.failed += 1
+                    raise
+                if attempt == retries:
+                    self.failed += 1
+                    raise
+                logger.warning(f"SMTP session lost ({e}), reconnecting...")
+
+    def close(self):
+        """Closes every idle session (call on shutdown)."""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for server, _ in idle:
+            self._close(server)
+
+    def stats(self) -> dict:
+        return {
+            "host": f"{self.host}:{self.port}",
+            "max_connections": self.max_connections,
+            "idle": len(self._idle),
+            "opened": self.opened,
+            "reused": self.reused,
+            "discarded": self.discarded,
+            "sent": self.sent,
+            "failed": self.failed,
+        }
@@ -0,0 +1,283 @@
+"""
+Streaming State Checkpoints
+Periodically saves the adaptive in-memory state - Kalman filters, the per-device
+rolling windows (trust, insight and anomaly-training buffers), baseline quantile
+sketches and fitted anomaly models - and restores it at startup, so a restart resumes with the same filters and
+models instead of cold.
+
+Layout under STATE_CHECKPOINT_DIR:
+- manifest.json                 device id -> file stem, save time
+- shared.npz / shared.model.pkl  version of the offline-fitted model, and the model
+- devices/<stem>.npz            filter state, rolling windows, sketches and retraining state of one device
+- devices/<stem>.model.pkl      its fitted IsolationForest (rewritten only when the version changes)
+
+Startup only reads the manifest and the small shared file; a device's files are
+loaded the first time that device reports again (prefetched in a thread by the
+ingestion endpoints, so the event loop never waits on them). The pickles are written and read
+only by this service, from its own directory.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+import numpy as np
+
+from .. import ml_engine
+from .kalman_filter import KalmanFilterBank, kalman_bank
+from .quantile_sketches import QuantileSketchStore, quantile_sketches
+from .rolling_windows import RollingWindowStore, rolling_windows
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "state")
+
+
+class StateCheckpoint:
+    def __init__(self, root: str, enabled: bool = True, interval_seconds: float = 300.0,
+                 bank: KalmanFilterBank = kalman_bank, windows: RollingWindowStore = rolling_windows,
+                 sketches: QuantileSketchStore = quantile_sketches,
+                 detector: Optional[ml_engine.IoTAnomalyDetector] = None):
+        self.root = root
+        self.enabled = enabled
+        self.interval = interval_seconds
+        self.bank = bank
+        self.windows = windows
+        self.sketches = sketches
+        self.detector = detector or ml_engine.anomaly_detector
+        self._stems: Dict[str, str] = {}              # device id -> file stem (from the manifest)
+        self._pending: Dict[str, Dict[str, dict]] = {}  # device id -> loaded parts not yet taken
+        self._saved_versions: Dict[str, int] = {}     # device id ("" = shared) -> model version on disk
+        self._taken: set = set()                      # devices whose saved state has been handed out
+        self._lock = threading.Lock()
+        self.last_save: Optional[dict] = None
+        self.restored_devices = 0
+
+    # --- Layout ---
+    @staticmethod
+    def _stem(device_id: str) -> str:
+        digest = hashlib.sha1(device_id.encode()).hexdigest()[:8]
+        return f"{re.sub(r'[^A-Za-z0-9_.-]', '_', device_id)[:64]}-{digest}"
+
+    def _path(self, *parts: str) -> str:
+        return os.path.join(self.root, *parts)
+
+    @staticmethod
+    def _write_atomic(path: str, write):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    # --- Save ---
+    def save(self) -> dict:
+        """Writes a checkpoint of the current state; returns a summary."""
+        started = time.perf_counter()
+        os.makedirs(self._path("devices"), exist_ok=True)
+        filters = self.bank.export()
+        windows = self.windows.export()
+        sketches = self.sketches.export()
+        models = self.detector.export()
+
+        written = 0
+        model_blobs = 0
+        for device_id in set(filters) | set(windows) | set(sketches) | set(models):
+            stem = self._stems.get(device_id) or self._stem(device_id)
+            arrays = {}
+            kf = filters.get(device_id)
+            if kf is not None:
+                arrays.update({f"kf_{key}": np.asarray(value) for key, value in kf.items()})
+            for name, state in windows.get(device_id, {}).items():
+                arrays[f"win_{name}"] = state["data"]
+                arrays[f"win_{name}_pushed"] = np.asarray(state["pushed"])
+            for metric, state in sketches.get(device_id, {}).items():
+                arrays.update({f"qs_{metric}__{key}": np.asarray(value) for key, value in state.items()})
+            anomaly = models.get(device_id)
+            fitted = anomaly["fitted"] if anomaly else None
+            if anomaly is not None:
+                arrays.update(
+                    ad_new_samples=np.asarray(anomaly["new_samples"]),
+                    ad_outlier_rate=np.asarray(anomaly["outlier_rate"]),
+                    ad_version=np.asarray(fitted.version if fitted else 0),
+                    ad_samples=np.asarray(fitted.samples if fitted else 0),
+                )
+            self._write_atomic(self._path("devices", f"{stem}.npz"), lambda f: np.savez_compressed(f, **arrays))
+            if fitted is not None and self._saved_versions.get(device_id) != fitted.version:
+                self._write_atomic(self._path("devices", f"{stem}.model.pkl"), lambda f: pickle.dump(fitted.model, f))
+                self._saved_versions[device_id] = fitted.version
+                model_blobs += 1
+            with self._lock:
+                self._stems[device_id] = stem
+            written += 1
+
+        self._save_shared()
+        with self._lock:
+            manifest = {"saved_at": datetime.utcnow().isoformat(), "devices": dict(self._stems)}
+        self._write_atomic(self._path("manifest.json"), lambda f: f.write(json.dumps(manifest).encode()))
+
+        self.last_save = {
+            "saved_at": manifest["saved_at"],
+            "devices": written,
+            "model_blobs": model_blobs,
+            "duration_ms": round((time.perf_counter() - started) * 1000.0, 1),
+        }
+        return self.last_save
+
+    def _save_shared(self):
+        shared = self.detector.shared
+        arrays = {
+            "shared_version": np.asarray(shared.version if shared else 0),
+            "shared_samples": np.asarray(shared.samples if shared else 0),
+        }
+        self._write_atomic(self._path("shared.npz"), lambda f: np.savez_compressed(f, **arrays))
+        if shared is not None and self._saved_versions.get("") != shared.version:
+            self._write_atomic(self._path("shared.model.pkl"), lambda f: pickle.dump(shared.model, f))
+            self._saved_versions[""] = shared.version
+
+    # --- Restore ---
+    def restore(self) -> int:
+        """
+        Reads the manifest and the shared state and installs the per-device restore hooks.
+        Returns the number of devices that can be restored.
+        """
+        manifest_path = self._path("manifest.json")
+        if not os.path.exists(manifest_path):
+            self._install_hooks()
+            return 0
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        with self._lock:
+            self._stems = dict(manifest.get("devices", {}))
+
+        shared_path = self._path("shared.npz")
+        if os.path.exists(shared_path):
+            with np.load(shared_path) as shared:
+                version, samples = int(shared["shared_version"]), int(shared["shared_samples"])
+            model_path = self._path("shared.model.pkl")
+            if version and os.path.exists(model_path):
+                with open(model_path, "rb") as f:
+                    self.detector.shared = ml_engine.FittedModel(pickle.load(f), version, samples)
+                self._saved_versions[""] = version
+
+        self._install_hooks()
+        logger.info(f"State checkpoint from {manifest.get('saved_at')}: {len(self._stems)} devices restorable")
+        return len(self._stems)
+
+    def _install_hooks(self):
+        self.bank.restore_hook = lambda device_id: self._take(device_id, "kalman")
+        self.windows.restore_hook = lambda device_id: self._take(device_id, "windows")
+        self.sketches.restore_hook = lambda device_id: self._take(device_id, "sketches")
+        self.detector.restore_hook = lambda device_id: self._take(device_id, "anomaly")
+
+    def _load_device(self, device_id: str) -> Dict[str, dict]:
+        stem = self._stems.get(device_id)
+        path = self._path("devices", f"{stem}.npz") if stem else None
+        if not path or not os.path.exists(path):
+            return {}
+        parts = {}
+        with np.load(path) as saved:
+            if "kf_x" in saved:
+                parts["kalman"] = {
+                    "x": saved["kf_x"],
+                    "P": saved["kf_P"],
+                    "initialized": saved["kf_initialized"],
+                    "mq_buffer": saved["kf_mq_buffer"],
+                    "mq_initialized": bool(saved["kf_mq_initialized"]),
+                }
+            windows = {
+                key[4:]: {"data": saved[key], "pushed": int(saved[f"{key}_pushed"])}
+                for key in saved.files if key.startswith("win_") and not key.endswith("_pushed")
+            }
+            if windows:
+                parts["windows"] = windows
+            sketches = {}
+            for key in saved.files:
+                if key.startswith("qs_"):
+                    metric, field = key[3:].split("__", 1)
+                    sketches.setdefault(metric, {})[field] = saved[key]
+            if sketches:
+                parts["sketches"] = sketches
+            if "ad_version" in saved:
+                version = int(saved["ad_version"])
+                model = None
+                model_path = self._path("devices", f"{stem}.model.pkl")
+                if version and os.path.exists(model_path):
+                    with open(model_path, "rb") as f:
+                        model = pickle.load(f)
+                    self._saved_versions[device_id] = version
+                parts["anomaly"] = {
+                    "new_samples": int(saved["ad_new_samples"]),
+                    "outlier_rate": float(saved["ad_outlier_rate"]),
+                    "model": model,
+                    "version": version,
+                    "samples": int(saved["ad_samples"]),
+                }
+        self.restored_devices += 1
+        return parts
+
+    def _load_pending(self, device_id: str) -> bool:
+        """Reads a restorable device's files into _pending (once). Call with the lock held."""
+        if device_id in self._pending:
+            return True
+        if device_id not in self._stems or device_id in self._taken:
+            return False
+        try:
+            self._pending[device_id] = self._load_device(device_id)
+        except Exception as e:
+            logger.error(f"Could not restore saved state of {device_id}: {e}")
+            self._taken.add(device_id)
+            return False
+        return True
+
+    def prefetch(self, device_id: str):
+        """
+        Reads a device's saved state ahead of its consumers, so their restore hooks only
+        take it from memory. Blocks on file I/O: run it in a thread, not on the event loop.
+        """
+        with self._lock:
+            self._load_pending(device_id)
+
+    def _take(self, device_id: str, part: str) -> Optional[dict]:
+        """One consumer's part of a device's saved state; the file is read once, on first use."""
+        with self._lock:
+            if not self._load_pending(device_id):
+                return None
+            parts = self._pending[device_id]
+            state = parts.pop(part, None)
+            if not parts:
+                del self._pending[device_id]
+                self._taken.add(device_id)
+            return state
+
+    # --- Background task ---
+    async def run(self):
+        """Saves a checkpoint every interval_seconds."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.save)
+            except Exception as e:
+                logger.error(f"State checkpoint failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "root": self.root,
+            "restorable_devices": len(self._stems),
+            "restored_devices": self.restored_devices,
+            "last_save": self.last_save,
+        }
+
+
+state_checkpoint = StateCheckpoint(
+    os.getenv("STATE_CHECKPOINT_DIR", DEFAULT_STATE_DIR),
+    enabled=os.getenv("STATE_CHECKPOINT_ENABLED", "true").lower() == "true",
+    interval_seconds=float(os.getenv("STATE_CHECKPOINT_SECONDS", "300")),
+)
@@ -0,0 +1,65 @@
+"""
+Exports closed months of sensor_data to the Parquet archive (SENSOR_ARCHIVE_DIR).
+
+Usage (from backend/):
+    python scripts/archive_sensor_data.py               # every closed month not archived yet
+    python scripts/archive_sensor_data.py --overwrite   # re-export existing files too
+    python scripts/archive_sensor_data.py --read ESP32_MAIN --days 30
+    python scripts/archive_sensor_data.py --backtest ESP32_MAIN --days 30   # fit on the rest, score this device
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import SessionLocal
+from app.services.sensor_archive import sensor_archive
+from app.ml_engine import anomaly_detector
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive sensor_data to Parquet")
+    parser.add_argument("--overwrite", action="store_true", help="re-export months that are already archived")
+    parser.add_argument("--read", metavar="DEVICE_ID", help="read back a device instead of exporting")
+    parser.add_argument("--backtest", metavar="DEVICE_ID",
+                        help="fit the anomaly model on the other archived devices and score this one")
+    parser.add_argument("--days", type=int, default=31, help="range to read back (with --read / --backtest)")
+    args = parser.parse_args()
+
+    if args.backtest:
+        start = datetime.utcnow() - timedelta(days=args.days)
+        others = [d for d in sensor_archive.devices() if d != sensor_archive._safe(args.backtest)]
+        if not anomaly_detector.fit_offline(sensor_archive.training_matrix(others or [args.backtest], start)):
+            print("❌ Not enough archived readings to fit a model")
+            return
+        flags, scores = anomaly_detector.backtest(sensor_archive.training_matrix([args.backtest], start))
+        print(f"✅ {args.backtest}: {int(np.sum(flags))}/{len(flags)} readings flagged, "
+              f"min score {float(np.min(scores)) if len(scores) else 0.0:.3f}")
+        return
+
+    if args.read:
+        started = time.perf_counter()
+        data = sensor_archive.read(args.read, start=datetime.utcnow() - timedelta(days=args.days),
+                                   columns=["timestamp", "temperature", "humidity", "gas"])
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"✅ {len(data['timestamp'])} rows for {args.read} in {elapsed:.1f} ms")
+        return
+
+    db = SessionLocal()
+    try:
+        exported = sensor_archive.archive_closed_months(db, overwrite=args.overwrite)
+        for device_id, month, rows in exported:
+            print(f"  {device_id} {month}: {rows} rows")
+        print(f"✅ Archived {len(exported)} device-months to {sensor_archive.root}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Backfills the 1m / 1h / 1d sensor_rollups from existing sensor_data rows.
+
+Usage (from backend/):
+    python scripts/backfill_rollups.py                  # all history
+    python scripts/backfill_rollups.py --days 30        # last 30 days only
+    python scripts/backfill_rollups.py --device ESP32_MAIN
+
+Rollups in the selected range are recomputed from scratch (days already trimmed by
+the raw-data retention job are kept as they are). Run it while ingestion is
+paused: readings buffered by a running server for the same range would be
+counted twice when it flushes.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import SessionLocal, engine, Base
+from app import models
+from app.services.rollups import rollup_store
+from app.services.sensor_storage import sensor_storage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild sensor rollups from sensor_data")
+    parser.add_argument("--days", type=int, default=None, help="only rebuild the last N days")
+    parser.add_argument("--device", default=None, help="only rebuild one device")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine, tables=[models.SensorRollup.__table__])
+    sensor_storage.ensure_schema(engine)  # rollup columns added after the table was created
+
+    since = datetime.utcnow() - timedelta(days=args.days) if args.days else None
+    db = SessionLocal()
+    try:
+        total = rollup_store.rebuild(db, since=since, device_id=args.device)
+        print(f"✅ Rebuilt rollups from {total} sensor_data rows")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
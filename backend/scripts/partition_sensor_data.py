@@ -0,0 +1,88 @@
+"""
+Converts sensor_data on Postgres into a table range-partitioned by month.
+
+Usage (from backend/, with the server stopped):
+    python scripts/partition_sensor_data.py               # keeps the old table as sensor_data_legacy
+    python scripts/partition_sensor_data.py --drop-legacy
+
+Creates one partition per month from the oldest reading up to the coming months
+(sensor_data_pYYYYMM) plus a default partition, copies the rows over and keeps the
+id sequence. The app keeps creating future partitions and drops expired ones (see
+app/services/sensor_storage.py). SQLite deployments keep the single table; the
+retention job deletes expired rows there in batches instead.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+
+from sqlalchemy import text
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import SessionLocal, engine
+from app.services.sensor_storage import month_start, next_month, partition_name, sensor_storage
+
+
+def partition():
+    parser = argparse.ArgumentParser(description="Partition sensor_data by month (Postgres)")
+    parser.add_argument("--drop-legacy", action="store_true", help="drop the unpartitioned table afterwards")
+    args = parser.parse_args()
+
+    if engine.dialect.name != "postgresql":
+        print("ℹ️  Not a Postgres database: sensor_data stays a single table (retention deletes in batches).")
+        return
+
+    db = SessionLocal()
+    try:
+        if sensor_storage.is_partitioned(db):
+            print("ℹ️  sensor_data is already partitioned.")
+            return
+
+        oldest = db.execute(text("SELECT min(timestamp) FROM sensor_data")).scalar() or datetime.utcnow()
+        db.execute(text("ALTER TABLE sensor_data RENAME TO sensor_data_legacy"))
+        for index in db.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = 'sensor_data_legacy'")).scalars():
+            if index.startswith("ix_sensor_data"):
+                db.execute(text(f'ALTER INDEX "{index}" RENAME TO "{index.replace("ix_sensor_data", "ix_sensor_data_legacy", 1)}"'))
+
+        # The partition key has to be part of the primary key; ids stay unique via the shared sequence
+        db.execute(text(
+            "CREATE TABLE sensor_data (LIKE sensor_data_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp)"
+        ))
+        db.execute(text("ALTER TABLE sensor_data ALTER COLUMN timestamp SET NOT NULL"))
+        db.execute(text("ALTER TABLE sensor_data ADD PRIMARY KEY (id, timestamp)"))
+        db.execute(text("ALTER TABLE sensor_data ADD FOREIGN KEY (device_id) REFERENCES devices (id)"))
+        db.execute(text("ALTER TABLE sensor_data ADD FOREIGN KEY (user_id) REFERENCES users (id)"))
+        db.execute(text("CREATE INDEX ix_sensor_data_device_ts ON sensor_data (device_id, timestamp)"))
+        db.execute(text("CREATE INDEX ix_sensor_data_timestamp ON sensor_data (timestamp)"))
+        db.execute(text("CREATE INDEX ix_sensor_data_id ON sensor_data (id)"))
+
+        start, last = month_start(oldest), next_month(next_month(datetime.utcnow()))
+        months = 0
+        while start <= last:
+            end = next_month(start)
+            db.execute(text(
+                f"CREATE TABLE {partition_name(start)} PARTITION OF sensor_data "
+                f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+            ))
+            start, months = end, months + 1
+        db.execute(text("CREATE TABLE sensor_data_default PARTITION OF sensor_data DEFAULT"))
+
+        copied = db.execute(text(
+            "INSERT INTO sensor_data SELECT * FROM sensor_data_legacy WHERE timestamp IS NOT NULL"
+        )).rowcount
+        db.execute(text("ALTER SEQUENCE IF EXISTS sensor_data_id_seq OWNED BY sensor_data.id"))
+        if args.drop_legacy:
+            db.execute(text("DROP TABLE sensor_data_legacy"))
+        db.commit()
+        print(f"✅ sensor_data partitioned into {months} monthly partitions ({copied} rows copied)")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Partitioning failed, nothing was changed: {e}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    partition()
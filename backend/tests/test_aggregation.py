@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app import models
+from app.services.aggregation import Aggregator, auto_bucket, parse_bucket
+from app.services.rollups import RollupStore
+
+BASE = datetime(2026, 2, 10)
+METRICS = ["temperature", "humidity", "gas"]
+
+
+@pytest.fixture
+def aggregator(db):
+    rng = np.random.default_rng(5)
+    rows = [
+        dict(device_id=f"D{i % 3}", timestamp=BASE + timedelta(seconds=53 * i), temperature=float(rng.normal(22, 2)),
+             humidity=None if i % 7 == 0 else float(40 + i % 11), gas=float(100 + i % 13), pm2_5=5.0)
+        for i in range(4000)
+    ]
+    db.execute(models.SensorData.__table__.insert(), rows)
+    db.commit()
+    store = RollupStore()
+    store.rebuild(db, BASE)
+    return Aggregator(store, chunk_rows=100)
+
+
+@pytest.mark.parametrize("bucket", ["1h", "3h", "1d", "2m"])
+@pytest.mark.parametrize("device_id", [None, "D1"])
+def test_rollup_series_match_raw_series(db, aggregator, bucket, device_id):
+    # Unaligned edges: partial rollup buckets must come from finer data and stop at `end`
+    start, end = BASE + timedelta(minutes=17, seconds=23), BASE + timedelta(days=2, hours=1, minutes=7, seconds=41)
+    rolled = aggregator.aggregate(db, METRICS, start, end, bucket, device_id)
+    raw = aggregator.aggregate(db, METRICS, start, end, bucket, device_id, percentiles=[50])
+    assert rolled["source"].startswith("rollup:") and raw["source"] == "raw"
+    assert rolled["buckets"] == raw["buckets"]
+    for metric in METRICS:
+        assert rolled["series"][metric] == {k: v for k, v in raw["series"][metric].items() if k != "p50"}
+
+    in_range = db.query(models.SensorData).filter(
+        models.SensorData.timestamp >= start, models.SensorData.timestamp < end,
+        *([models.SensorData.device_id == device_id] if device_id else [])
+    ).count()
+    assert sum(rolled["series"]["gas"]["count"]) == in_range
+
+
+def test_raw_percentiles(db, aggregator):
+    result = aggregator.aggregate(db, ["gas"], BASE, BASE + timedelta(hours=1), "1h", "D0", percentiles=[50, 90])
+    values = [r.gas for r in db.query(models.SensorData).filter(
+        models.SensorData.device_id == "D0", models.SensorData.timestamp < BASE + timedelta(hours=1))]
+    series = result["series"]["gas"]
+    assert series["count"] == [len(values)]
+    assert series["p50"] == [round(float(np.percentile(values, 50)), 3)]
+    assert series["p90"] == [round(float(np.percentile(values, 90)), 3)]
+
+
+def test_empty_range(db, aggregator):
+    result = aggregator.aggregate(db, ["gas"], BASE - timedelta(days=2), BASE - timedelta(days=1), "1h")
+    assert result["buckets"] == [] and result["series"]["gas"]["count"] == []
+
+
+def test_bucket_parsing():
+    assert parse_bucket("15m") == 900 and parse_bucket("1d") == 86400
+    with pytest.raises(ValueError):
+        parse_bucket("0h")
+    assert auto_bucket(BASE, BASE + timedelta(days=1), 96) == "15m"
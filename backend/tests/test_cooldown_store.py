@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services.cooldown_store import MemoryCooldownStore, SQLCooldownStore
+
+COOLDOWN = timedelta(minutes=10)
+T0 = datetime(2026, 5, 1, 12, 0)
+
+
+@pytest.fixture(params=["memory", "db"])
+def store(request, engine):
+    if request.param == "memory":
+        return MemoryCooldownStore(COOLDOWN)
+    return SQLCooldownStore(engine, COOLDOWN)
+
+
+def test_claim_blocks_until_the_cooldown_expires(store):
+    assert store.claim("dev:a@x.com", T0)
+    assert not store.claim("dev:a@x.com", T0 + timedelta(minutes=9))
+    assert store.get("dev:a@x.com") == T0
+    assert store.claim("dev:a@x.com", T0 + COOLDOWN)
+    assert store.get("dev:a@x.com") == T0 + COOLDOWN
+
+
+def test_keys_are_independent(store):
+    assert store.claim("dev:a@x.com", T0)
+    assert store.claim("dev:b@x.com", T0)
+    assert store.get("other") is None
+
+
+def test_release_only_undoes_the_matching_claim(store):
+    assert store.claim("k", T0)
+    store.release("k", T0 - timedelta(seconds=1))  # a stale release is ignored
+    assert store.get("k") == T0
+    store.release("k", T0)
+    assert store.get("k") is None
+    assert store.claim("k", T0 + timedelta(seconds=1))
+
+
+def test_reset(store):
+    store.claim("a", T0)
+    store.claim("b", T0)
+    assert store.reset() == 2
+    assert store.claim("a", T0)
+
+
+def test_memory_store_prunes_expired_and_excess_entries():
+    store = MemoryCooldownStore(COOLDOWN, max_entries=3)
+    for i in range(5):
+        assert store.claim(f"k{i}", T0 + timedelta(seconds=i))
+    assert list(store._entries) == ["k2", "k3", "k4"]
+    store.claim("late", T0 + COOLDOWN + timedelta(seconds=3))
+    assert list(store._entries) == ["k4", "late"]
+
+
+def test_sql_claim_joins_the_callers_transaction(engine, db):
+    store = SQLCooldownStore(engine, COOLDOWN)
+    assert store.claim("k", T0, db)
+    assert not store.claim("k", T0 + timedelta(minutes=1), db)
+    db.rollback()  # the staged alert was not stored, so neither is its cooldown
+    assert store.get("k") is None
+    assert store.claim("k", T0, db)
+    db.commit()
+    assert store.get("k") == T0
+
+
+def test_sql_prune_removes_only_expired_cooldowns(engine):
+    store = SQLCooldownStore(engine, COOLDOWN)
+    store.claim("old", T0)
+    store.claim("new", T0 + timedelta(minutes=5))
+    assert store.prune(T0 + COOLDOWN) == 1
+    assert store.get("old") is None and store.get("new") is not None
@@ -0,0 +1,58 @@
+import json
+from datetime import datetime
+
+from app import models
+from app.services.dashboard_snapshots import DashboardSnapshots
+from app.services.latest_readings import LatestReadings, snapshot
+
+
+def _reading(db, temperature, device_id="ESP32_MAIN"):
+    row = models.SensorData(device_id=device_id, timestamp=datetime.utcnow(), temperature=temperature,
+                            humidity=55.0, pm2_5=12.0, pressure=1010.0, gas=120.0)
+    db.add(row)
+    db.commit()
+    return row
+
+
+def _worker(session_factory):
+    """A worker process's view: its own registry and snapshots over the shared database."""
+    readings = LatestReadings(refresh_seconds=0, check_seconds=0)
+    snapshots = DashboardSnapshots(readings)
+    snapshots.attach(session_factory)
+    return readings, snapshots
+
+
+def test_etag_depends_only_on_the_payload(db, session_factory):
+    _reading(db, 24.0)
+    _, first = _worker(session_factory)
+    _, second = _worker(session_factory)
+    etag, body = first.get(db)
+    assert json.loads(body)["filtered"]["temperature"] == 24.0
+    assert etag.startswith('"') and etag.endswith('"')
+    # Another worker (or a restart) serving the same reading answers with the same tag
+    assert second.get(db) == (etag, body)
+    first.refresh(db)
+    assert first.get(db)[0] == etag
+
+
+def test_new_reading_changes_the_etag(db, session_factory):
+    readings, snapshots = _worker(session_factory)
+    _reading(db, 24.0)
+    etag, _ = snapshots.get(db)
+    readings.record(snapshot(_reading(db, 31.0)))
+    new_etag, body = snapshots.get(db)
+    assert new_etag != etag
+    assert json.loads(body)["filtered"]["temperature"] == 31.0
+
+
+def test_no_data_payload(db, session_factory):
+    _, snapshots = _worker(session_factory)
+    etag, body = snapshots.get(db)
+    assert json.loads(body)["status"] == "no_data"
+    assert snapshots.get(db)[0] == etag
+
+
+def test_not_modified_is_counted_in_stats(db, session_factory):
+    _, snapshots = _worker(session_factory)
+    snapshots.record_not_modified()
+    assert snapshots.stats()["not_modified"] == 1
@@ -0,0 +1,46 @@
+import time
+from datetime import datetime, timedelta
+
+from app.services.historical_context import HistoricalContextService
+from app.services.rollups import RollupStore
+
+
+def _sample(ts, temperature, device_id="dev"):
+    return {"device_id": device_id, "timestamp": ts, "temperature": temperature, "humidity": 50.0, "gas": 100.0,
+            "pm2_5": None, "rain": None, "anomaly_label": "Normal", "smart_insight": ""}
+
+
+def _worker():
+    """One uvicorn worker's view: its own rollup buffer and in-memory history over the shared database."""
+    return HistoricalContextService(RollupStore(flush_interval=0.01), ttl_seconds=0)
+
+
+def test_workers_see_each_others_flushed_readings(db):
+    now = datetime.utcnow()
+    a, b = _worker(), _worker()
+    assert b.context(db, "dev", now)["yesterday"] is None  # b loads before a has flushed anything
+
+    a.record(_sample(now - timedelta(days=1), 20.0))
+    a.store.flush(db)
+    b.record(_sample(now - timedelta(hours=1), 30.0))  # b ingests too, and has not flushed yet
+    time.sleep(0.02)
+
+    context = b.context(db, "dev", now)
+    assert context["yesterday"]["temperature"] == 20.0
+    assert context["week_averages"]["temperature"] == 25.0  # flushed + b's pending, each counted once
+
+    b.store.flush(db)
+    time.sleep(0.02)
+    for worker in (a, b):
+        assert worker.context(db, "dev", now)["week_averages"]["temperature"] == 25.0
+
+
+def test_unflushed_readings_are_kept_across_reloads(db):
+    now = datetime.utcnow()
+    worker = _worker()
+    worker.record(_sample(now - timedelta(days=7), 18.0))
+    for _ in range(3):
+        time.sleep(0.02)
+        context = worker.context(db, "dev", now)
+        assert context["last_week"]["temperature"] == 18.0
+        assert worker.stats()["devices"] == 1
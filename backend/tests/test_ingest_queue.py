@@ -0,0 +1,110 @@
+import asyncio
+import threading
+
+from app.services.ingest_queue import WriteBehindQueue
+
+
+class Recorder:
+    """persist() stand-in: records committed groups, optionally failing or blocking."""
+
+    def __init__(self, bad=(), transient_failures=0, gate=None):
+        self.groups = []
+        self.bad = set(bad)
+        self.transient_failures = transient_failures
+        self.gate = gate
+        self.calls = 0
+
+    def __call__(self, items):
+        self.calls += 1
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.transient_failures:
+            self.transient_failures -= 1
+            raise RuntimeError("database is locked")
+        if self.bad & set(items):
+            raise ValueError("bad row")
+        self.groups.append(list(items))
+        return len(items)
+
+
+def _committed(recorder):
+    return sorted(item for group in recorder.groups for item in group)
+
+
+def test_groups_by_batch_size_and_drains_on_stop():
+    async def scenario():
+        recorder = Recorder()
+        queue = WriteBehindQueue(batch_size=4, max_wait_ms=1000)
+        queue.start(recorder)
+        for i in range(10):
+            assert queue.submit(i)
+        await asyncio.sleep(0.05)
+        await queue.stop()
+        assert not queue.submit(99)
+        return recorder, queue
+
+    recorder, queue = asyncio.run(scenario())
+    assert _committed(recorder) == list(range(10))
+    assert [len(group) for group in recorder.groups][:2] == [4, 4]
+    assert queue.committed_rows == 10 and queue.rejected == 1
+
+
+def test_stop_waits_for_the_commit_in_flight():
+    gate = threading.Event()
+
+    async def scenario():
+        recorder = Recorder(gate=gate)
+        queue = WriteBehindQueue(batch_size=2, max_wait_ms=10)
+        queue.start(recorder)
+        for i in range(5):
+            queue.submit(i)
+        await asyncio.sleep(0.05)  # first group is blocked inside persist
+        stopping = asyncio.create_task(queue.stop())
+        await asyncio.sleep(0.05)
+        gate.set()
+        await stopping
+        return recorder
+
+    recorder = asyncio.run(scenario())
+    assert _committed(recorder) == list(range(5))  # each row exactly once
+
+
+def test_transient_failures_are_retried():
+    async def scenario():
+        recorder = Recorder(transient_failures=2)
+        queue = WriteBehindQueue(batch_size=3, max_wait_ms=10, retry_backoff_seconds=0.01)
+        queue.start(recorder)
+        for i in range(3):
+            queue.submit(i)
+        await asyncio.sleep(0.2)
+        await queue.stop()
+        return recorder, queue
+
+    recorder, queue = asyncio.run(scenario())
+    assert recorder.groups == [[0, 1, 2]]
+    assert queue.retries == 2 and queue.failed_rows == 0
+
+
+def test_bad_rows_are_isolated_and_dead_lettered():
+    dead = []
+    committed_hooks = []
+
+    async def after_commit(items, result):
+        committed_hooks.append(list(items))
+
+    async def scenario():
+        recorder = Recorder(bad={3, 6})
+        queue = WriteBehindQueue(batch_size=8, max_wait_ms=10, max_retries=1, retry_backoff_seconds=0.01)
+        queue.start(recorder, after_commit, lambda items, error: dead.append((items, str(error))))
+        for i in range(8):
+            queue.submit(i)
+        await asyncio.sleep(0.3)
+        await queue.stop()
+        return recorder, queue
+
+    recorder, queue = asyncio.run(scenario())
+    assert _committed(recorder) == [0, 1, 2, 4, 5, 7]
+    assert sorted(items[0] for items, _ in dead) == [3, 6]
+    assert all(error == "bad row" for _, error in dead)
+    assert sorted(item for items in committed_hooks for item in items) == [0, 1, 2, 4, 5, 7]
+    assert queue.failed_rows == 2 and queue.committed_rows == 6
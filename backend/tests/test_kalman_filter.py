@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from app.services.kalman_filter import KalmanFilterBank
+
+
+class ScalarKalman:
+    """The former per-device filter: one constant-velocity filter per metric, stepped alone."""
+
+    def __init__(self, initial_value=0.0):
+        self.x = np.array([[initial_value], [0.0]])
+        self.P = np.eye(2)
+        self.F = np.array([[1.0, 1.0], [0.0, 1.0]])
+        self.H = np.array([[1.0, 0.0]])
+        self.Q = np.eye(2) * 0.1
+        self.R = np.array([[0.1]])
+
+    def filter(self, measurement):
+        self.x = self.F @ self.x
+        self.P = self.F @ self.P @ self.F.T + self.Q
+        S = self.H @ self.P @ self.H.T + self.R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ (measurement - self.H @ self.x)
+        self.P = (np.eye(2) - K @ self.H) @ self.P
+        return float(self.x[0, 0]), float(np.sqrt(self.P[0, 0]))
+
+
+def _readings(steps=12, devices=("a", "b", "c")):
+    rng = np.random.default_rng(2)
+    ids, values = [], []
+    for t in range(steps):
+        for d, device_id in enumerate(devices):
+            ids.append(device_id)
+            values.append([21.0 + d + 0.1 * t + rng.normal(0, 0.3), 50.0 - d + rng.normal(0, 1), 12.0 + rng.normal(0, 2)])
+    return ids, np.array(values)
+
+
+@pytest.mark.parametrize("batch_size", [1, 5, 36])
+def test_bank_matches_per_device_scalar_filters_seeded_with_the_first_reading(batch_size):
+    ids, values = _readings()
+    bank = KalmanFilterBank(max_devices=4)
+    reference = {}
+    for start in range(0, len(ids), batch_size):
+        chunk = slice(start, start + batch_size)
+        results = bank.filter_batch(ids[chunk], values[chunk], np.full(len(ids[chunk]), 100.0))
+        for device_id, row, result in zip(ids[chunk], values[chunk], results):
+            if device_id not in reference:
+                reference[device_id] = [ScalarKalman(z) for z in row]
+            for m, metric in enumerate(KalmanFilterBank.METRICS):
+                assert result[metric] == pytest.approx(reference[device_id][m].filter(row[m]), abs=1e-9)
+
+
+def test_first_reading_seeding_only_differs_from_a_zero_start_at_first():
+    ids, values = _readings(steps=30, devices=("a",))
+    bank = KalmanFilterBank(max_devices=1)
+    zero_start = ScalarKalman()
+    gaps = [
+        abs(bank.filter_reading("a", *row, 100.0)["temperature"][0] - zero_start.filter(row[0])[0])
+        for row in values
+    ]
+    # A zero-started filter reports ~95% of the first reading; the difference then dies out
+    assert gaps[0] > 0.5
+    assert max(gaps[15:]) < 1e-4
+
+
+def test_mq_moving_average_and_z_score():
+    bank = KalmanFilterBank(max_devices=1, mq_window=5)
+    raw = [100.0, 101.0, 99.0, 100.0, 100.0, 160.0]
+    results = [bank.filter_reading("a", 20.0, 50.0, 10.0, r)["mq"] for r in raw]
+    assert results[0] == {"smoothed": 100.0, "is_outlier": False, "z_score": 0.0}
+    window = np.array(raw[1:])
+    assert results[-1]["smoothed"] == pytest.approx(window.mean())
+    assert results[-1]["z_score"] == pytest.approx((160.0 - window.mean()) / window.std())
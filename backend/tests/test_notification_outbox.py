@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import models
+from app.services.notification_outbox import NotificationOutbox
+
+Outbox = models.NotificationOutbox
+
+
+@pytest.fixture
+def outbox():
+    return NotificationOutbox(max_attempts=3, base_backoff=30.0, max_backoff=300.0, lease_seconds=60.0)
+
+
+def _enqueue(db, count=1, channel="email"):
+    for i in range(count):
+        NotificationOutbox.enqueue(db, channel, {"n": i}, recipient=f"user{i}@x.com",
+                                   deliver_at=datetime.utcnow() - timedelta(seconds=1))
+    db.commit()
+
+
+def test_backoff_grows_exponentially_with_jitter_and_cap(outbox):
+    for attempts, base in ((1, 30), (2, 60), (3, 120), (4, 240), (5, 300), (20, 300)):
+        delay = outbox.backoff(attempts).total_seconds()
+        assert base * 0.8 <= delay <= base * 1.2
+
+
+def test_claim_leases_entries_once(db, outbox):
+    _enqueue(db, 3)
+    first = outbox.claim(db, 2)
+    assert len(first) == 2 and len({token for _, _, token in first}) == 1
+    second = outbox.claim(db, 10)
+    assert len(second) == 1
+    assert {entry_id for entry_id, _, _ in first}.isdisjoint(entry_id for entry_id, _, _ in second)
+    assert outbox.claim(db, 10) == []
+    leased = db.query(Outbox).filter(Outbox.status == "sending").all()
+    assert len(leased) == 3 and all(entry.locked_until > datetime.utcnow() for entry in leased)
+
+
+def test_expired_lease_is_reclaimed(db, outbox):
+    _enqueue(db)
+    (entry_id, _, token), = outbox.claim(db, 1)
+    db.query(Outbox).filter(Outbox.id == entry_id).update({"locked_until": datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+    (again_id, _, new_token), = outbox.claim(db, 1)
+    assert again_id == entry_id and new_token != token
+
+    delivered = []
+    outbox.register("email", lambda db, entry, payload: delivered.append(entry.id) or True)
+    outbox.deliver(db, [entry_id], token)  # the lost lease's worker must not deliver it
+    assert delivered == []
+    outbox.deliver(db, [entry_id], new_token)
+    assert delivered == [entry_id]
+    assert db.get(Outbox, entry_id).status == "sent"
+
+
+def test_failed_delivery_backs_off_then_fails_permanently(db, outbox):
+    outbox.register("email", lambda db, entry, payload: "SMTP 451")
+    _enqueue(db)
+    for attempt in range(1, 4):
+        claimed = outbox.claim(db, 1)
+        assert len(claimed) == 1
+        entry_id, _, token = claimed[0]
+        before = datetime.utcnow()
+        outbox.deliver(db, [entry_id], token)
+        db.expire_all()
+        entry = db.get(Outbox, entry_id)
+        assert entry.attempts == attempt and entry.last_error == "SMTP 451"
+        if attempt < 3:
+            assert entry.status == "pending"
+            assert entry.next_attempt_at >= before + timedelta(seconds=30 * 2 ** (attempt - 1) * 0.8)
+            assert outbox.claim(db, 1) == []  # not due yet
+            entry.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+            db.commit()
+    assert entry.status == "failed"
+    assert (outbox.retried, outbox.failed) == (2, 1)
+
+
+def test_batch_handler_receives_all_claimed_entries(db, outbox):
+    batches = []
+    outbox.register_batch("digest", lambda db, entries, payloads: batches.append(payloads) or [True] * len(entries))
+    _enqueue(db, 3, channel="digest")
+    claimed = outbox.claim(db, 10)
+    outbox.deliver(db, [entry_id for entry_id, _, _ in claimed], claimed[0][2])
+    assert batches == [[{"n": 0}, {"n": 1}, {"n": 2}]]
+    assert db.query(Outbox).filter(Outbox.status == "sent").count() == 3
+
+
+def test_unknown_channel_is_retried(db, outbox):
+    _enqueue(db, channel="fax")
+    (entry_id, _, token), = outbox.claim(db, 1)
+    outbox.deliver(db, [entry_id], token)
+    entry = db.get(Outbox, entry_id)
+    assert entry.status == "pending" and "No handler" in entry.last_error
@@ -0,0 +1,80 @@
+import numpy as np
+
+from app.services.quantile_sketches import QuantileSketch, QuantileSketchStore
+
+
+def _sketch(values, k=200):
+    sketch = QuantileSketch(k)
+    for value in values:
+        sketch.update(value)
+    return sketch
+
+
+def test_quantiles_within_rank_error():
+    values = np.random.default_rng(1).normal(20.0, 5.0, 20000)
+    sketch = _sketch(values)
+    ordered = np.sort(values)
+    for q in (0.05, 0.25, 0.5, 0.75, 0.95):
+        estimate = sketch.quantile(q)
+        true_rank = np.searchsorted(ordered, estimate) / len(values)
+        assert abs(true_rank - q) < 0.02
+    assert sketch.quantile(0.0) == values.min()
+    assert sketch.quantile(1.0) == values.max()
+    assert sketch._size < 2000  # holds O(k) values, not the stream
+
+
+def test_rank_and_nan_handling():
+    sketch = _sketch(range(1000))
+    sketch.update(float("nan"))
+    assert len(sketch) == 1000
+    assert abs(sketch.rank(500) - 0.5) < 0.02
+    assert sketch.rank(-1) == 0.0
+    assert sketch.rank(5000) == 1.0
+
+
+def test_empty_sketch():
+    sketch = QuantileSketch()
+    assert sketch.quantile(0.5) is None
+    assert sketch.describe((0.5,), 1.0) == (None, None)
+
+
+def test_merge_matches_single_stream():
+    rng = np.random.default_rng(2)
+    a, b = rng.uniform(0, 100, 8000), rng.uniform(50, 150, 8000)
+    merged = _sketch(a)
+    merged.merge(_sketch(b))
+    assert len(merged) == 16000
+    assert merged.min == min(a.min(), b.min()) and merged.max == max(a.max(), b.max())
+    combined = np.sort(np.concatenate([a, b]))
+    median_rank = np.searchsorted(combined, merged.quantile(0.5)) / len(combined)
+    assert abs(median_rank - 0.5) < 0.02
+
+
+def test_state_round_trip():
+    sketch = _sketch(np.random.default_rng(3).exponential(2.0, 5000))
+    restored = QuantileSketch.from_state(sketch.state())
+    assert len(restored) == len(sketch)
+    assert restored.levels == sketch.levels
+    for q in (0.1, 0.5, 0.9):
+        assert restored.quantile(q) == sketch.quantile(q)
+
+
+def test_store_profiles_after_min_samples():
+    store = QuantileSketchStore(("temperature",), min_samples=30)
+    for i in range(30):
+        assert store.observe("dev", {"temperature": float(i)}) == {}
+    profile = store.observe("dev", {"temperature": 29.0, "gas": None})["temperature"]
+    assert profile["samples"] == 30
+    assert profile["p5"] <= profile["p50"] <= profile["p95"]
+    assert profile["percentile"] > 90
+    assert 0.0 <= profile["unusualness"] <= 1.0
+
+
+def test_store_evicts_least_recently_used():
+    store = QuantileSketchStore(("temperature",), max_devices=2)
+    store.observe("a", {"temperature": 1.0})
+    store.observe("b", {"temperature": 1.0})
+    store.observe("a", {"temperature": 1.0})
+    store.observe("c", {"temperature": 1.0})
+    assert set(store.export()) == {"a", "c"}
+    assert store.evicted == 1
@@ -0,0 +1,81 @@
+import numpy as np
+
+from app.services.rolling_windows import RollingWindow, RollingWindowStore
+
+
+def _reference(rows, capacity):
+    return np.array(rows[-capacity:], dtype=float)
+
+
+def test_stats_match_numpy_over_the_window():
+    rng = np.random.default_rng(4)
+    window = RollingWindow(("temperature", "gas"), capacity=50)
+    rows = []
+    for i in range(437):
+        row = [rng.normal(25, 3), np.nan if i % 7 == 3 else rng.uniform(0, 500)]
+        rows.append(row)
+        window.push(row)
+        expected = _reference(rows, 50)
+        for column, name in enumerate(("temperature", "gas")):
+            values = expected[:, column][~np.isnan(expected[:, column])]
+            assert window.count(name) == len(values)
+            assert np.isclose(window.mean(name), values.mean())
+            assert np.isclose(window.std(name), values.std())
+            assert window.min(name) == values.min()
+            assert window.max(name) == values.max()
+    assert len(window) == 50
+    assert np.array_equal(window.snapshot(), _reference(rows, 50), equal_nan=True)
+
+
+def test_min_max_expire_with_the_oldest_rows():
+    window = RollingWindow(("v",), capacity=3)
+    for value in (9.0, 1.0, 5.0):
+        window.push([value])
+    assert (window.min("v"), window.max("v")) == (1.0, 9.0)
+    window.push([4.0])  # 9 leaves
+    assert (window.min("v"), window.max("v")) == (1.0, 5.0)
+    window.push([6.0])  # 1 leaves
+    assert (window.min("v"), window.max("v")) == (4.0, 6.0)
+
+
+def test_missing_values_and_empty_columns():
+    window = RollingWindow(("temperature", "ph"), capacity=4)
+    window.push_values({"temperature": 21.5, "ph": None})
+    window.push_values({"temperature": True, "ph": "n/a"})
+    assert window.count("temperature") == 1
+    assert window.mean("ph") is None and window.min("ph") is None and window.std("ph") is None
+    assert np.array_equal(window.tail("temperature", 5), [21.5, np.nan], equal_nan=True)
+
+
+def test_state_round_trip_rebuilds_stats():
+    window = RollingWindow(("v",), capacity=5)
+    for value in range(12):
+        window.push([float(value)])
+    restored = RollingWindow(("v",), capacity=5)
+    restored.load(window.state())
+    assert restored.pushed == 12
+    assert np.array_equal(restored.snapshot(), window.snapshot())
+    assert (restored.min("v"), restored.max("v"), restored.mean("v")) == (7.0, 11.0, 9.0)
+
+
+def test_store_evicts_least_recently_used_devices():
+    store = RollingWindowStore(max_devices=2)
+    store.define("trust", ("temperature",), 5)
+    a = store.window("a", "trust")
+    store.window("b", "trust")
+    assert store.window("a", "trust") is a  # touches a
+    store.window("c", "trust")
+    assert store.peek("b", "trust") is None
+    assert store.peek("a", "trust") is a
+    assert store.evicted == 1
+    assert store.peek("d", "trust") is None and "d" not in store.export()
+
+
+def test_store_restores_saved_windows_for_new_devices():
+    saved = RollingWindow(("temperature",), 5)
+    saved.push([30.0])
+    store = RollingWindowStore()
+    store.define("trust", ("temperature",), 5)
+    store.restore_hook = lambda device_id: {"trust": saved.state()} if device_id == "a" else None
+    assert store.window("a", "trust").mean("temperature") == 30.0
+    assert len(store.window("b", "trust")) == 0
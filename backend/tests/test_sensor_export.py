@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import models
+from app.services import sensor_export
+
+
+@pytest.fixture
+def readings(db):
+    base = datetime(2026, 1, 1)
+    # Three rows per timestamp, so pages have to break ties on id
+    rows = [
+        models.SensorData(device_id="dev-a" if i % 2 else "dev-b", timestamp=base + timedelta(minutes=i // 3), temperature=float(i))
+        for i in range(25)
+    ]
+    db.add_all(rows)
+    db.commit()
+    return rows
+
+
+def _all_pages(db, limit, **filters):
+    pages, cursor = [], None
+    while True:
+        page, cursor = sensor_export.fetch_page(db, ["id", "temperature"], limit, cursor=cursor, **filters)
+        pages.append(page)
+        if cursor is None:
+            return pages
+
+
+def test_cursor_round_trip():
+    ts = datetime(2026, 3, 4, 5, 6, 7, 890123)
+    cursor = sensor_export.encode_cursor(ts, 42)
+    assert "=" not in cursor
+    assert sensor_export.decode_cursor(cursor) == (ts, 42)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!", "bm8tc2VwYXJhdG9y"])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        sensor_export.decode_cursor(cursor)
+
+
+@pytest.mark.parametrize("descending", [True, False])
+def test_keyset_pages_cover_every_row_once(db, readings, descending):
+    pages = _all_pages(db, 4, descending=descending)
+    ids = [row["id"] for page in pages for row in page]
+    expected = sorted(readings, key=lambda r: (r.timestamp, r.id), reverse=descending)
+    assert ids == [r.id for r in expected]
+    assert [len(page) for page in pages] == [4] * 6 + [1]
+
+
+def test_last_full_page_has_no_cursor(db, readings):
+    page, cursor = sensor_export.fetch_page(db, ["id"], 25)
+    assert len(page) == 25 and cursor is None
+
+
+def test_filters_and_projection(db, readings):
+    start = datetime(2026, 1, 1, 0, 2)
+    pages = _all_pages(db, 3, device_id="dev-a", start=start, end=start + timedelta(minutes=4))
+    rows = [row for page in pages for row in page]
+    expected = [r for r in readings if r.device_id == "dev-a" and start <= r.timestamp < start + timedelta(minutes=4)]
+    assert sorted(row["id"] for row in rows) == sorted(r.id for r in expected)
+    assert all(set(row) == {"id", "temperature"} for row in rows)
+
+
+def test_parse_fields():
+    assert sensor_export.parse_fields("temperature, id,temperature") == ["temperature", "id"]
+    assert sensor_export.parse_fields(None) == list(sensor_export.COLUMNS)
+    with pytest.raises(ValueError):
+        sensor_export.parse_fields("temperature,bogus")
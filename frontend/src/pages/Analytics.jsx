@@ -1,11 +1,37 @@
 import React, { useState, useEffect } from 'react';
-import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer, Cell, AreaChart, Area, LineChart, Line, Legend } from 'recharts';
+import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer, Cell, AreaChart, Area, LineChart, Line, Legend, ComposedChart } from 'recharts';
 import { TrendingUp, TrendingDown, AlertTriangle, ShieldCheck, Activity, Zap, Leaf, Sprout } from 'lucide-react';
 import API_BASE_URL from '../config';
 
 const Analytics = ({ sensorData = [], predictions = [], isProMode = false }) => {
     const [data, setData] = useState([]);
     const [loading, setLoading] = useState(true);
+    const [trend, setTrend] = useState([]);
+
+    useEffect(() => {
+        const fetchTrend = async () => {
+            try {
+                // Last 24h bucketed on the server (rollups / raw aggregation), not raw rows
+                const from = new Date(Date.now() - 24 * 60 * 60 * 1000).toISOString().slice(0, 19);
+                const res = await fetch(`${API_BASE_URL}/api/analytics/aggregate?from=${from}&metric=temperature,humidity&max_points=96`);
+                if (!res.ok) throw new Error("Aggregate Fetch Failed");
+
+                const json = await res.json();
+                const temp = json.series.temperature;
+                const hum = json.series.humidity;
+                setTrend(json.buckets.map((bucket, i) => ({
+                    time: new Date(`${bucket}Z`).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' }),
+                    temperature: temp.mean[i],
+                    tempRange: [temp.min[i], temp.max[i]],
+                    humidity: hum.mean[i]
+                })));
+            } catch (e) {
+                console.error("Failed to fetch trend", e);
+                setTrend([]);
+            }
+        };
+        fetchTrend();
+    }, []);
 
     useEffect(() => {
         const fetchAnalytics = async () => {
@@ -84,6 +110,35 @@ const Analytics = ({ sensorData = [], predictions = [], isProMode = false }) =>
                 </div>
             </div>
 
+            {/* 24h Trend (server-side aggregates) */}
+            <div className="glass-panel p-6 border border-emerald-500/20 rounded-[2rem] bg-emerald-950/20 relative overflow-hidden">
+                <div className="flex items-center gap-3 mb-6">
+                    <Activity size={20} className="text-emerald-400" />
+                    <h3 className="text-lg font-bold text-emerald-100">24H Trend</h3>
+                    <span className="text-[10px] text-emerald-100/40 font-mono uppercase tracking-widest">Mean · Min/Max Band</span>
+                </div>
+                <div className="h-64 w-full">
+                    {trend.length > 0 ? (
+                        <ResponsiveContainer width="100%" height="100%">
+                            <ComposedChart data={trend}>
+                                <CartesianGrid strokeDasharray="3 3" stroke="#064e3b" />
+                                <XAxis dataKey="time" stroke="#34d399" fontSize={10} minTickGap={24} />
+                                <YAxis stroke="#34d399" fontSize={10} domain={['auto', 'auto']} />
+                                <Tooltip contentStyle={{ backgroundColor: '#022c22', borderColor: '#059669', color: '#fff' }} />
+                                <Legend />
+                                <Area type="monotone" dataKey="tempRange" name="Temp Range" stroke="none" fill="#10b981" fillOpacity={0.15} />
+                                <Line type="monotone" dataKey="temperature" name="Temp (avg)" stroke="#10b981" strokeWidth={2} dot={false} />
+                                <Line type="monotone" dataKey="humidity" name="Humidity (avg)" stroke="#38bdf8" strokeWidth={1} dot={false} />
+                            </ComposedChart>
+                        </ResponsiveContainer>
+                    ) : (
+                        <div className="h-full flex items-center justify-center text-slate-500 font-mono text-xs uppercase tracking-widest">
+                            No readings in the last 24 hours
+                        </div>
+                    )}
+                </div>
+            </div>
+
             {/* --- PRO MODE: ADVANCED GRAPHS --- */}
             {isProMode && (
                 <div className="grid grid-cols-1 lg:grid-cols-2 gap-8 animate-in slide-in-from-bottom-5 duration-700 delay-100">